@@ -8,8 +8,6 @@ import base64
 import hashlib
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.concurrency import run_in_threadpool
-import httpx
 from bs4 import BeautifulSoup
 from cryptography.fernet import Fernet
 from urllib.parse import urlparse
@@ -24,6 +22,21 @@ from app.services.rag_service import (
     query_similar,
 )
 from app.services.telemetry import log_event
+from app.services import (
+    gemini_scheduler,
+    http_clients,
+    image_preprocess,
+    model_health,
+    model_router,
+    prompt_cache,
+    response_cache,
+    single_flight,
+    stream_sessions,
+    summary_worker,
+    telemetry,
+    tts_cache,
+    write_behind,
+)
 from app.repositories.chat_repo import get_conversation
 from app.services.memory_service import update_conversation_summary
 
@@ -48,6 +61,30 @@ async def admin_health():
     }
 
 
+# ---------------- Model health ----------------
+@router.get("/models/health")
+async def models_health():
+    """Per-model circuit breaker state, failure rate and latency EWMAs, plus per-task routing stats."""
+    return {"models": model_health.snapshot(), "routing": model_router.snapshot()}
+
+
+@router.get("/metrics")
+async def metrics():
+    """In-process counters (hedging, caches, queues) since the last restart."""
+    return {
+        "counters": telemetry.counters(),
+        "response_cache": response_cache.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "gemini_scheduler": gemini_scheduler.stats(),
+        "image_preprocess": image_preprocess.stats(),
+        "write_behind": write_behind.stats(),
+        "stream_sessions": stream_sessions.stats(),
+        "tts_cache": tts_cache.stats(),
+        "summary_worker": summary_worker.stats(),
+    }
+
+
 # ---------------- KB Stats ----------------
 @router.get("/kb/stats")
 async def kb_stats():
@@ -170,17 +207,16 @@ async def crawl_website(urls: List[str]):
                 # not an IP literal; allow domain (note: DNS-based SSRF not fully mitigated here)
                 pass
 
-            async with httpx.AsyncClient(timeout=20, follow_redirects=True) as client:
-                r = await client.get(url)
-                r.raise_for_status()
-                html = r.text
-                soup = BeautifulSoup(html, "html.parser")
-                if soup.title and soup.title.string:
-                    title = soup.title.string.strip()
-                # Remove script/style
-                for t in soup(["script", "style", "noscript"]):
-                    t.extract()
-                text = (soup.get_text(" ") or "").strip()
+            r = await http_clients.get(http_clients.CRAWL).get(url)
+            r.raise_for_status()
+            html = r.text
+            soup = BeautifulSoup(html, "html.parser")
+            if soup.title and soup.title.string:
+                title = soup.title.string.strip()
+            # Remove script/style
+            for t in soup(["script", "style", "noscript"]):
+                t.extract()
+            text = (soup.get_text(" ") or "").strip()
         except Exception as e:
             return {"url": url, "error": str(e), "chunks": 0}
 
@@ -492,7 +528,7 @@ async def test_connection(service: str = Query(...)):
         try:
             # Attempt a tiny embed call
             from app.services.rag_service import _embed_text  # reuse
-            _ = await run_in_threadpool(_embed_text, "hello")
+            _ = await _embed_text("hello")
             return {"ok": True}
         except Exception as e:
             return {"ok": False, "error": str(e)}
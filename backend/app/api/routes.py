@@ -1,8 +1,15 @@
+import asyncio
 import base64
-from fastapi import APIRouter, Response, UploadFile, File, Form, Depends
-from fastapi.responses import StreamingResponse
+import json
+import os
+import uuid
+from pathlib import Path
+from contextlib import aclosing
+from typing import AsyncIterator, Optional, Tuple, Union
+
+from fastapi import APIRouter, Body, HTTPException, Request, Response, UploadFile, File, Form, Depends
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
-import google.generativeai as genai
 
 from app.core.config import settings
 from app.core.auth import require_auth
@@ -15,73 +22,101 @@ from app.models.schema import (
     ChatVoiceRequest,
 )
 from app.services.gemini_service import generate_reply, stream_reply, summarize_image, ask_about_file
+from app.services import model_catalog, response_cache, stream_sessions, summary_worker, tts_cache, tts_service, voice_pipeline, write_behind
 from app.services.web_search_service import search_web
 from app.services.rag_service import upsert_document, query_similar, ingest_pdf_bytes
 from app.services.telemetry import log_event
-from app.services.memory_service import get_memory_text, update_conversation_summary
+from app.services.memory_service import get_memory_text
 from app.services.archive_service import archive_messages
 from app.services.tts_service import synthesize as tts_synthesize
 from app.repositories.chat_repo import (
     ensure_conversation,
     add_message,
+    add_messages,
     list_conversations,
     get_conversation,
     delete_conversation,
+    start_turn,
 )
 
 router = APIRouter(dependencies=[Depends(require_auth)])
 
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest) -> ChatResponse:
-    """Chat endpoint: accepts a message and returns the AI reply.
+def _cache_enabled(request: ChatRequest) -> bool:
+    """Per-request response cache opt-out; live web results are never served from cache."""
+    if request.cache is False:
+        return False
+    return (request.tool or "").lower() != "web_search"
 
-    Persists user/assistant messages under a conversation.
-    """
-    # Ensure conversation exists (create when missing)
-    conv_id = await ensure_conversation(request.conversation_id, request.message, user_key=request.user_key)
-    # Store user message first so it becomes part of the history
-    await add_message(conv_id, "user", request.message)
-
-    # Load conversation history (ordered oldest->newest)
-    _conv, msgs = await get_conversation(conv_id)
 
-    # Optional simple tool-calling: rag_search
-    # Compose the user message with global memory (profile + summaries)
-    mem_txt = await get_memory_text(request.user_key)
-    user_message = request.message
-    if mem_txt:
-        user_message = f"Use the user's profile and prior summaries to personalize and remain consistent.\n{mem_txt}\n\nQuestion: {request.message}"
+async def _tool_context(request: ChatRequest) -> Optional[str]:
+    """Context block from the optional pre-LLM tool (rag_search / web_search), or None."""
     tool = (request.tool or "").lower()
+    args = request.tool_args or {}
     if tool == "rag_search":
         try:
-            hits = await query_similar(request.tool_args.get("query", user_message), k=request.tool_args.get("k", 5))
+            hits = await query_similar(args.get("query", request.message), k=args.get("k", 5))
             context = "\n\n".join([f"[doc {i+1} score={h.get('score',0):.3f}] {h.get('text','')}" for i, h in enumerate(hits)])
-            user_message = f"Use the following context to answer.\n{context}\n\nQuestion: {user_message}"
+            return f"Use the following context to answer.\n{context}"
         except Exception:
-            pass
-    elif tool == "web_search":
+            return None
+    if tool == "web_search":
         try:
-            q = (request.tool_args or {}).get("query", user_message)
-            k = int((request.tool_args or {}).get("k", 5))
+            q = args.get("query", request.message)
+            k = int(args.get("k", 5))
             results = await run_in_threadpool(search_web, q, k, False)
             context = "\n\n".join([f"[web {i+1}] {r.get('title','')} - {r.get('url','')}\n{r.get('snippet','')}" for i, r in enumerate(results)])
-            user_message = f"Use the following web results if relevant.\n{context}\n\nQuestion: {user_message}"
+            return f"Use the following web results if relevant.\n{context}"
         except Exception:
-            pass
+            return None
+    return None
+
+
+async def _chat_prelude(request: ChatRequest, tools: bool = True) -> Tuple[str, list, str]:
+    """Store the user's message and build the prompt; returns (conversation_id, history, message).
+
+    The conversation/message writes with the history read, the memory lookup and the
+    tool retrieval are independent, so they run concurrently and the prelude takes as
+    long as the slowest of them. Tool queries default to the raw user message.
+    """
+    async def _no_tool() -> Optional[str]:
+        return None
+
+    (conv_id, msgs), mem_txt, tool_txt = await asyncio.gather(
+        start_turn(request.conversation_id, request.message, user_key=request.user_key),
+        get_memory_text(request.user_key),
+        _tool_context(request) if tools else _no_tool(),
+    )
+    user_message = request.message
+    if mem_txt:
+        user_message = f"Use the user's profile and prior summaries to personalize and remain consistent.\n{mem_txt}\n\nQuestion: {request.message}"
+    if tool_txt:
+        user_message = f"{tool_txt}\n\nQuestion: {user_message}"
+    return conv_id, msgs, user_message
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest) -> ChatResponse:
+    """Chat endpoint: accepts a message and returns the AI reply.
 
-    # Generate AI reply with conversation context (offload to thread if SDK is blocking)
-    reply, model, quality = await run_in_threadpool(
-        generate_reply, user_message, request.quality, history=msgs
+    Persists user/assistant messages under a conversation.
+    """
+    # Conversation upsert + user message + history, memory and tool context run concurrently
+    conv_id, msgs, user_message = await _chat_prelude(request)
+
+    # Generate AI reply with conversation context
+    reply, model, quality = await generate_reply(
+        user_message,
+        request.quality,
+        history=msgs,
+        cache=_cache_enabled(request),
+        cache_scope=response_cache.scope_for(request.user_key, conv_id),
     )
 
     # Store assistant message
     await add_message(conv_id, "assistant", reply)
-    # Update conversation summary for cross-conversation memory
-    try:
-        await update_conversation_summary(conv_id, request.user_key)
-    except Exception:
-        pass
+    # Refresh the conversation summary (cross-conversation memory) in the background
+    summary_worker.request(conv_id, request.user_key, messages=2)
 
     # Telemetry (best-effort)
     try:
@@ -93,62 +128,126 @@ async def chat(request: ChatRequest) -> ChatResponse:
 
 
 @router.get("/models")
-def list_models():
+async def list_models():
     """List available Gemini models that support text generation."""
     if not settings.GEMINI_API_KEY:
         return {"models": [], "error": "GEMINI_API_KEY not configured"}
-    try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        names = []
-        for m in genai.list_models():
-            methods = getattr(m, "supported_generation_methods", []) or []
-            if "generateContent" in methods or "createContent" in methods:
-                name = getattr(m, "name", "") or ""
-                if name.startswith("models/"):
-                    name = name.split("/", 1)[1]
-                if name:
-                    names.append(name)
-        names = sorted(set(names))
-        return {"models": names}
-    except Exception as e:
-        return {"models": [], "error": str(e)}
+    return model_catalog.snapshot()
 
 
-@router.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
-    """Server-Sent Events streaming endpoint for token-by-token replies."""
-    # Ensure conversation exists and store the user's message
-    conv_id = await ensure_conversation(request.conversation_id, request.message, user_key=request.user_key)
-    await add_message(conv_id, "user", request.message)
-    _conv, msgs = await get_conversation(conv_id)
-
-    # Precompute memory text here to avoid blocking inside generator
-    mem_txt_local = await get_memory_text(request.user_key)
-    message_with_mem = request.message
-    if mem_txt_local:
-        message_with_mem = f"Use the user's profile and prior summaries to personalize and remain consistent.\n{mem_txt_local}\n\nQuestion: {request.message}"
-
-    def _event_gen():
-        accum = []
-        try:
-            for chunk in stream_reply(message_with_mem, request.quality, history=msgs):
-                accum.append(chunk)
-                yield f"data: {chunk}\n\n"
-        finally:
-            # Persist assistant message and log telemetry (best-effort)
+def _sse_data(chunk: str, event_id: Optional[str] = None) -> str:
+    """Format one SSE event; multi-line chunks become one `data:` line per line."""
+    head = f"id: {event_id}\n" if event_id else ""
+    return head + "".join(f"data: {line}\n" for line in chunk.split("\n")) + "\n"
+
+
+async def _wait_for_disconnect(http_request: Request) -> None:
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _sse_events(
+    http_request: Request, chunks: AsyncIterator[Union[str, Tuple[str, str]]]
+) -> AsyncIterator[str]:
+    """Relay `chunks` (text, or (event id, text)) as SSE events with keep-alives and disconnect cancellation.
+
+    The next chunk is only requested after the previous one was handed to the server,
+    so a slow client slows the upstream read instead of buffering it. A ": keep-alive"
+    comment is sent after SSE_KEEPALIVE_S of silence. When the client disconnects,
+    `chunks` is closed (for a resumable stream this starts its grace period).
+    """
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(http_request))
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(chunks.__anext__())
+            done, _ = await asyncio.wait({pending, disconnect}, timeout=settings.SSE_KEEPALIVE_S, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                break
+            if pending not in done:
+                yield ": keep-alive\n\n"
+                continue
             try:
-                final_text = "".join(accum).strip()
-                if final_text:
-                    # Store assistant message
-                    import asyncio
-                    loop = asyncio.get_event_loop()
-                    loop.create_task(add_message(conv_id, "assistant", final_text))
-                    loop.create_task(update_conversation_summary(conv_id, request.user_key))
-                    loop.create_task(log_event("chat_stream", {"conv": conv_id, "reply_len": len(final_text)}))
-            except Exception:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            if isinstance(chunk, tuple):
+                yield _sse_data(chunk[1], event_id=chunk[0])
+            else:
+                yield _sse_data(chunk)
+    finally:
+        disconnect.cancel()
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
                 pass
+        await chunks.aclose()
 
-    return StreamingResponse(_event_gen(), media_type="text/event-stream")
+
+@router.post("/chat/stream")
+async def chat_stream(http_request: Request, request: Optional[ChatRequest] = Body(None)):
+    """Server-Sent Events streaming endpoint for token-by-token replies.
+
+    Events carry ids; a client that reconnects with `Last-Event-ID` gets the rest of
+    the same reply (buffered tail, then live) instead of a new generation. The body
+    is only required when starting a new reply. A resumed reply that was cut short
+    (generation cancelled or failed) carries an `X-Stream-Incomplete: 1` header.
+    """
+    resume = stream_sessions.parse_event_id(http_request.headers.get("last-event-id"))
+    if resume is not None:
+        stream_id, offset = resume
+        session = stream_sessions.get(stream_id)
+        if session is not None:
+            headers = {"X-Stream-Id": stream_id}
+            if session.done and not session.finished:
+                headers["X-Stream-Incomplete"] = "1"
+            return StreamingResponse(
+                _sse_events(http_request, stream_sessions.follow(session, offset)),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+        tail = await stream_sessions.checkpoint_tail(stream_id, offset)
+        if tail is None:
+            raise HTTPException(status_code=410, detail="Stream expired; send the message again")
+
+        tail_id, tail_text, finished = tail
+
+        async def _tail():
+            if tail_text:
+                yield tail_id, tail_text
+
+        headers = {"X-Stream-Id": stream_id, **({} if finished else {"X-Stream-Incomplete": "1"})}
+        return StreamingResponse(_sse_events(http_request, _tail()), media_type="text/event-stream", headers=headers)
+    if request is None:
+        raise HTTPException(status_code=422, detail="Request body is required unless resuming with Last-Event-ID")
+
+    # Store the user's message and precompute the memory-augmented prompt (concurrently)
+    conv_id, msgs, message_with_mem = await _chat_prelude(request, tools=False)
+
+    def _persist(reply_text: str) -> None:
+        # Persist through the write-behind queue: batched, retried and drained on shutdown
+        final_text = reply_text.strip()
+        if final_text:
+            write_behind.enqueue_message(conv_id, "assistant", final_text)
+            write_behind.enqueue_summary(conv_id, request.user_key)
+            write_behind.enqueue_event("chat_stream", {"conv": conv_id, "reply_len": len(final_text)})
+
+    # Generation runs detached from this connection so a reconnect can pick it up
+    session = stream_sessions.start(
+        stream_reply(message_with_mem, request.quality, history=msgs), on_finish=_persist, conversation_id=conv_id
+    )
+    return StreamingResponse(
+        _sse_events(http_request, stream_sessions.follow(session)),
+        media_type="text/event-stream",
+        headers={"X-Stream-Id": session.id},
+    )
 
 
 @router.post("/rag/upsert")
@@ -193,62 +292,116 @@ async def rag_ingest_pdf(
 
 
 # ---------- TTS endpoints ----------
+class _CachedAudioResponse(FileResponse):
+    """FileResponse for a pinned tts_cache entry; releases the pin however sending ends."""
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await tts_cache.release(Path(self.path))
+
+
 @router.post("/tts")
 async def tts(body: TTSRequest):
-    """Return synthesized speech audio (audio/mpeg) for given text and voice."""
+    """Return synthesized speech audio (audio/mpeg) for given text and voice.
+
+    Inputs over TTS_LONG_TEXT_CHARS are streamed: split at paragraph/sentence
+    boundaries, synthesized concurrently and sent in order as each chunk is ready.
+    """
+    mime = tts_service.mime_for(body.output)
+    cached = await tts_service.acquire_cached_audio(body.text, voice_id=body.voice_id, model=body.model, output=body.output)
+    if cached is not None:
+        try:
+            stat = await asyncio.to_thread(os.stat, cached)
+        except OSError:
+            # Removed from disk behind the cache's back; synthesize it again below
+            await tts_cache.release(cached)
+        else:
+            # Pinned until sent, so eviction cannot unlink it before the server opens it
+            return _CachedAudioResponse(cached, media_type=mime, stat_result=stat)
+    if settings.TTS_LONG_TEXT_CHARS and len(body.text) > settings.TTS_LONG_TEXT_CHARS:
+        # Long input: synthesize chunks concurrently, stream them in order from the first one
+        events = voice_pipeline.speak_text(body.text, voice_id=body.voice_id, model=body.model, output=body.output)
+        try:
+            first = await _next_audio(events)
+        except BaseException:
+            await events.aclose()
+            raise
+        return StreamingResponse(_audio_only(first, events), media_type=mime)
     audio = await tts_synthesize(
         text=body.text,
         voice_id=body.voice_id,
         model=body.model,
         output=body.output,
     )
-    return Response(content=audio, media_type="audio/mpeg")
+    return Response(content=audio, media_type=mime)
+
+
+async def _next_audio(events: AsyncIterator[tuple]) -> bytes:
+    """Audio bytes of the next AUDIO event (b"" at the end); a synthesis error raises 502."""
+    async for kind, _seq, value in events:
+        if kind == voice_pipeline.AUDIO:
+            return value
+        if kind == voice_pipeline.ERROR:
+            raise HTTPException(status_code=502, detail={"msg": "TTS failed", "error": value})
+    return b""
+
+
+async def _audio_only(first: bytes, events: AsyncIterator[tuple]) -> AsyncIterator[bytes]:
+    try:
+        if first:
+            yield first
+        while True:
+            chunk = await _next_audio(events)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await events.aclose()
 
 
 @router.post("/chat/voice")
 async def chat_voice(request: ChatVoiceRequest):
-    """Generate a chat reply and return audio as base64 along with text reply."""
-    # Ensure conversation and store user message
-    conv_id = await ensure_conversation(request.conversation_id, request.message, user_key=request.user_key)
-    await add_message(conv_id, "user", request.message)
-    _conv, msgs = await get_conversation(conv_id)
-
-    # Compose memory
-    mem_txt = await get_memory_text(request.user_key)
-    user_message = request.message
-    if mem_txt:
-        user_message = f"Use the user's profile and prior summaries to personalize and remain consistent.\n{mem_txt}\n\nQuestion: {request.message}"
+    """Generate a chat reply and return audio as base64 along with text reply.
 
-    # Optional tools
-    tool = (request.tool or "").lower()
-    if tool == "rag_search":
-        try:
-            hits = await query_similar(request.tool_args.get("query", user_message), k=request.tool_args.get("k", 5))
-            context = "\n\n".join([f"[doc {i+1} score={h.get('score',0):.3f}] {h.get('text','')}" for i, h in enumerate(hits)])
-            user_message = f"Use the following context to answer.\n{context}\n\nQuestion: {user_message}"
-        except Exception:
-            pass
-    elif tool == "web_search":
-        try:
-            q = (request.tool_args or {}).get("query", user_message)
-            k = int((request.tool_args or {}).get("k", 5))
-            results = search_web(q, k=k, fetch_pages=False)
-            context = "\n\n".join([f"[web {i+1}] {r.get('title','')} - {r.get('url','')}\n{r.get('snippet','')}" for i, r in enumerate(results)])
-            user_message = f"Use the following web results if relevant.\n{context}\n\nQuestion: {user_message}"
-        except Exception:
-            pass
+    With `transport="multipart"` the response is multipart/mixed instead: a JSON part
+    with the reply and ids, then the audio streamed straight from the TTS response.
+    """
+    conv_id, msgs, user_message = await _chat_prelude(request)
 
     # LLM reply
-    reply, model, quality = await run_in_threadpool(
-        generate_reply, user_message, request.quality, history=msgs
+    reply, model, quality = await generate_reply(
+        user_message,
+        request.quality,
+        history=msgs,
+        cache=_cache_enabled(request),
+        cache_scope=response_cache.scope_for(request.user_key, conv_id),
     )
 
-    # Persist assistant reply and update summary
+    # Persist assistant reply; the summary is refreshed in the background
     await add_message(conv_id, "assistant", reply)
-    try:
-        await update_conversation_summary(conv_id, request.user_key)
-    except Exception:
-        pass
+    summary_worker.request(conv_id, request.user_key, messages=2)
+
+    meta = {"reply": reply, "model": model, "quality": quality, "conversation_id": conv_id}
+    mime = tts_service.mime_for(request.tts_output)
+
+    if request.transport == "multipart":
+        # Relay the TTS response as it arrives: no base64 and no full copy in memory
+        audio = tts_service.synthesize_stream(reply, voice_id=request.voice_id, model=request.tts_model, output=request.tts_output)
+        try:
+            # Pull the first chunk now so a TTS failure is still a proper error response
+            first = await audio.__anext__()
+        except StopAsyncIteration:
+            first = b""
+        except BaseException:
+            await audio.aclose()
+            raise
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(
+            _multipart_audio(boundary, meta, mime, first, audio),
+            media_type=f"multipart/mixed; boundary={boundary}",
+        )
 
     # Synthesize audio
     audio_bytes = await tts_synthesize(
@@ -260,15 +413,70 @@ async def chat_voice(request: ChatVoiceRequest):
     audio_b64 = base64.b64encode(audio_bytes).decode("ascii")
 
     return {
-        "reply": reply,
-        "model": model,
-        "quality": quality,
-        "conversation_id": conv_id,
+        **meta,
         "audio_base64": audio_b64,
-        "audio_mime": "audio/mpeg",
+        "audio_mime": mime,
     }
 
 
+async def _multipart_audio(boundary: str, meta: dict, mime: str, first: bytes, audio: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """multipart/mixed body: a JSON part with `meta`, then one audio part streamed chunk by chunk."""
+    try:
+        yield f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode("ascii")
+        yield json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\r\n"
+        yield f"--{boundary}\r\nContent-Type: {mime}\r\n\r\n".encode("ascii")
+        if first:
+            yield first
+        async for chunk in audio:
+            yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode("ascii")
+    finally:
+        await audio.aclose()
+
+
+@router.post("/chat/voice/stream")
+async def chat_voice_stream(request: ChatVoiceRequest):
+    """Stream a spoken reply as NDJSON: each sentence's text, then its audio chunks.
+
+    Sentences are synthesized while the LLM is still generating, so the first audio
+    arrives after roughly one sentence of generation plus one TTS round trip. Lines:
+    {"type": "text", "seq", "text"}, {"type": "audio", "seq", "mime", "audio_base64"},
+    {"type": "error", "seq", "error"} and a final {"type": "done", "conversation_id"}.
+    """
+    tts_service.resolve_voice(request.voice_id)
+    conv_id, msgs, user_message = await _chat_prelude(request)
+    mime = tts_service.mime_for(request.tts_output)
+    raw: list[str] = []
+
+    async def _reply():
+        async with aclosing(stream_reply(user_message, request.quality, history=msgs)) as chunks:
+            async for chunk in chunks:
+                raw.append(chunk)
+                yield chunk
+
+    async def _events():
+        try:
+            speech = voice_pipeline.speak(_reply(), voice_id=request.voice_id, model=request.tts_model, output=request.tts_output)
+            async with aclosing(speech):
+                async for kind, seq, value in speech:
+                    if kind == voice_pipeline.TEXT:
+                        line = {"type": "text", "seq": seq, "text": value}
+                    elif kind == voice_pipeline.AUDIO:
+                        line = {"type": "audio", "seq": seq, "mime": mime, "audio_base64": base64.b64encode(value).decode("ascii")}
+                    else:
+                        line = {"type": "error", "seq": seq, "error": value}
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "done", "conversation_id": conv_id}) + "\n"
+        finally:
+            final_text = "".join(raw).strip()
+            if final_text:
+                write_behind.enqueue_message(conv_id, "assistant", final_text)
+                write_behind.enqueue_summary(conv_id, request.user_key)
+                write_behind.enqueue_event("chat_voice_stream", {"conv": conv_id, "reply_len": len(final_text)})
+
+    return StreamingResponse(_events(), media_type="application/x-ndjson")
+
+
 # ---------- Vision endpoints ----------
 @router.post("/vision/summarize")
 async def vision_summarize(
@@ -299,17 +507,91 @@ async def vision_summarize(
     user_text = (prompt or "Summarize this image").strip()
     await add_message(conv_id, "user", f"[Image] {display_name} ({mime})\nInstruction: {user_text}")
 
-    summary, model, q_used = await run_in_threadpool(summarize_image, data, mime, prompt, quality)
+    summary, model, q_used = await summarize_image(data, mime, prompt, quality)
 
     await add_message(conv_id, "assistant", summary)
-    try:
-        await update_conversation_summary(conv_id, user_key)
-    except Exception:
-        pass
+    summary_worker.request(conv_id, user_key, messages=2)
 
     return {"summary": summary, "model": model, "quality": q_used, "conversation_id": conv_id}
 
 
+@router.post("/vision/summarize/batch")
+async def vision_summarize_batch(
+    files: list[UploadFile] = File(...),
+    prompt: str | None = Form(None),
+    quality: str | None = Form(None),
+    conversation_id: str | None = Form(None),
+    user_key: str | None = Form(None),
+):
+    """Summarize many images in one request, streaming results as NDJSON.
+
+    Images are summarized concurrently (at most VISION_BATCH_CONCURRENCY at a time).
+    One JSON line is sent per image as soon as it completes:
+    {"index", "filename", "summary", "model", "quality", "conversation_id"} or
+    {"index", "filename", "error", "conversation_id"}, followed by a final
+    {"done": true, "conversation_id", "count", "failed"} line. Successful exchanges are
+    saved to one conversation, in upload order, with a single batched insert once the
+    stream ends (also when the client disconnects early, for the images already done);
+    failures only appear in the NDJSON output.
+
+    Form fields are the same as /vision/summarize, with `files` repeated per image.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No images uploaded.")
+    if len(files) > settings.VISION_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.VISION_BATCH_MAX_FILES} images per batch.")
+    items = []
+    for i, f in enumerate(files):
+        items.append((getattr(f, "filename", None) or f"image {i + 1}", f.content_type or "image/png", await f.read()))
+
+    user_text = (prompt or "Summarize this image").strip()
+    conv_id = await ensure_conversation(conversation_id, prompt or f"{len(items)} images", user_key=user_key)
+    sem = asyncio.Semaphore(max(1, settings.VISION_BATCH_CONCURRENCY))
+
+    async def _one(index: int, name: str, mime: str, data: bytes) -> dict:
+        async with sem:
+            try:
+                summary, model, q_used = await summarize_image(data, mime, prompt, quality)
+                return {"index": index, "filename": name, "summary": summary, "model": model, "quality": q_used}
+            except HTTPException as e:
+                return {"index": index, "filename": name, "error": str(e.detail)}
+            except Exception as e:
+                return {"index": index, "filename": name, "error": str(e)}
+
+    async def _save(done: list[dict]) -> None:
+        messages = []
+        for r in sorted(done, key=lambda r: r["index"]):
+            name, mime, _ = items[r["index"]]
+            messages.append(("user", f"[Image] {name} ({mime})\nInstruction: {user_text}"))
+            messages.append(("assistant", r["summary"]))
+        try:
+            await add_messages(conv_id, messages)
+        except Exception:
+            return
+        summary_worker.request(conv_id, user_key, messages=len(messages))
+
+    async def _stream():
+        tasks = [asyncio.ensure_future(_one(i, name, mime, data)) for i, (name, mime, data) in enumerate(items)]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                r = await next_done
+                failed += "summary" not in r
+                yield json.dumps({**r, "conversation_id": conv_id}, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away: stop summarizing images nobody will see
+            for t in tasks:
+                t.cancel()
+            done = [t.result() for t in tasks if t.done() and not t.cancelled() and "summary" in t.result()]
+            if done:
+                # One insert for the whole batch; shielded so a disconnect cannot drop
+                # answers that were already paid for
+                await asyncio.shield(_save(done))
+        yield json.dumps({"done": True, "conversation_id": conv_id, "count": len(items), "failed": failed}) + "\n"
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
 @router.post("/files/ask")
 async def files_ask(
     file: UploadFile = File(...),
@@ -337,14 +619,11 @@ async def files_ask(
     user_text = (prompt or "Summarize this document").strip()
     await add_message(conv_id, "user", f"[File] {display_name} ({mime})\nQuestion: {user_text}")
 
-    answer, model, q_used = await run_in_threadpool(ask_about_file, data, mime, prompt, quality)
+    answer, model, q_used = await ask_about_file(data, mime, prompt, quality)
 
-    # Store assistant message and update summary (best-effort)
+    # Store assistant message; the summary is refreshed in the background
     await add_message(conv_id, "assistant", answer)
-    try:
-        await update_conversation_summary(conv_id, user_key)
-    except Exception:
-        pass
+    summary_worker.request(conv_id, user_key, messages=2)
 
     return {"answer": answer, "model": model, "quality": q_used, "conversation_id": conv_id}
 
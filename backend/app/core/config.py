@@ -39,9 +39,154 @@ class Settings:
         # Memory / context window for chat (number of recent turns kept)
         self.MEMORY_MAX_MESSAGES: int = int(os.getenv("MEMORY_MAX_MESSAGES", "30"))
 
+        # Token budget for prior turns sent with each prompt, per quality tier
+        self.HISTORY_TOKEN_BUDGET_LOW: int = int(os.getenv("HISTORY_TOKEN_BUDGET_LOW", "2000"))
+        self.HISTORY_TOKEN_BUDGET_MEDIUM: int = int(os.getenv("HISTORY_TOKEN_BUDGET_MEDIUM", "6000"))
+        self.HISTORY_TOKEN_BUDGET_HIGH: int = int(os.getenv("HISTORY_TOKEN_BUDGET_HIGH", "12000"))
+        # Optional per-model overrides by name prefix, e.g. "gemini-1.5-flash=4000,gemini-1.5-pro=16000"
+        self.HISTORY_TOKEN_BUDGET_MODELS: str = os.getenv("HISTORY_TOKEN_BUDGET_MODELS", "")
+
         # Streaming toggle (for SSE endpoint)
         self.STREAMING_ENABLED: bool = os.getenv("STREAMING_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
 
+        # Model catalog: how long the cached list_models result is fresh (seconds)
+        self.MODEL_CATALOG_TTL_S: float = float(os.getenv("MODEL_CATALOG_TTL_S", "600"))
+        # Max time startup waits for the first list_models call
+        self.MODEL_CATALOG_WARM_TIMEOUT_S: float = float(os.getenv("MODEL_CATALOG_WARM_TIMEOUT_S", "10"))
+
+        # Model health registry / circuit breakers for the Gemini fallback chain
+        # Consecutive failures before a model's breaker opens
+        self.MODEL_BREAKER_FAILURES: int = int(os.getenv("MODEL_BREAKER_FAILURES", "3"))
+        # Seconds an open breaker skips the model before allowing a probe call
+        self.MODEL_BREAKER_COOLDOWN_S: float = float(os.getenv("MODEL_BREAKER_COOLDOWN_S", "30"))
+        # Longer cool-down for models the API reports as not found (404)
+        self.MODEL_NOT_FOUND_COOLDOWN_S: float = float(os.getenv("MODEL_NOT_FOUND_COOLDOWN_S", "600"))
+        # Smoothing factor for failure-rate and latency EWMAs (0..1, higher = more reactive)
+        self.MODEL_HEALTH_EWMA_ALPHA: float = float(os.getenv("MODEL_HEALTH_EWMA_ALPHA", "0.2"))
+        # Failure-rate EWMA above which a model is tried after healthier ones
+        self.MODEL_HEALTH_DEGRADED_RATE: float = float(os.getenv("MODEL_HEALTH_DEGRADED_RATE", "0.5"))
+
+        # Recent latencies kept per model for percentile estimates
+        self.MODEL_LATENCY_SAMPLES: int = int(os.getenv("MODEL_LATENCY_SAMPLES", "200"))
+
+        # Hedged requests: race the next-best model when the primary is slow
+        self.HEDGING_ENABLED: bool = os.getenv("HEDGING_ENABLED", "false").lower() in {"1", "true", "yes", "y"}
+        # Hedge after the primary exceeds this latency percentile (0..1) of its recent calls
+        self.HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+        # Delay used until the primary has HEDGE_MIN_SAMPLES successful calls
+        self.HEDGE_DELAY_MS: int = int(os.getenv("HEDGE_DELAY_MS", "2500"))
+        self.HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+        # Clamp for the percentile-derived delay
+        self.HEDGE_MIN_DELAY_MS: int = int(os.getenv("HEDGE_MIN_DELAY_MS", "300"))
+        self.HEDGE_MAX_DELAY_MS: int = int(os.getenv("HEDGE_MAX_DELAY_MS", "8000"))
+
+        # Outbound Gemini scheduler: concurrency caps, per-minute buckets and priority queues
+        self.GEMINI_MAX_CONCURRENCY_PER_KEY: int = int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_KEY", "16"))
+        self.GEMINI_MAX_CONCURRENCY_PER_MODEL: int = int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_MODEL", "8"))
+        # Requests / tokens per minute per model (0 = unlimited)
+        self.GEMINI_RPM: int = int(os.getenv("GEMINI_RPM", "0"))
+        self.GEMINI_TPM: int = int(os.getenv("GEMINI_TPM", "0"))
+        # Per-model overrides by name prefix, e.g. "gemini-1.5-pro=2,gemini-1.5-flash=15"
+        self.GEMINI_MODEL_CONCURRENCY: str = os.getenv("GEMINI_MODEL_CONCURRENCY", "")
+        self.GEMINI_MODEL_RPM: str = os.getenv("GEMINI_MODEL_RPM", "")
+        self.GEMINI_MODEL_TPM: str = os.getenv("GEMINI_MODEL_TPM", "")
+        # Longest a request waits for capacity before failing
+        self.GEMINI_QUEUE_TIMEOUT_S: float = float(os.getenv("GEMINI_QUEUE_TIMEOUT_S", "60"))
+
+        # Latency-aware routing within a quality tier, learned from call telemetry
+        self.ROUTER_ENABLED: bool = os.getenv("ROUTER_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
+        # Per-task latency SLO in ms (stream = time to first chunk)
+        self.ROUTER_SLO_MS: str = os.getenv("ROUTER_SLO_MS", "text=4000,stream=1500,vision=8000,file=12000")
+        # Latency percentile (0..1) compared against the SLO
+        self.ROUTER_SLO_PERCENTILE: float = float(os.getenv("ROUTER_SLO_PERCENTILE", "0.9"))
+        # A model also misses its SLO when its error-rate EWMA exceeds this
+        self.ROUTER_MAX_ERROR_RATE: float = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.2"))
+        # Samples needed before a model is judged, and how long they stay valid
+        self.ROUTER_MIN_SAMPLES: int = int(os.getenv("ROUTER_MIN_SAMPLES", "10"))
+        self.ROUTER_STALE_S: float = float(os.getenv("ROUTER_STALE_S", "1800"))
+        # Telemetry replayed at startup to seed the statistics
+        self.ROUTER_SEED_HOURS: float = float(os.getenv("ROUTER_SEED_HOURS", "24"))
+        self.ROUTER_SEED_MAX_EVENTS: int = int(os.getenv("ROUTER_SEED_MAX_EVENTS", "5000"))
+
+        # Response cache in front of generate_reply (exact + semantic tiers)
+        self.RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
+        self.RESPONSE_CACHE_TTL_S: float = float(os.getenv("RESPONSE_CACHE_TTL_S", "3600"))
+        self.RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+        # Partition cached replies: global | user | conversation
+        self.RESPONSE_CACHE_SCOPE: str = os.getenv("RESPONSE_CACHE_SCOPE", "user")
+        # Semantic tier costs one embedding call per miss, so it is opt-in
+        self.RESPONSE_CACHE_SEMANTIC_ENABLED: bool = os.getenv("RESPONSE_CACHE_SEMANTIC_ENABLED", "false").lower() in {"1", "true", "yes", "y"}
+        # Minimum cosine similarity for a semantic hit
+        self.RESPONSE_CACHE_SEMANTIC_THRESHOLD: float = float(os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+        self.RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES", "500"))
+
+        # Prompt prefix (context) caching: off | gemini | local (offline stand-in)
+        self.PROMPT_CACHE_BACKEND: str = os.getenv("PROMPT_CACHE_BACKEND", "off")
+        # Prefixes below this estimated size are sent inline (Gemini enforces a minimum)
+        self.PROMPT_CACHE_MIN_TOKENS: int = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "4096"))
+        self.PROMPT_CACHE_TTL_S: float = float(os.getenv("PROMPT_CACHE_TTL_S", "3600"))
+        # Recreate a cached prefix when it has less than this many seconds left
+        self.PROMPT_CACHE_REFRESH_MARGIN_S: float = float(os.getenv("PROMPT_CACHE_REFRESH_MARGIN_S", "60"))
+        # Newest messages always sent inline; the cached prefix grows in blocks of N messages
+        self.PROMPT_CACHE_TAIL_MESSAGES: int = int(os.getenv("PROMPT_CACHE_TAIL_MESSAGES", "2"))
+        self.PROMPT_CACHE_BLOCK_MESSAGES: int = int(os.getenv("PROMPT_CACHE_BLOCK_MESSAGES", "8"))
+        self.PROMPT_CACHE_MAX_ENTRIES: int = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "256"))
+        # Back-off after a model refuses cache creation
+        self.PROMPT_CACHE_RETRY_S: float = float(os.getenv("PROMPT_CACHE_RETRY_S", "600"))
+
+        # Gemini Files API uploads (ask_about_file): handles reused per content hash
+        # Remote files live 48h; reuse them for at most this long
+        self.FILE_UPLOAD_TTL_S: float = float(os.getenv("FILE_UPLOAD_TTL_S", str(47 * 3600)))
+        self.FILE_UPLOAD_REFRESH_MARGIN_S: float = float(os.getenv("FILE_UPLOAD_REFRESH_MARGIN_S", "300"))
+        self.FILE_UPLOAD_CACHE_MAX: int = int(os.getenv("FILE_UPLOAD_CACHE_MAX", "256"))
+        # Readiness polling: exponential backoff from INITIAL to MAX seconds, up to TIMEOUT overall
+        self.FILE_READY_POLL_INITIAL_S: float = float(os.getenv("FILE_READY_POLL_INITIAL_S", "0.25"))
+        self.FILE_READY_POLL_MAX_S: float = float(os.getenv("FILE_READY_POLL_MAX_S", "4"))
+        self.FILE_READY_TIMEOUT_S: float = float(os.getenv("FILE_READY_TIMEOUT_S", "30"))
+
+        # Image preprocessing before vision calls (downscale, strip metadata, re-encode)
+        self.IMAGE_PREPROCESS_ENABLED: bool = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
+        # Longest image side in pixels sent per quality tier
+        self.IMAGE_MAX_SIDE_LOW: int = int(os.getenv("IMAGE_MAX_SIDE_LOW", "1024"))
+        self.IMAGE_MAX_SIDE_MEDIUM: int = int(os.getenv("IMAGE_MAX_SIDE_MEDIUM", "1536"))
+        self.IMAGE_MAX_SIDE_HIGH: int = int(os.getenv("IMAGE_MAX_SIDE_HIGH", "2048"))
+        # Output format: webp | jpeg | png, and lossy quality (1..100)
+        self.IMAGE_FORMAT: str = os.getenv("IMAGE_FORMAT", "webp")
+        self.IMAGE_QUALITY: int = int(os.getenv("IMAGE_QUALITY", "80"))
+        # Process pool size (0 = min(4, CPUs)) and processed-image cache size
+        self.IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "0"))
+        self.IMAGE_CACHE_MAX_BYTES: int = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+        # Seconds of upstream silence before an SSE keep-alive comment is sent
+        self.SSE_KEEPALIVE_S: float = float(os.getenv("SSE_KEEPALIVE_S", "15"))
+
+        # Write-behind queue for post-stream persistence (messages, summaries, telemetry)
+        self.WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+        # Pause after a partial batch so concurrent replies share one write
+        self.WRITE_BEHIND_FLUSH_INTERVAL_S: float = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_S", "0.05"))
+        self.WRITE_BEHIND_MAX_RETRIES: int = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5"))
+        self.WRITE_BEHIND_RETRY_BASE_S: float = float(os.getenv("WRITE_BEHIND_RETRY_BASE_S", "0.5"))
+        # On shutdown, pending jobs not written within this time are spilled to disk
+        self.WRITE_BEHIND_DRAIN_TIMEOUT_S: float = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT_S", "10"))
+
+        # Resumable /chat/stream: checkpoint every N tokens; cancel generation when no client is
+        # attached for the grace period; keep finished streams in memory / MongoDB for replay
+        self.STREAM_CHECKPOINT_TOKENS: int = int(os.getenv("STREAM_CHECKPOINT_TOKENS", "50"))
+        self.STREAM_RESUME_GRACE_S: float = float(os.getenv("STREAM_RESUME_GRACE_S", "20"))
+        self.STREAM_RESUME_TTL_S: float = float(os.getenv("STREAM_RESUME_TTL_S", "300"))
+        self.STREAM_CHECKPOINT_TTL_S: int = int(os.getenv("STREAM_CHECKPOINT_TTL_S", "86400"))
+
+        # Background conversation summaries: at most one per conversation per interval unless
+        # this many new messages arrived; concurrent summaries; cap on conversations waiting
+        self.SUMMARY_INTERVAL_S: float = float(os.getenv("SUMMARY_INTERVAL_S", "30"))
+        self.SUMMARY_MAX_NEW_MESSAGES: int = int(os.getenv("SUMMARY_MAX_NEW_MESSAGES", "10"))
+        self.SUMMARY_WORKERS: int = int(os.getenv("SUMMARY_WORKERS", "2"))
+        self.SUMMARY_MAX_PENDING: int = int(os.getenv("SUMMARY_MAX_PENDING", "1000"))
+
+        # Batch vision endpoint: images summarized concurrently per request, and upload cap
+        self.VISION_BATCH_CONCURRENCY: int = int(os.getenv("VISION_BATCH_CONCURRENCY", "4"))
+        self.VISION_BATCH_MAX_FILES: int = int(os.getenv("VISION_BATCH_MAX_FILES", "50"))
+
         # Embeddings / RAG
         self.EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
         self.RAG_COLLECTION: str = os.getenv("RAG_COLLECTION", "documents")
@@ -65,6 +210,28 @@ class Settings:
         self.ELEVENLABS_MODEL: str = os.getenv("ELEVENLABS_MODEL", "eleven_multilingual_v2")
         # Output format preset (e.g., mp3_44100_128, mp3_44100_64)
         self.ELEVENLABS_OUTPUT: str = os.getenv("ELEVENLABS_OUTPUT", "mp3_44100_128")
+        # Streaming voice replies: sentence length bounds for TTS pieces, and concurrent TTS requests
+        self.TTS_SENTENCE_MIN_CHARS: int = int(os.getenv("TTS_SENTENCE_MIN_CHARS", "20"))
+        self.TTS_SENTENCE_MAX_CHARS: int = int(os.getenv("TTS_SENTENCE_MAX_CHARS", "300"))
+        self.TTS_STREAM_CONCURRENCY: int = int(os.getenv("TTS_STREAM_CONCURRENCY", "2"))
+        # /tts inputs longer than this are split into chunks synthesized concurrently (0 = off)
+        self.TTS_LONG_TEXT_CHARS: int = int(os.getenv("TTS_LONG_TEXT_CHARS", "1500"))
+        self.TTS_LONG_CHUNK_CHARS: int = int(os.getenv("TTS_LONG_CHUNK_CHARS", "800"))
+        # Disk cache for synthesized audio (content-addressed, LRU-evicted above the size cap)
+        self.TTS_CACHE_ENABLED: bool = os.getenv("TTS_CACHE_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
+        self.TTS_CACHE_DIR: str = os.getenv("TTS_CACHE_DIR", "data/tts_cache")
+        self.TTS_CACHE_MAX_BYTES: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+        # Shared outbound HTTP clients: read timeouts per service, connect timeout, pool limits.
+        # HTTP/2 is used when the h2 package is installed (httpx[http2])
+        self.HTTP_TIMEOUT_TTS_S: float = float(os.getenv("HTTP_TIMEOUT_TTS_S", "60"))
+        self.HTTP_TIMEOUT_CRAWL_S: float = float(os.getenv("HTTP_TIMEOUT_CRAWL_S", "20"))
+        self.HTTP_TIMEOUT_WEB_S: float = float(os.getenv("HTTP_TIMEOUT_WEB_S", "8"))
+        self.HTTP_CONNECT_TIMEOUT_S: float = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "5"))
+        self.HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+        self.HTTP_MAX_KEEPALIVE: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+        self.HTTP_KEEPALIVE_S: float = float(os.getenv("HTTP_KEEPALIVE_S", "30"))
+        self.HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
 
         # Simple Auth (passcode + JWT)
         self.AUTH_PASSCODE: str = os.getenv("AUTH_PASSCODE", "")
@@ -11,6 +11,7 @@ class ChatRequest(BaseModel):
     # Optional lightweight tool call (kept minimal for compatibility)
     tool: Optional[str] = Field(default=None, description="Optional tool name to invoke before LLM, e.g., 'db_lookup'")
     tool_args: Optional[Dict[str, Any]] = Field(default=None, description="Arguments for the tool")
+    cache: Optional[bool] = Field(default=None, description="Set false to bypass the response cache for this request")
 
 
 class ChatResponse(BaseModel):
@@ -68,3 +69,7 @@ class ChatVoiceRequest(ChatRequest):
     voice_id: Optional[str] = None
     tts_model: Optional[str] = None
     tts_output: Optional[str] = None
+    transport: Optional[Literal["json", "multipart"]] = Field(
+        default=None,
+        description="'json' (default): audio as base64 in JSON; 'multipart': a JSON part, then the raw audio streamed from TTS",
+    )
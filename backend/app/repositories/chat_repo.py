@@ -1,14 +1,17 @@
 from __future__ import annotations
 
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
 from typing import List, Optional, Tuple
 
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
 
 from app.db.mongo import get_db
 from pathlib import Path
 import json
 from app.core.config import settings
+from app.services.token_budget import estimate_tokens
 
 # If MongoDB is not reachable (e.g., TLS/network issues), we fall back to an
 # in-memory store so the app keeps working like ChatGPT (no persistence).
@@ -174,6 +177,8 @@ async def add_message(conversation_id: str, role: str, content: str) -> None:
                 "conversation_id": oid,
                 "role": role,
                 "content": content,
+                # Counted once here so prompt building never re-tokenizes history
+                "tokens": estimate_tokens(content),
                 "created_at": _now(),
             }
             await db.messages.insert_one(msg)
@@ -188,12 +193,171 @@ async def add_message(conversation_id: str, role: str, content: str) -> None:
     _mem_msgs.setdefault(conversation_id, []).append({
         "role": role,
         "content": content,
+        "tokens": estimate_tokens(content),
         "created_at": _now(),
     })
     conv["updated_at"] = _now()
     _save_store()
 
 
+async def start_turn(conversation_id: Optional[str], message: str, user_key: Optional[str] = None) -> Tuple[str, List[dict]]:
+    """Ensure the conversation, store the user's message and load the history, concurrently.
+
+    Returns (conversation_id, messages oldest->newest including the new one). The
+    conversation update, the message insert and the history read are independent
+    round trips: ids are generated here, the history query excludes the new message
+    and the message is appended locally. A missing, malformed, unknown or deleted id
+    starts a new conversation (under a server-generated id), like ensure_conversation.
+    """
+    global _USE_MEM
+    if not _USE_MEM:
+        try:
+            db = get_db()
+            now = _now()
+            msg_id = ObjectId()
+            msg = {
+                "_id": msg_id,
+                "role": "user",
+                "content": message,
+                "tokens": estimate_tokens(message),
+                "created_at": now,
+            }
+            conv_fields = {"title": _title_from(message), **({"user_key": user_key} if user_key else {}), "created_at": now}
+
+            async def _start_new() -> ObjectId:
+                new_oid = ObjectId()
+                msg["conversation_id"] = new_oid
+                await asyncio.gather(
+                    db.conversations.insert_one({"_id": new_oid, **conv_fields, "updated_at": now}),
+                    db.messages.insert_one(msg),
+                )
+                return new_oid
+
+            history: List[dict] = []
+            if conversation_id and ObjectId.is_valid(conversation_id):
+                oid = ObjectId(conversation_id)
+                msg["conversation_id"] = oid
+
+                async def _history() -> List[dict]:
+                    cursor = db.messages.find({"conversation_id": oid, "_id": {"$ne": msg_id}}).sort("created_at", 1)
+                    return [
+                        {"role": m.get("role"), "content": m.get("content"), "tokens": m.get("tokens"), "created_at": m.get("created_at")}
+                        async for m in cursor
+                    ]
+
+                conv, _inserted, history = await asyncio.gather(
+                    db.conversations.find_one_and_update(
+                        {"_id": oid},
+                        {"$set": {"updated_at": now}},
+                        projection={"deleted_at": 1},
+                    ),
+                    db.messages.insert_one(msg),
+                    _history(),
+                )
+                if not conv or conv.get("deleted_at"):
+                    # Unknown or deleted: take back the message inserted alongside the
+                    # lookup and start a fresh conversation instead
+                    await db.messages.delete_one({"_id": msg_id})
+                    history = []
+                    oid = await _start_new()
+            else:
+                oid = await _start_new()
+            history.append({k: msg[k] for k in ("role", "content", "tokens", "created_at")})
+            return str(oid), history
+        except Exception:
+            _switch_to_mem()
+    # memory fallback
+    conv_id = await ensure_conversation(conversation_id, message, user_key=user_key)
+    await add_message(conv_id, "user", message)
+    _conv, msgs = await get_conversation(conv_id)
+    return conv_id, msgs
+
+
+async def add_messages(conversation_id: str, messages: List[Tuple[str, str]]) -> None:
+    """Append several (role, content) messages in order with one insert."""
+    global _USE_MEM
+    if not messages:
+        return
+    if not _USE_MEM:
+        try:
+            db = get_db()
+            oid = _obj_id(conversation_id)
+            now = _now()
+            # Messages are read back sorted by created_at (millisecond precision in
+            # MongoDB), so each one gets its own timestamp to keep the batch order
+            docs = [
+                {
+                    "conversation_id": oid,
+                    "role": role,
+                    "content": content,
+                    "tokens": estimate_tokens(content),
+                    "created_at": now + timedelta(milliseconds=i),
+                }
+                for i, (role, content) in enumerate(messages)
+            ]
+            await db.messages.insert_many(docs, ordered=True)
+            await db.conversations.update_one({"_id": oid}, {"$set": {"updated_at": _now()}})
+            return
+        except Exception:
+            _switch_to_mem()
+    # memory fallback
+    conv = _mem_convs.get(conversation_id)
+    if not conv:
+        raise ValueError("Conversation not found")
+    now = _now()
+    _mem_msgs.setdefault(conversation_id, []).extend(
+        {"role": role, "content": content, "tokens": estimate_tokens(content), "created_at": now}
+        for role, content in messages
+    )
+    conv["updated_at"] = _now()
+    _save_store()
+
+
+async def insert_messages(conversation_id: str, messages: List[dict]) -> None:
+    """Store messages carrying their own ids ({"id", "role", "content", "created_at"}).
+
+    Unlike add_messages this raises on database errors instead of switching to the
+    in-memory store, and is safe to retry: ids already stored are skipped.
+    """
+    if not messages:
+        return
+    if not _USE_MEM:
+        db = get_db()
+        oid = _obj_id(conversation_id)
+        docs = [
+            {
+                "_id": _obj_id(m["id"]),
+                "conversation_id": oid,
+                "role": m["role"],
+                "content": m["content"],
+                "tokens": estimate_tokens(m["content"]),
+                "created_at": m["created_at"],
+            }
+            for m in messages
+        ]
+        try:
+            await db.messages.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys are messages an earlier attempt already stored
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+                raise
+        await db.conversations.update_one({"_id": oid}, {"$set": {"updated_at": _now()}})
+        return
+    # memory store (already in use)
+    conv = _mem_convs.get(conversation_id)
+    if not conv:
+        raise ValueError("Conversation not found")
+    arr = _mem_msgs.setdefault(conversation_id, [])
+    seen = {m.get("id") for m in arr}
+    arr.extend(
+        {"id": m["id"], "role": m["role"], "content": m["content"], "tokens": estimate_tokens(m["content"]), "created_at": m["created_at"]}
+        for m in messages
+        if m["id"] not in seen
+    )
+    conv["updated_at"] = _now()
+    _save_store()
+
+
 async def list_conversations() -> List[dict]:
     global _USE_MEM
     if not _USE_MEM:
@@ -232,6 +396,7 @@ async def get_conversation(conversation_id: str) -> Tuple[dict, List[dict]]:
                 msgs.append({
                     "role": m.get("role"),
                     "content": m.get("content"),
+                    "tokens": m.get("tokens"),
                     "created_at": m.get("created_at"),
                 })
             conv_doc = {
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services import gemini_client, telemetry
+
+# Gemini Files API handles, keyed by SHA-256 of the uploaded bytes. A re-asked document
+# or a fallback retry on another model reuses the same remote file instead of uploading
+# again. Remote files expire on their own (48h); entries are dropped before that.
+_handles: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _state_of(meta: Any) -> str:
+    state = getattr(getattr(meta, "state", None), "name", None) or getattr(meta, "state", None) or getattr(meta, "processing_status", None)
+    return str(state).upper() if state else ""
+
+
+def _expires_at(uploaded: Any) -> float:
+    """Monotonic deadline for reusing `uploaded`, from its remote expiration_time when known."""
+    default = time.monotonic() + settings.FILE_UPLOAD_TTL_S
+    try:
+        exp = getattr(uploaded, "expiration_time", None)
+        if isinstance(exp, datetime):
+            if exp.tzinfo is None:
+                exp = exp.replace(tzinfo=timezone.utc)
+            remaining = (exp - datetime.now(timezone.utc)).total_seconds()
+            if remaining > 0:
+                return time.monotonic() + min(remaining, settings.FILE_UPLOAD_TTL_S)
+    except Exception:
+        pass
+    return default
+
+
+async def wait_until_active(uploaded: Any) -> Any:
+    """Poll the file's processing state with exponential backoff, without blocking the loop.
+
+    Returns the latest metadata. Raises RuntimeError if processing failed; after
+    FILE_READY_TIMEOUT_S the file is returned as-is (best effort, like before).
+    """
+    delay = settings.FILE_READY_POLL_INITIAL_S
+    deadline = time.monotonic() + settings.FILE_READY_TIMEOUT_S
+    meta = uploaded
+    state = _state_of(meta)
+    while True:
+        if "ACTIVE" in state or "SUCCEED" in state or "READY" in state:
+            return meta
+        if "FAILED" in state:
+            raise RuntimeError(f"File processing failed for {getattr(uploaded, 'name', 'file')}")
+        if time.monotonic() + delay > deadline:
+            return meta
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.FILE_READY_POLL_MAX_S)
+        try:
+            meta = await gemini_client.get_file(uploaded.name)
+        except Exception:
+            return meta
+        state = _state_of(meta)
+
+
+async def _upload(data: bytes, mime_type: str) -> Any:
+    # upload_file takes a path on all supported SDK versions; the temp file lives only for the upload
+    suffix = ".pdf" if mime_type.lower().endswith("pdf") else ""
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            tmp.write(data)
+            tmp_path = tmp.name
+        uploaded = await gemini_client.upload_file(tmp_path, mime_type=mime_type)
+    finally:
+        try:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except Exception:
+            pass
+    return await wait_until_active(uploaded)
+
+
+def _cached(digest: str) -> Optional[Any]:
+    item = _handles.get(digest)
+    if item is None:
+        return None
+    uploaded, expires_at = item
+    if expires_at - time.monotonic() <= settings.FILE_UPLOAD_REFRESH_MARGIN_S:
+        _handles.pop(digest, None)
+        return None
+    _handles.move_to_end(digest)
+    return uploaded
+
+
+async def get_or_upload(data: bytes, mime_type: Optional[str] = None) -> Any:
+    """Return an ACTIVE Files API handle for `data`, uploading at most once per content hash."""
+    mime = mime_type or "application/octet-stream"
+    digest = hashlib.sha256(data).hexdigest() + ":" + mime
+    uploaded = _cached(digest)
+    if uploaded is not None:
+        telemetry.incr("file_upload_reuse")
+        return uploaded
+
+    pending = _inflight.get(digest)
+    if pending is not None:
+        telemetry.incr("file_upload_reuse")
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+        # The request doing the upload was cancelled; upload on our own below
+
+    fut: asyncio.Future = asyncio.get_running_loop().create_future()
+    _inflight[digest] = fut
+    try:
+        uploaded = await _upload(data, mime)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            fut.cancel()
+        else:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved
+        raise
+    finally:
+        _inflight.pop(digest, None)
+    telemetry.incr("file_upload")
+    _handles[digest] = (uploaded, _expires_at(uploaded))
+    while len(_handles) > max(1, settings.FILE_UPLOAD_CACHE_MAX):
+        _handles.popitem(last=False)
+    fut.set_result(uploaded)
+    return uploaded
+
+
+def forget(data: bytes, mime_type: Optional[str] = None) -> None:
+    """Drop the cached handle for `data` (e.g. the remote file was rejected as missing)."""
+    digest = hashlib.sha256(data).hexdigest() + ":" + (mime_type or "application/octet-stream")
+    _handles.pop(digest, None)
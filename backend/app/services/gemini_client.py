@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from app.core.config import settings
+from app.services import gemini_scheduler, single_flight
+from app.services.token_budget import estimate_tokens, text_tokens
+
+# The SDK keeps its gRPC channels on a module-level client manager, and every
+# genai.configure() call throws them away. We configure once per API key and keep
+# model objects around so all requests share the same long-lived channels.
+_configured_key: Optional[str] = None
+_models: Dict[Tuple[str, Optional[str]], genai.GenerativeModel] = {}
+_lock = threading.Lock()
+
+
+def configure() -> None:
+    """Configure the SDK for the current API key (no-op when already configured)."""
+    global _configured_key
+    key = settings.GEMINI_API_KEY
+    if _configured_key == key:
+        return
+    with _lock:
+        if _configured_key != key:
+            genai.configure(api_key=key)
+            _models.clear()
+            _configured_key = key
+
+
+def get_model(model_name: str, system_instruction: Optional[str] = None) -> genai.GenerativeModel:
+    """Return a shared GenerativeModel for (model_name, system_instruction)."""
+    configure()
+    key = (model_name, system_instruction)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction)
+                _models[key] = model
+    return model
+
+
+def build_contents(message: Any, history: Optional[List[Dict[str, Any]]] = None) -> Any:
+    """Return request contents: Gemini-format history followed by the new user turn.
+
+    Equivalent to what ChatSession.send_message sends, without keeping a session object.
+    """
+    if not history:
+        return message
+    parts = message if isinstance(message, list) else [message]
+    return list(history) + [{"role": "user", "parts": parts}]
+
+
+def response_text(response: Any) -> str:
+    """Extract the text of a response, falling back to candidate parts. Raises ValueError when empty."""
+    text = None
+    try:
+        text = getattr(response, "text", None)
+    except Exception:
+        text = None
+    if not text and hasattr(response, "candidates"):
+        try:
+            for cand in response.candidates or []:
+                content = getattr(cand, "content", None)
+                if not content:
+                    continue
+                pieces = getattr(content, "parts", []) or []
+                chunks = [getattr(p, "text", "") for p in pieces]
+                text = "\n".join([c for c in chunks if c])
+                if text:
+                    break
+        except Exception:
+            pass
+    if not text:
+        raise ValueError("Empty response from Gemini.")
+    return text.strip()
+
+
+@lru_cache(maxsize=16)
+def _instruction_tokens(text: str) -> int:
+    # System instructions are a handful of constant prompts; count each once
+    return estimate_tokens(text)
+
+
+def _estimate_request_tokens(contents: Any, generation_config: Optional[dict], extra_text: Optional[str] = None) -> int:
+    """Rough request size for the scheduler's TPM bucket: text parts plus the output cap."""
+    items = contents if isinstance(contents, list) else [contents]
+    total = _instruction_tokens(extra_text or "")
+    for item in items:
+        parts = item.get("parts", []) if isinstance(item, dict) and "role" in item else [item]
+        for p in parts if isinstance(parts, list) else [parts]:
+            if isinstance(p, str):
+                # History parts carry the count stored with the message (no re-tokenizing)
+                total += text_tokens(p)
+            else:
+                # Images / file handles: Gemini bills media at a roughly fixed rate
+                total += 258
+    return total + int((generation_config or {}).get("max_output_tokens") or 0)
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    msg = str(exc)
+    return "429" in msg or "ResourceExhausted" in type(exc).__name__ or "RESOURCE_EXHAUSTED" in msg
+
+
+async def _scheduled_generate(
+    model: genai.GenerativeModel,
+    model_name: str,
+    contents: Any,
+    generation_config: Optional[dict],
+    system_instruction: Optional[str] = None,
+) -> Any:
+    tokens = _estimate_request_tokens(contents, generation_config, system_instruction)
+    async with gemini_scheduler.slot(model_name, tokens=tokens) as ticket:
+        try:
+            response = await model.generate_content_async(contents, generation_config=generation_config)
+        except Exception as e:
+            if _is_rate_limited(e):
+                gemini_scheduler.penalize(model_name)
+            raise
+        ticket.settle(response_usage(response).get("total_tokens"))
+        return response
+
+
+async def generate(
+    model_name: str,
+    contents: Any,
+    generation_config: Optional[dict] = None,
+    system_instruction: Optional[str] = None,
+) -> Any:
+    """Run generate_content on the SDK's async (gRPC asyncio) client and return the raw response.
+
+    The call waits in the outbound scheduler for capacity on `model_name` first.
+    """
+    model = get_model(model_name, system_instruction)
+    return await _scheduled_generate(model, model_name, contents, generation_config, system_instruction)
+
+
+async def stream(
+    model_name: str,
+    contents: Any,
+    generation_config: Optional[dict] = None,
+    system_instruction: Optional[str] = None,
+) -> AsyncIterator[Any]:
+    """Stream generate_content chunks from the async client.
+
+    Holds one scheduler slot for the life of the stream. Closing the generator (or
+    cancelling the task iterating it) cancels the upstream gRPC call.
+    """
+    model = get_model(model_name, system_instruction)
+    tokens = _estimate_request_tokens(contents, generation_config, system_instruction)
+    async with gemini_scheduler.slot(model_name, tokens=tokens) as ticket:
+        try:
+            response = await model.generate_content_async(contents, generation_config=generation_config, stream=True)
+        except Exception as e:
+            if _is_rate_limited(e):
+                gemini_scheduler.penalize(model_name)
+            raise
+        usage: Optional[int] = None
+        try:
+            async for chunk in response:
+                usage = response_usage(chunk).get("total_tokens") or usage
+                yield chunk
+        finally:
+            # The SDK does not expose cancel(); closing its iterator tears down the call
+            iterator = getattr(response, "_iterator", None)
+            if iterator is not None and hasattr(iterator, "aclose"):
+                try:
+                    await iterator.aclose()
+                except Exception:
+                    pass
+            ticket.settle(usage)
+
+
+async def generate_cached(
+    cached_content: Any,
+    model_name: str,
+    contents: Any,
+    generation_config: Optional[dict] = None,
+) -> Any:
+    """Like generate(), on a model bound to a CachedContent prefix."""
+    model = get_cached_model(cached_content)
+    return await _scheduled_generate(model, model_name, contents, generation_config)
+
+
+async def upload_file(path: str, mime_type: Optional[str] = None) -> Any:
+    """Upload a file via the Files API. The SDK only offers a blocking upload, so it runs off-loop."""
+    configure()
+    return await asyncio.to_thread(genai.upload_file, path=path, mime_type=mime_type)
+
+
+async def get_file(name: str) -> Any:
+    configure()
+    return await asyncio.to_thread(genai.get_file, name)
+
+
+async def embed(text: str, model: Optional[str] = None) -> List[float]:
+    """Return the embedding vector for `text` using the async embeddings API.
+
+    Concurrent requests for the same (model, text) at the same priority share one upstream call.
+    """
+    configure()
+    model_name = model or settings.EMBEDDING_MODEL
+
+    async def _call() -> List[float]:
+        result = await genai.embed_content_async(model=model_name, content=text)
+        vec = result.get("embedding") or result.get("data", {}).get("embedding")
+        if not isinstance(vec, list):
+            raise RuntimeError("Failed to get embedding vector from Google API response")
+        return vec
+
+    async def _scheduled() -> List[float]:
+        async with gemini_scheduler.slot(model_name, tokens=estimate_tokens(text)):
+            try:
+                return await _call()
+            except Exception as e:
+                if _is_rate_limited(e):
+                    gemini_scheduler.penalize(model_name)
+                raise
+
+    # Priority is part of the key: a background caller must not own an interactive one's call
+    key = single_flight.fingerprint(model_name, text, gemini_scheduler.current_priority())
+    vec = await single_flight.do("embed", key, _scheduled)
+    # Waiters share the leader's list; hand each caller its own copy
+    return list(vec)
+
+
+def get_cached_model(cached_content: Any) -> genai.GenerativeModel:
+    """Return a shared model bound to a CachedContent (system prompt + prefix live server-side)."""
+    configure()
+    name = getattr(cached_content, "name", None) or str(cached_content)
+    key = ("cached:" + name, None)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = genai.GenerativeModel.from_cached_content(cached_content)
+                _models[key] = model
+    return model
+
+
+def forget_cached_model(name: str) -> None:
+    with _lock:
+        _models.pop(("cached:" + name, None), None)
+
+
+def response_usage(response: Any) -> Dict[str, int]:
+    """Token usage reported on a response (prompt/output/cached/total), empty when absent."""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return {}
+    out: Dict[str, int] = {}
+    for key, attr in (
+        ("prompt_tokens", "prompt_token_count"),
+        ("output_tokens", "candidates_token_count"),
+        ("cached_tokens", "cached_content_token_count"),
+        ("total_tokens", "total_token_count"),
+    ):
+        value = getattr(meta, attr, None)
+        if isinstance(value, int) and value:
+            out[key] = value
+    return out
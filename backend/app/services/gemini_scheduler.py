@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set
+
+from app.core.config import settings
+from app.services import telemetry
+
+# Outbound scheduler for Gemini calls. Every request waits here until it fits:
+#   - concurrency cap per API key and per model
+#   - requests-per-minute and tokens-per-minute buckets per model
+# Waiters are served in priority order (interactive chat before background summaries
+# before ingestion embeddings), FIFO within a priority. A waiter never overtakes a
+# higher-priority waiter that is blocked on the same model or key, so bursts queue
+# up here instead of turning into upstream 429s and fallback cascades.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+INGEST = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", INGEST: "ingest"}
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("gemini_priority", default=INTERACTIVE)
+# Seconds the current task spent queued, so callers can separate queueing from model latency
+_waited: contextvars.ContextVar[float] = contextvars.ContextVar("gemini_queue_wait", default=0.0)
+
+
+class SchedulerTimeout(RuntimeError):
+    """Raised when a request waited longer than GEMINI_QUEUE_TIMEOUT_S for capacity."""
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute` / 60 per second (0 = unlimited)."""
+
+    __slots__ = ("per_minute", "tokens", "updated_at")
+
+    def __init__(self, per_minute: int) -> None:
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        rate = self.per_minute / 60.0
+        self.tokens = min(float(self.per_minute), self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (0 when it is available now)."""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, float(self.per_minute))
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.per_minute
+
+    def take(self, amount: float) -> None:
+        if self.per_minute > 0:
+            self.tokens -= min(amount, float(self.per_minute))
+
+    def give(self, amount: float) -> None:
+        if self.per_minute > 0:
+            self.tokens = min(float(self.per_minute), self.tokens + amount)
+
+
+class _Limits:
+    __slots__ = ("limit", "in_use", "rpm", "tpm")
+
+    def __init__(self, limit: int, rpm: int = 0, tpm: int = 0) -> None:
+        self.limit = limit
+        self.in_use = 0
+        self.rpm = _Bucket(rpm)
+        self.tpm = _Bucket(tpm)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "model", "key", "tokens", "future", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int, model: str, key: str, tokens: int, future: asyncio.Future) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.model = model
+        self.key = key
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Ticket:
+    """Capacity granted to one call; settle() corrects the TPM charge with real usage."""
+
+    __slots__ = ("model", "key", "tokens", "waited_s")
+
+    def __init__(self, model: str, key: str, tokens: int, waited_s: float) -> None:
+        self.model = model
+        self.key = key
+        self.tokens = tokens
+        self.waited_s = waited_s
+
+    def settle(self, actual_tokens: Optional[int]) -> None:
+        if not actual_tokens or actual_tokens == self.tokens:
+            return
+        limits = _models.get(self.model)
+        if limits is None:
+            return
+        if actual_tokens < self.tokens:
+            limits.tpm.give(self.tokens - actual_tokens)
+        else:
+            limits.tpm.take(actual_tokens - self.tokens)
+        self.tokens = actual_tokens
+
+
+_queue: List[_Waiter] = []
+_seq = itertools.count()
+_models: Dict[str, _Limits] = {}
+_keys: Dict[str, _Limits] = {}
+_timer: Optional[asyncio.TimerHandle] = None
+_timer_at = 0.0
+
+
+def _prefix_map(raw: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for item in (raw or "").split(","):
+        name, _, value = item.partition("=")
+        try:
+            if name.strip():
+                out[name.strip()] = int(value)
+        except ValueError:
+            continue
+    return out
+
+
+def _for_model(raw: str, model: str, default: int) -> int:
+    """Longest matching model-name prefix in a "prefix=value,..." setting, else `default`."""
+    overrides = _prefix_map(raw)
+    matches = [p for p in overrides if model.startswith(p)]
+    return overrides[max(matches, key=len)] if matches else default
+
+
+def _model_limits(model: str) -> _Limits:
+    limits = _models.get(model)
+    if limits is None:
+        limits = _Limits(
+            _for_model(settings.GEMINI_MODEL_CONCURRENCY, model, settings.GEMINI_MAX_CONCURRENCY_PER_MODEL),
+            rpm=_for_model(settings.GEMINI_MODEL_RPM, model, settings.GEMINI_RPM),
+            tpm=_for_model(settings.GEMINI_MODEL_TPM, model, settings.GEMINI_TPM),
+        )
+        _models[model] = limits
+    return limits
+
+
+def _key_limits(key: str) -> _Limits:
+    limits = _keys.get(key)
+    if limits is None:
+        limits = _Limits(settings.GEMINI_MAX_CONCURRENCY_PER_KEY)
+        _keys[key] = limits
+    return limits
+
+
+def _api_key_id() -> str:
+    return hashlib.sha256((settings.GEMINI_API_KEY or "").encode("utf-8")).hexdigest()[:12]
+
+
+def _schedule_pump(delay: float) -> None:
+    global _timer, _timer_at
+    loop = asyncio.get_running_loop()
+    at = loop.time() + delay
+    if _timer is not None and _timer_at <= at:
+        return
+    if _timer is not None:
+        _timer.cancel()
+    _timer_at = at
+    _timer = loop.call_later(delay, _pump)
+
+
+def _pump() -> None:
+    """Grant capacity to queued waiters in priority order."""
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+    now = time.monotonic()
+    blocked_models: Set[str] = set()
+    blocked_keys: Set[str] = set()
+    next_refill: Optional[float] = None
+    remaining: List[_Waiter] = []
+    for w in sorted(_queue):
+        if w.future.done():
+            continue
+        if w.model in blocked_models or w.key in blocked_keys:
+            remaining.append(w)
+            continue
+        key_limits = _key_limits(w.key)
+        model_limits = _model_limits(w.model)
+        if key_limits.in_use >= max(1, key_limits.limit):
+            blocked_keys.add(w.key)
+            remaining.append(w)
+            continue
+        if model_limits.in_use >= max(1, model_limits.limit):
+            blocked_models.add(w.model)
+            remaining.append(w)
+            continue
+        wait = max(model_limits.rpm.wait_for(1, now), model_limits.tpm.wait_for(w.tokens, now))
+        if wait > 0:
+            blocked_models.add(w.model)
+            next_refill = wait if next_refill is None else min(next_refill, wait)
+            remaining.append(w)
+            continue
+        key_limits.in_use += 1
+        model_limits.in_use += 1
+        model_limits.rpm.take(1)
+        model_limits.tpm.take(w.tokens)
+        w.future.set_result(now - w.enqueued_at)
+    _queue[:] = remaining
+    heapq.heapify(_queue)
+    if next_refill is not None:
+        _schedule_pump(next_refill)
+
+
+def _release(model: str, key: str) -> None:
+    _model_limits(model).in_use -= 1
+    _key_limits(key).in_use -= 1
+    if _queue:
+        _pump()
+
+
+@asynccontextmanager
+async def slot(model: str, tokens: int = 0, priority: Optional[int] = None) -> AsyncIterator[Ticket]:
+    """Hold one outbound call's worth of capacity for `model` while the block runs.
+
+    `tokens` is the request's estimated size for the TPM bucket (settle the ticket
+    with the real usage afterwards). `priority` defaults to the current context's
+    priority (see use_priority). Raises SchedulerTimeout after GEMINI_QUEUE_TIMEOUT_S.
+    """
+    prio = _priority.get() if priority is None else priority
+    key = _api_key_id()
+    fut: asyncio.Future = asyncio.get_running_loop().create_future()
+    waiter = _Waiter(prio, next(_seq), model, key, max(0, int(tokens)), fut)
+    heapq.heappush(_queue, waiter)
+    _pump()
+    try:
+        waited = await asyncio.wait_for(asyncio.shield(fut), timeout=settings.GEMINI_QUEUE_TIMEOUT_S)
+    except BaseException as e:
+        if fut.done() and not fut.cancelled() and fut.exception() is None:
+            # Granted just as we gave up; hand the capacity back
+            _release(model, key)
+        else:
+            fut.cancel()
+            _pump()
+        if isinstance(e, asyncio.TimeoutError):
+            telemetry.incr("gemini_queue_timeout")
+            raise SchedulerTimeout(f"Timed out waiting for Gemini capacity for {model}") from None
+        raise
+    name = PRIORITY_NAMES.get(prio, str(prio))
+    telemetry.incr(f"gemini_queue_{name}_granted")
+    telemetry.incr(f"gemini_queue_{name}_wait_ms", round(waited * 1000))
+    _waited.set(_waited.get() + waited)
+    try:
+        yield Ticket(model, key, waiter.tokens, waited)
+    finally:
+        _release(model, key)
+
+
+@contextmanager
+def use_priority(priority: int) -> Iterator[None]:
+    """Run Gemini calls made inside the block (and tasks spawned from it) at `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    """Priority that Gemini calls made from the current context will be queued at."""
+    return _priority.get()
+
+
+def take_wait() -> float:
+    """Return and reset the queueing time accumulated by the current task."""
+    waited = _waited.get()
+    _waited.set(0.0)
+    return waited
+
+
+def penalize(model: str) -> None:
+    """Upstream returned 429: empty the model's RPM bucket so queued calls back off."""
+    limits = _model_limits(model)
+    if limits.rpm.per_minute > 0:
+        limits.rpm.tokens = 0.0
+        limits.rpm.updated_at = time.monotonic()
+    telemetry.incr("gemini_upstream_429")
+
+
+def stats() -> Dict[str, Any]:
+    depth: Dict[str, int] = {}
+    for w in _queue:
+        if not w.future.done():
+            name = PRIORITY_NAMES.get(w.priority, str(w.priority))
+            depth[name] = depth.get(name, 0) + 1
+    return {
+        "queued": depth,
+        "models": {
+            name: {
+                "in_flight": m.in_use,
+                "limit": m.limit,
+                "rpm_available": round(m.rpm.tokens, 1) if m.rpm.per_minute else None,
+                "tpm_available": round(m.tpm.tokens) if m.tpm.per_minute else None,
+            }
+            for name, m in _models.items()
+        },
+        **telemetry.counters("gemini_queue_"),
+        **telemetry.counters("gemini_upstream_"),
+    }
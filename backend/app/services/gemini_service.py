@@ -1,13 +1,13 @@
-from typing import Tuple, Optional, List, Dict, Any, Iterable
+from typing import Tuple, Optional, List, Dict, Any, AsyncIterator, Iterable, Callable, Awaitable
+import asyncio
 import time
-import tempfile
-import os
+from contextlib import aclosing
 
 from fastapi import HTTPException
-from functools import lru_cache
-import google.generativeai as genai
 
 from app.core.config import settings
+from app.services import file_uploads, gemini_client, gemini_scheduler, image_preprocess, model_catalog, model_health, model_router, moderation, prompt_cache, response_cache, single_flight, telemetry
+from app.services import token_budget as token_budget_mod
 
 SYSTEM_PROMPT = (
     "You are Taliyo AI, a helpful engineering and business assistant.\n"
@@ -35,25 +35,16 @@ FILE_ASSISTANT_GUIDE = (
     "7) If the answer is not present, respond exactly: 'Not available in the document.'\n"
 )
 
+# Static system instruction for file/vision calls; kept identical across calls so it can be prefix-cached
+FILE_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n" + FILE_ASSISTANT_GUIDE
+
 
-@lru_cache(maxsize=1)
 def _list_available_model_names() -> list[str]:
-    """Return model ids (without 'models/' prefix) that support text generation."""
-    try:
-        names = []
-        for m in genai.list_models():
-            methods = getattr(m, "supported_generation_methods", []) or []
-            # Some SDK versions used 'createContent', keep both for safety
-            if "generateContent" in methods or "createContent" in methods:
-                name = getattr(m, "name", "") or ""
-                if name.startswith("models/"):
-                    name = name.split("/", 1)[1]
-                if name:
-                    names.append(name)
-        # de-duplicate and sort for stability
-        return sorted(set(names))
-    except Exception:
-        return []
+    """Return model ids (without 'models/' prefix) that support text generation.
+
+    Served from the background-refreshed model catalog; never waits on list_models.
+    """
+    return model_catalog.get_names()
 
 
 def _prefer(names: list[str], contains: list[str]) -> list[str]:
@@ -79,24 +70,29 @@ def _score_model_name(name: str) -> int:
     return score
 
 
-def _select_model_for_quality(quality: str, env_model: Optional[str]) -> str:
+def _ranked_models_for_quality(quality: str) -> list[str]:
+    """Available models suitable for `quality`, best first."""
     names = _list_available_model_names()
-    # If env model is explicitly set and available, use it
-    if env_model and env_model in names:
-        return env_model
-
     candidates: list[str] = []
     if quality in ("high", "medium"):
         candidates = _prefer(names, ["pro"]) or names
     else:
         candidates = _prefer(names, ["flash"]) or _prefer(names, ["pro"]) or names
+    return sorted(candidates, key=_score_model_name, reverse=True)
+
 
+def _select_model_for_quality(quality: str, env_model: Optional[str], task: Optional[str] = None) -> str:
+    names = _list_available_model_names()
+    # If env model is explicitly set and available, use it
+    if env_model and env_model in names:
+        return env_model
+
+    candidates = _ranked_models_for_quality(quality)
     if not candidates:
         # Fallback to a sane default; may still 404 if account lacks access
         return env_model or "gemini-1.5-pro-latest"
-
-    candidates = sorted(candidates, key=_score_model_name, reverse=True)
-    return candidates[0]
+    # Within the tier, prefer the best-ranked model that meets the task's latency SLO
+    return model_router.choose(task or "text", candidates) or candidates[0]
 
 
 def _choose_quality_and_model(message: str, requested_quality: Optional[str], task: Optional[str] = None) -> Tuple[str, str, dict]:
@@ -130,7 +126,7 @@ def _choose_quality_and_model(message: str, requested_quality: Optional[str], ta
         env_model = (settings.GEMINI_FILE_MODEL or "").strip() or None
     else:
         env_model = (settings.GEMINI_MODEL or "").strip() or None
-    chosen = _select_model_for_quality(rq, env_model)
+    chosen = _select_model_for_quality(rq, env_model, task=task)
 
     # Generation config tuned by quality only
     if rq == "high":
@@ -153,38 +149,324 @@ def _to_gemini_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     for m in history:
         role = "user" if m.get("role") == "user" else "model"
         content = m.get("content", "")
-        # Gemini Python SDK accepts strings as parts
-        out.append({"role": role, "parts": [content]})
+        # Gemini Python SDK accepts strings as parts; keep the stored count for request sizing
+        out.append({"role": role, "parts": [token_budget_mod.CountedText(content, token_budget_mod.message_tokens(m))]})
     return out
 
 
-def _trim_history(history: Optional[List[Dict[str, Any]]], max_messages: int = 20) -> Optional[List[Dict[str, Any]]]:
+def _trim_history(
+    history: Optional[List[Dict[str, Any]]],
+    max_messages: int = 20,
+    token_budget: Optional[int] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """Keep the most recent messages that fit `token_budget` (and at most `max_messages`).
+
+    Uses the per-message token counts stored by chat_repo, so nothing is re-tokenized.
+    """
     if not history:
         return history
+    if token_budget is not None:
+        return token_budget_mod.select_history(history, token_budget, max_messages=max_messages)
     if len(history) <= max_messages:
         return history
     return history[-max_messages:]
 
 
 def _moderate_text(text: str) -> Optional[str]:
-    """Very simple moderation using block words from settings. Returns an error message if blocked, else None."""
-    words = set((settings.SAFETY_BLOCK_WORDS or []))
-    if not words:
-        return None
-    lower = (text or "").lower()
-    for w in words:
-        if w and w.lower() in lower:
-            return "Your message contains disallowed content."
+    """Block-word moderation (single pass over a compiled matcher). Returns an error message if blocked, else None."""
+    return moderation.check_text(text)
+
+
+# Well-known defaults tried before scanning the full model list
+_EXPLICIT_FALLBACKS = [
+    "gemini-1.5-pro-latest",
+    "gemini-1.5-flash-latest",
+]
+
+
+def _is_not_found(err: Exception) -> bool:
+    msg = str(err).lower()
+    return "404" in msg or "not found" in msg
+
+
+def _alt_variant(model_name: str) -> str:
+    return model_name[:-7] if model_name.endswith("-latest") else model_name + "-latest"
+
+
+def _pref_list(quality: str, exclude: Iterable[str]) -> list[str]:
+    """Available models ordered by quality preference, excluding ones already in the chain."""
+    names = _list_available_model_names()
+    tried = set(exclude)
+    if quality in ("high", "medium"):
+        first = _prefer(names, ["pro"]) or []
+        second = _prefer(names, ["flash"]) or []
+    else:
+        first = _prefer(names, ["flash"]) or []
+        second = _prefer(names, ["pro"]) or []
+    seq = [n for n in first + second if n not in tried]
+    if not seq:
+        seq = [n for n in names if n not in tried]
+    return sorted(seq, key=_score_model_name, reverse=True)
+
+
+def _fallback_chain(model_name: str, quality: str, include_pref: bool = True) -> list[str]:
+    """Primary model, then explicit defaults, then (optionally) the preference list."""
+    chain = [model_name] + [c for c in _EXPLICIT_FALLBACKS if c != model_name]
+    if include_pref:
+        chain += _pref_list(quality, chain)
+    return chain
+
+
+async def _attempt(
+    model_name: str,
+    run: Callable[[str], Awaitable[Any]],
+    attempts: List[Dict[str, Any]],
+    hedge: bool = False,
+) -> str:
+    """Run one model call, extract its text and record the attempt.
+
+    The outcome goes to the health registry, and a per-attempt record (model, outcome,
+    latency, time queued in the outbound scheduler, token usage) is appended to
+    `attempts` for telemetry. Queueing time is excluded from the model's latency.
+    """
+    model_health.begin_attempt(model_name)
+    record: Dict[str, Any] = {"model": model_name, **({"hedge": True} if hedge else {})}
+    attempts.append(record)
+    gemini_scheduler.take_wait()
+    t0 = time.monotonic()
+
+    def _timing() -> float:
+        queued = gemini_scheduler.take_wait()
+        if queued:
+            record["queue_ms"] = round(queued * 1000)
+        return max(0.0, time.monotonic() - t0 - queued)
+
+    try:
+        response = await run(model_name)
+        text = gemini_client.response_text(response)
+    except asyncio.CancelledError:
+        model_health.end_attempt(model_name)
+        record.update({"outcome": "cancelled", "latency_ms": round(_timing() * 1000)})
+        raise
+    except gemini_scheduler.SchedulerTimeout as e:
+        # Local back-pressure, not a model failure
+        model_health.end_attempt(model_name)
+        record.update({"outcome": "queue_timeout", "latency_ms": round(_timing() * 1000), "error": str(e)})
+        raise
+    except Exception as e:
+        elapsed = _timing()
+        model_health.record_failure(model_name, elapsed, str(e))
+        record.update({"outcome": "error", "latency_ms": round(elapsed * 1000), "error": str(e)[:200]})
+        telemetry.incr("llm_attempt_error")
+        raise
+    elapsed = _timing()
+    model_health.record_success(model_name, elapsed)
+    usage = gemini_client.response_usage(response)
+    record.update({"outcome": "ok", "latency_ms": round(elapsed * 1000), **usage})
+    telemetry.incr("llm_attempt_ok")
+    for key in ("prompt_tokens", "output_tokens", "cached_tokens"):
+        if key in usage:
+            telemetry.incr("llm_" + key, usage[key])
+    return text
+
+
+def _hedge_delay(model_name: str) -> float:
+    """Seconds to wait on `model_name` before hedging: its recent latency percentile, clamped."""
+    p = model_health.latency_percentile(model_name, settings.HEDGE_PERCENTILE, min_samples=settings.HEDGE_MIN_SAMPLES)
+    delay_ms = p * 1000 if p is not None else settings.HEDGE_DELAY_MS
+    delay_ms = min(max(delay_ms, settings.HEDGE_MIN_DELAY_MS), settings.HEDGE_MAX_DELAY_MS)
+    return delay_ms / 1000.0
+
+
+async def _hedged_attempt(
+    primary: str,
+    backup: str,
+    run: Callable[[str], Awaitable[Any]],
+    errors: List[str],
+    attempts: List[Dict[str, Any]],
+) -> Tuple[Optional[Tuple[str, str]], Optional[Exception], bool]:
+    """Call `primary`; if it has not answered within its hedge delay, race `backup` too.
+
+    The first successful answer wins and the other call is cancelled. Returns
+    ((text, model_used) or None, primary_error, hedge_fired).
+    """
+    delay = _hedge_delay(primary)
+    t0 = time.monotonic()
+    p_index = len(attempts)
+    p_task = asyncio.ensure_future(_attempt(primary, run, attempts))
+    tasks = {p_task: primary}
+    try:
+        done, _ = await asyncio.wait({p_task}, timeout=delay)
+        if done:
+            try:
+                return (p_task.result(), primary), None, False
+            except Exception as e:
+                errors.append(f"Primary {primary}: {e}")
+                return None, e, False
+
+        # Primary is slower than usual: fire the hedge and take whichever answers first
+        telemetry.incr("llm_hedge_fired")
+        h_task = asyncio.ensure_future(_attempt(backup, run, attempts, hedge=True))
+        tasks[h_task] = backup
+        pending = set(tasks)
+        result: Optional[Tuple[str, str]] = None
+        primary_exc: Optional[Exception] = None
+        primary_failed_at: Optional[float] = None
+        while pending and result is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                try:
+                    text = t.result()
+                except Exception as e:
+                    if t is p_task:
+                        primary_exc = e
+                        primary_failed_at = time.monotonic() - t0
+                        errors.append(f"Primary {primary}: {e}")
+                    else:
+                        errors.append(f"Hedge {backup}: {e}")
+                    continue
+                if result is None:
+                    result = (text, tasks[t])
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+    elapsed = time.monotonic() - t0
+    winner = result[1] if result else None
+    saved: Optional[float] = 0.0
+    if winner == backup:
+        telemetry.incr("llm_hedge_won")
+        if primary_failed_at is None and len(attempts) > p_index:
+            # The primary was cancelled: it would have taken at least this long. Kept as a
+            # censored sample so the router learns the primary is slow
+            attempts[p_index]["censored_ms"] = round(elapsed * 1000)
+        if primary_failed_at is not None:
+            # Sequential fallback would only have started the backup once the primary failed
+            saved = max(0.0, primary_failed_at - delay)
+        else:
+            # Primary was cancelled; estimate from its typical latency (unknown on a cold start)
+            baseline = model_health.latency_ewma(primary)
+            saved = max(0.0, baseline - elapsed) if baseline is not None else None
+        if saved is not None:
+            telemetry.incr("llm_hedge_saved_ms", round(saved * 1000))
+    telemetry.emit("llm_hedge", {
+        "primary": primary,
+        "backup": backup,
+        "winner": winner,
+        "delay_ms": round(delay * 1000),
+        "elapsed_ms": round(elapsed * 1000),
+        **({"saved_ms": round(saved * 1000)} if saved is not None else {}),
+    })
+    return result, primary_exc, True
+
+
+async def _invoke_with_fallbacks(
+    model_name: str,
+    quality: str,
+    run: Callable[[str], Awaitable[Any]],
+    errors: List[str],
+    include_pref: bool = True,
+    hedge: bool = False,
+    task: str = "text",
+) -> Optional[Tuple[str, str]]:
+    """Model-invocation engine shared by generate_reply, summarize_image and ask_about_file.
+
+    Calls `run(model)` (which returns the raw SDK response) along the fallback chain
+    until one yields text. Candidates are filtered and ordered by the model health
+    registry, so models with an open circuit breaker are skipped without a network
+    call. A not-found primary is retried once with its '-latest' alias. With `hedge`,
+    the first attempt races the next-best model for the quality tier once it exceeds
+    its latency budget. Every attempt (model, outcome, latency, token usage) is
+    emitted to telemetry as one 'llm_call' event.
+    Returns (text, model_used) or None, appending one line per failed attempt to `errors`.
+    """
+    attempts: List[Dict[str, Any]] = []
+    t0 = time.monotonic()
+    result: Optional[Tuple[str, str]] = None
+    try:
+        result = await _run_chain(model_name, quality, run, errors, attempts, include_pref, hedge)
+        return result
+    finally:
+        for a in attempts:
+            if a.get("outcome") in ("ok", "error"):
+                model_router.record(task, a["model"], a["latency_ms"] / 1000, a["outcome"] == "ok")
+            elif "censored_ms" in a:
+                model_router.record_censored(task, a["model"], a["censored_ms"] / 1000)
+        telemetry.emit("llm_call", {
+            "task": task,
+            "quality": quality,
+            "requested_model": model_name,
+            "model": result[1] if result else None,
+            "ok": result is not None,
+            "total_ms": round((time.monotonic() - t0) * 1000),
+            "attempts": attempts,
+        })
+
+
+async def _run_chain(
+    model_name: str,
+    quality: str,
+    run: Callable[[str], Awaitable[Any]],
+    errors: List[str],
+    attempts: List[Dict[str, Any]],
+    include_pref: bool,
+    hedge: bool,
+) -> Optional[Tuple[str, str]]:
+    chain = model_health.order_candidates(_fallback_chain(model_name, quality, include_pref=include_pref))
+    tried: set[str] = set()
+    i = 0
+    while i < len(chain):
+        cand = chain[i]
+        i += 1
+        tried.add(cand)
+        backup = None
+        if hedge and i == 1:
+            telemetry.incr("llm_hedge_eligible")
+            ranked = model_health.order_candidates(_ranked_models_for_quality(quality) or list(_EXPLICIT_FALLBACKS))
+            backup = next((m for m in ranked if m != cand), None)
+        try:
+            if backup:
+                result, primary_exc, fired = await _hedged_attempt(cand, backup, run, errors, attempts)
+                if result:
+                    return result
+                if fired:
+                    # The backup already had its attempt in the race
+                    tried.add(backup)
+                    chain = chain[:i] + [m for m in chain[i:] if m != backup]
+                if primary_exc is not None:
+                    raise primary_exc
+                continue
+            text = await _attempt(cand, run, attempts)
+        except Exception as e:
+            if not backup:
+                errors.append(f"{'Primary ' if cand == model_name else ''}{cand}: {e}")
+            if cand == model_name and _is_not_found(e):
+                alt = _alt_variant(cand)
+                if alt not in tried and alt not in chain[i:] and model_health.is_available(alt):
+                    chain.insert(i, alt)
+            continue
+        return text, cand
     return None
 
 
-def generate_reply(message: str, quality: Optional[str] = None, history: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, str, str]:
+async def generate_reply(
+    message: str,
+    quality: Optional[str] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+    hedge: Optional[bool] = None,
+    cache: Optional[bool] = None,
+    cache_scope: Optional[str] = None,
+) -> Tuple[str, str, str]:
     """Generate a reply using Google Gemini models with safe fallbacks.
 
     Returns: (reply_text, model_used, quality_used)
 
-    If `history` is provided, it will be used to create a chat session so the
-    model has multi-turn context similar to ChatGPT.
+    If `history` is provided, it is sent ahead of the message as prior turns so
+    the model has multi-turn context similar to ChatGPT. `hedge` overrides
+    HEDGING_ENABLED for this call. Replies are served from / stored in the
+    response cache unless `cache` is False; `cache_scope` (see
+    response_cache.scope_for) partitions cached replies.
     """
     if not settings.GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured.")
@@ -194,107 +476,66 @@ def generate_reply(message: str, quality: Optional[str] = None, history: Optiona
     if err:
         raise HTTPException(status_code=400, detail=err)
 
-    genai.configure(api_key=settings.GEMINI_API_KEY)
     # Decide model & generation config
     quality_used, model_name, gen_cfg = _choose_quality_and_model(message, quality, task="text")
 
-    def _run(model_name_local: str, gen_cfg_local: dict) -> str:
-        model = genai.GenerativeModel(
-            model_name=model_name_local,
+    # Include trimmed history so the model has multi-turn context
+    hist = _trim_history(
+        history,
+        max_messages=settings.MEMORY_MAX_MESSAGES,
+        token_budget=token_budget_mod.history_token_budget(model_name, quality_used),
+    )
+    hist_contents = _to_gemini_history(hist) if hist else []
+
+    probe = None
+    if settings.RESPONSE_CACHE_ENABLED and cache is not False:
+        probe = await response_cache.lookup(
+            message, hist, model_name, gen_cfg, scope=cache_scope or response_cache.scope_for()
+        )
+        if probe.hit:
+            text, used = probe.hit
+            return text, used, quality_used
+
+    async def _run(model_name_local: str, gen_cfg_local: dict) -> Any:
+        # System prompt and older turns are served from the prefix cache when enabled
+        return await prompt_cache.generate(
+            model_name_local,
+            message,
+            history=hist_contents,
+            generation_config=gen_cfg_local,
             system_instruction=SYSTEM_PROMPT,
         )
-        # Use chat session with history when available
-        hist = _trim_history(history, max_messages=settings.MEMORY_MAX_MESSAGES)
-        if hist:
-            chat = model.start_chat(history=_to_gemini_history(hist))
-            response = chat.send_message(message, generation_config=gen_cfg_local)
-        else:
-            response = model.generate_content(message, generation_config=gen_cfg_local)
-        text = getattr(response, "text", None)
-        if not text and hasattr(response, "candidates"):
-            try:
-                for cand in response.candidates or []:
-                    parts = getattr(cand.content, "parts", [])
-                    chunks = [getattr(p, "text", "") for p in parts]
-                    text = "\n".join([c for c in chunks if c])
-                    if text:
-                        break
-            except Exception:
-                pass
-        if not text:
-            raise ValueError("Empty response from Gemini.")
-        return text.strip()
 
-    try:
-        # Try primary model
-        text = _run(model_name, gen_cfg)
-        return text, model_name, quality_used
-    except Exception as e_primary:
-        errors = [f"Primary {model_name}: {e_primary}"]
-        # If not-found, try alternate variant of same name
-        try:
-            msg = str(e_primary).lower()
-            if "404" in msg or "not found" in msg:
-                alt_name = model_name[:-7] if model_name.endswith("-latest") else model_name + "-latest"
-                if alt_name != model_name:
-                    try:
-                        text = _run(alt_name, gen_cfg)
-                        return text, alt_name, quality_used
-                    except Exception as e_alt:
-                        errors.append(f"Alt {alt_name}: {e_alt}")
-        except Exception:
-            pass
-
-        # Try explicit well-known defaults before scanning the full list
-        explicit_fallbacks = [
-            "gemini-1.5-pro-latest",
-            "gemini-1.5-flash-latest",
-        ]
-        tried = {model_name}
-        if 'alt_name' in locals():
-            tried.add(alt_name)
-        for cand in explicit_fallbacks:
-            if cand in tried:
-                continue
-            try:
-                text = _run(cand, gen_cfg)
-                return text, cand, quality_used
-            except Exception as e_exp:
-                errors.append(f"{cand}: {e_exp}")
-
-        # Try other available models by quality preference
-        names = _list_available_model_names()
-        # Build preference list
-        def _pref_list(q: str) -> list[str]:
-            if q in ("high", "medium"):
-                first = _prefer(names, ["pro"]) or []
-                second = _prefer(names, ["flash"]) or []
-            else:
-                first = _prefer(names, ["flash"]) or []
-                second = _prefer(names, ["pro"]) or []
-            # Remove ones we attempted
-            tried_local = set(tried)
-            seq = [n for n in first + second if n not in tried]
-            if not seq:
-                seq = [n for n in names if n not in tried_local]
-            # sort by score
-            return sorted(seq, key=_score_model_name, reverse=True)
-
-        for candidate in _pref_list(quality_used):
-            try:
-                text = _run(candidate, gen_cfg)
-                return text, candidate, quality_used
-            except Exception as e_c:
-                errors.append(f"{candidate}: {e_c}")
+    use_hedge = settings.HEDGING_ENABLED if hedge is None else hedge
+
+    async def _call() -> Tuple[Optional[Tuple[str, str]], List[str]]:
+        errs: List[str] = []
+        res = await _invoke_with_fallbacks(model_name, quality_used, lambda m: _run(m, gen_cfg), errs, hedge=use_hedge, task="text")
+        return res, errs
+
+    # Identical requests already in flight (client retries, the same question from
+    # several users at once) share one upstream call. Priority is part of the key so an
+    # interactive caller never waits behind a leader queued at background priority
+    flight_key = single_flight.fingerprint(
+        model_name, quality_used, gen_cfg, use_hedge, hist_contents, message, gemini_scheduler.current_priority()
+    )
+    result, errors = await single_flight.do("llm", flight_key, _call)
+    if result:
+        text, used = result
+        if probe is not None:
+            response_cache.store(probe, text, used)
+        return text, used, quality_used
 
-        # No working model found
-        raise HTTPException(status_code=502, detail="Gemini errors: " + " | ".join(errors))
+    # No working model found
+    raise HTTPException(status_code=502, detail="Gemini errors: " + (" | ".join(errors) or "all candidate models are cooling down"))
 
 
-def stream_reply(message: str, quality: Optional[str] = None, history: Optional[List[Dict[str, Any]]] = None) -> Iterable[str]:
+async def stream_reply(message: str, quality: Optional[str] = None, history: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[str]:
     """Yield reply chunks (strings) for streaming to the client.
 
-    This uses the chosen model and streams tokens. Minimal moderation is applied on input.
+    Runs on the async client, so an open stream holds no thread. Closing the generator
+    (e.g. the client disconnected) cancels the upstream generation. Minimal moderation
+    is applied on input; output is scanned incrementally.
     """
     err = _moderate_text(message)
     if err:
@@ -302,26 +543,84 @@ def stream_reply(message: str, quality: Optional[str] = None, history: Optional[
         yield err
         return
 
-    genai.configure(api_key=settings.GEMINI_API_KEY)
     quality_used, model_name, gen_cfg = _choose_quality_and_model(message, quality, task="stream")
-
-    model = genai.GenerativeModel(model_name=model_name, system_instruction=SYSTEM_PROMPT)
-    hist = _trim_history(history, max_messages=settings.MEMORY_MAX_MESSAGES)
+    # Streams cannot fall back mid-reply, so start on the healthiest candidate
+    healthy = model_health.order_candidates(_fallback_chain(model_name, quality_used))
+    if healthy:
+        model_name = healthy[0]
+
+    hist = _trim_history(
+        history,
+        max_messages=settings.MEMORY_MAX_MESSAGES,
+        token_budget=token_budget_mod.history_token_budget(model_name, quality_used),
+    )
+    contents = gemini_client.build_contents(message, _to_gemini_history(hist) if hist else None)
+    record: Dict[str, Any] = {"model": model_name}
+    model_health.begin_attempt(model_name)
+    gemini_scheduler.take_wait()
+    t0 = time.monotonic()
+    queued = 0.0
+    first_chunk = True
     try:
-        if hist:
-            chat = model.start_chat(history=_to_gemini_history(hist))
-            response = chat.send_message(message, generation_config=gen_cfg, stream=True)
-        else:
-            response = model.generate_content(message, generation_config=gen_cfg, stream=True)
-        for event in response:
-            text_piece = getattr(event, "text", None)
-            if text_piece:
-                yield text_piece
+        # Output moderation: hold back only a possible partial block word between chunks
+        scanner = moderation.StreamScanner()
+        async with aclosing(gemini_client.stream(model_name, contents, generation_config=gen_cfg, system_instruction=SYSTEM_PROMPT)) as chunks:
+            async for event in chunks:
+                if first_chunk:
+                    # Routing SLO for streams is time to first chunk (excluding local queueing)
+                    first_chunk = False
+                    queued = gemini_scheduler.take_wait()
+                    ttft = max(0.0, time.monotonic() - t0 - queued)
+                    record["ttft_ms"] = round(ttft * 1000)
+                    model_router.record("stream", model_name, ttft, True)
+                record.update(gemini_client.response_usage(event))
+                try:
+                    text_piece = event.text
+                except Exception:
+                    text_piece = None
+                if text_piece:
+                    safe = scanner.feed(text_piece)
+                    if scanner.blocked:
+                        yield moderation.BLOCKED_OUTPUT_MESSAGE
+                        break
+                    if safe:
+                        yield safe
+        tail = scanner.flush()
+        if tail:
+            yield tail
+        elapsed = max(0.0, time.monotonic() - t0 - queued)
+        model_health.record_success(model_name, elapsed)
+        record.update({"outcome": "ok", "latency_ms": round(elapsed * 1000)})
+    except (asyncio.CancelledError, GeneratorExit):
+        model_health.end_attempt(model_name)
+        record.update({"outcome": "cancelled", "latency_ms": round((time.monotonic() - t0 - queued) * 1000)})
+        raise
+    except gemini_scheduler.SchedulerTimeout as e:
+        model_health.end_attempt(model_name)
+        record.update({"outcome": "queue_timeout", "error": str(e)})
+        yield f"[stream error: {e}]"
     except Exception as e:
+        elapsed = max(0.0, time.monotonic() - t0 - queued)
+        model_health.record_failure(model_name, elapsed, str(e))
+        if first_chunk:
+            model_router.record("stream", model_name, None, False)
+        record.update({"outcome": "error", "latency_ms": round(elapsed * 1000), "error": str(e)[:200]})
         yield f"[stream error: {e}]"
-
-
-def summarize_image(image_bytes: bytes, mime_type: str, prompt: Optional[str] = None, quality: Optional[str] = None) -> Tuple[str, str, str]:
+    finally:
+        if queued:
+            record["queue_ms"] = round(queued * 1000)
+        telemetry.emit("llm_call", {
+            "task": "stream",
+            "quality": quality_used,
+            "requested_model": model_name,
+            "model": model_name if record.get("outcome") == "ok" else None,
+            "ok": record.get("outcome") == "ok",
+            "total_ms": round((time.monotonic() - t0) * 1000),
+            "attempts": [record],
+        })
+
+
+async def summarize_image(image_bytes: bytes, mime_type: str, prompt: Optional[str] = None, quality: Optional[str] = None) -> Tuple[str, str, str]:
     """Summarize an image using Gemini multimodal models.
 
     Returns: (summary_text, model_used, quality_used)
@@ -329,109 +628,43 @@ def summarize_image(image_bytes: bytes, mime_type: str, prompt: Optional[str] =
     if not settings.GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured.")
 
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-
     # Choose model/quality; seed message is generic since content is visual
     quality_used, model_name, gen_cfg = _choose_quality_and_model("image_summary", quality, task="vision")
 
-    # Default instruction optimized for concise summaries + file assistant guide
+    # Default instruction optimized for concise summaries (file assistant guide is in the system prompt)
     instruction = (
-        (FILE_ASSISTANT_GUIDE + "\nTask: " + (prompt or (
+        ("Task: " + (prompt or (
             "Summarize the image in 4-8 concise bullet points. "
             "If it's a document, extract main headings, key facts, dates, amounts, and totals. "
             "Avoid guessing unreadable text; mention if parts are unclear."
         )))
     ).strip()
 
+    # Downscale / re-encode off the event loop; cached per content hash and tier
+    image_bytes, mime_type = await image_preprocess.prepare(image_bytes, mime_type, quality_used)
     parts: List[Any] = [
         {"mime_type": (mime_type or "image/png"), "data": image_bytes},
         instruction,
     ]
 
-    def _run(model_name_local: str, gen_cfg_local: dict) -> str:
-        model = genai.GenerativeModel(
-            model_name=model_name_local,
-            system_instruction=SYSTEM_PROMPT,
+    async def _run(model_name_local: str, gen_cfg_local: dict) -> Any:
+        return await prompt_cache.generate(
+            model_name_local,
+            parts,
+            generation_config=gen_cfg_local,
+            system_instruction=FILE_SYSTEM_PROMPT,
         )
-        response = model.generate_content(parts, generation_config=gen_cfg_local)
-        text = getattr(response, "text", None)
-        if not text and hasattr(response, "candidates"):
-            try:
-                for cand in response.candidates or []:
-                    content = getattr(cand, "content", None)
-                    if not content:
-                        continue
-                    pieces = getattr(content, "parts", []) or []
-                    chunks = [getattr(p, "text", "") for p in pieces]
-                    text = "\n".join([c for c in chunks if c])
-                    if text:
-                        break
-            except Exception:
-                pass
-        if not text:
-            raise ValueError("Empty response from Gemini.")
-        return text.strip()
 
-    try:
-        summary = _run(model_name, gen_cfg)
-        return summary, model_name, quality_used
-    except Exception as e_primary:
-        errors = [f"Primary {model_name}: {e_primary}"]
-        try:
-            msg = str(e_primary).lower()
-            if "404" in msg or "not found" in msg:
-                alt_name = model_name[:-7] if model_name.endswith("-latest") else model_name + "-latest"
-                if alt_name != model_name:
-                    try:
-                        summary = _run(alt_name, gen_cfg)
-                        return summary, alt_name, quality_used
-                    except Exception as e_alt:
-                        errors.append(f"Alt {alt_name}: {e_alt}")
-        except Exception:
-            pass
-
-    # Explicit fallbacks
-    explicit_fallbacks = [
-        "gemini-1.5-pro-latest",
-        "gemini-1.5-flash-latest",
-    ]
-    tried = {model_name}
-    if 'alt_name' in locals():
-        tried.add(alt_name)
-    for cand in explicit_fallbacks:
-        if cand in tried:
-            continue
-        try:
-            summary = _run(cand, gen_cfg)
-            return summary, cand, quality_used
-        except Exception:
-            continue
-
-    # Broader search across available models
-    names = _list_available_model_names()
-    def _pref_list(q: str) -> list[str]:
-        if q in ("high", "medium"):
-            first = _prefer(names, ["pro"]) or []
-            second = _prefer(names, ["flash"]) or []
-        else:
-            first = _prefer(names, ["flash"]) or []
-            second = _prefer(names, ["pro"]) or []
-        seq = [n for n in first + second if n not in tried]
-        if not seq:
-            seq = [n for n in names if n not in tried]
-        return sorted(seq, key=_score_model_name, reverse=True)
-
-    for candidate in _pref_list(quality_used):
-        try:
-            summary = _run(candidate, gen_cfg)
-            return summary, candidate, quality_used
-        except Exception:
-            continue
+    errors: List[str] = []
+    result = await _invoke_with_fallbacks(model_name, quality_used, lambda m: _run(m, gen_cfg), errors, task="vision")
+    if result:
+        summary, used = result
+        return summary, used, quality_used
 
     raise HTTPException(status_code=502, detail="Gemini vision failed to summarize the image with available models.")
 
 
-def ask_about_file(file_bytes: bytes, mime_type: str, prompt: Optional[str], quality: Optional[str] = None) -> Tuple[str, str, str]:
+async def ask_about_file(file_bytes: bytes, mime_type: str, prompt: Optional[str], quality: Optional[str] = None) -> Tuple[str, str, str]:
     """Answer a user prompt about an uploaded file (image/* or application/pdf).
 
     Returns (answer, model_used, quality_used).
@@ -441,88 +674,40 @@ def ask_about_file(file_bytes: bytes, mime_type: str, prompt: Optional[str], qua
 
     # Route images through the existing vision helper
     if (mime_type or "").lower().startswith("image/"):
-        text, model, q_used = summarize_image(file_bytes, mime_type=mime_type, prompt=prompt, quality=quality)
+        text, model, q_used = await summarize_image(file_bytes, mime_type=mime_type, prompt=prompt, quality=quality)
         return text, model, q_used
 
     if (mime_type or "").lower() not in {"application/pdf", "application/x-pdf", "application/acrobat"}:
         # Fallback: treat unknown types as binary attachment and still try via upload API
         pass
 
-    genai.configure(api_key=settings.GEMINI_API_KEY)
     q_used, model_name, gen_cfg = _choose_quality_and_model(prompt or "analyze file", quality, task="file")
 
     instruction = (
-        FILE_ASSISTANT_GUIDE + "\nTask: " + (
+        "Task: " + (
             prompt or "Answer the user's request using only the content of the attached file."
         )
     ).strip()
 
-    # Persist bytes to a temp file for upload_file API
-    tmp_path = None
+    # Upload once per content hash; fallback models and repeat questions reuse the handle
     try:
-        suffix = ".pdf" if (mime_type or "").lower().endswith("pdf") else ""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
-
-        def _run(model_local: str, cfg_local: dict) -> str:
-            # Upload and wait until processed
-            uploaded = genai.upload_file(path=tmp_path, mime_type=mime_type or "application/octet-stream")
-            # best-effort wait until ACTIVE
-            try:
-                for _ in range(30):
-                    meta = genai.get_file(uploaded.name)
-                    state = getattr(getattr(meta, "state", None), "name", None) or getattr(meta, "state", None) or getattr(meta, "processing_status", None)
-                    s = str(state).upper() if state else ""
-                    if "ACTIVE" in s or "SUCCEED" in s or "READY" in s:
-                        break
-                    time.sleep(1)
-            except Exception:
-                pass
-
-            model = genai.GenerativeModel(model_name=model_local, system_instruction=SYSTEM_PROMPT)
-            resp = model.generate_content([uploaded, instruction], generation_config=cfg_local)
-            text = getattr(resp, "text", None)
-            if not text and hasattr(resp, "candidates"):
-                try:
-                    for cand in resp.candidates or []:
-                        parts = getattr(cand.content, "parts", [])
-                        chunks = [getattr(p, "text", "") for p in parts]
-                        text = "\n".join([c for c in chunks if c])
-                        if text:
-                            break
-                except Exception:
-                    pass
-            if not text:
-                raise ValueError("Empty response from Gemini.")
-            return text.strip()
+        uploaded = await file_uploads.get_or_upload(file_bytes, mime_type or "application/octet-stream")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Gemini file upload failed: {e}")
+
+    async def _run(model_local: str, cfg_local: dict) -> Any:
+        return await prompt_cache.generate(
+            model_local,
+            [uploaded, instruction],
+            generation_config=cfg_local,
+            system_instruction=FILE_SYSTEM_PROMPT,
+        )
 
-        try:
-            ans = _run(model_name, gen_cfg)
-            return ans, model_name, q_used
-        except Exception as e_primary:
-            msg = str(e_primary).lower()
-            if "404" in msg or "not found" in msg:
-                alt = model_name[:-7] if model_name.endswith("-latest") else model_name + "-latest"
-                if alt != model_name:
-                    try:
-                        ans = _run(alt, gen_cfg)
-                        return ans, alt, q_used
-                    except Exception:
-                        pass
-        # final fallbacks
-        for cand in ["gemini-1.5-pro-latest", "gemini-1.5-flash-latest"]:
-            if cand == model_name:
-                continue
-            try:
-                ans = _run(cand, gen_cfg)
-                return ans, cand, q_used
-            except Exception:
-                continue
-        raise HTTPException(status_code=502, detail="Gemini failed to analyze the file with available models.")
-    finally:
-        try:
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
+    errors: List[str] = []
+    result = await _invoke_with_fallbacks(model_name, q_used, lambda m: _run(m, gen_cfg), errors, include_pref=False, task="file")
+    if result:
+        ans, used = result
+        return ans, used, q_used
+    # The remote file may be the problem (expired/removed); upload afresh next time
+    file_uploads.forget(file_bytes, mime_type or "application/octet-stream")
+    raise HTTPException(status_code=502, detail="Gemini failed to analyze the file with available models.")
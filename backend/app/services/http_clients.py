@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import importlib.util
+import threading
+from typing import Any, Dict
+
+import httpx
+
+from app.core.config import settings
+
+# Shared outbound HTTP clients, one per service, created at startup and closed at
+# shutdown. Each client keeps its own per-host connection pool with keep-alive, so
+# repeated calls to ElevenLabs or the same site reuse TCP/TLS connections. HTTP/2 is
+# negotiated when the optional `h2` package is installed (httpx[http2]).
+
+TTS = "tts"
+CRAWL = "crawl"
+WEB = "web"
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_sync_clients: Dict[str, httpx.Client] = {}
+_sync_lock = threading.Lock()
+
+
+def _http2() -> bool:
+    return settings.HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+
+def _options(service: str) -> Dict[str, Any]:
+    read = {
+        TTS: settings.HTTP_TIMEOUT_TTS_S,
+        CRAWL: settings.HTTP_TIMEOUT_CRAWL_S,
+        WEB: settings.HTTP_TIMEOUT_WEB_S,
+    }.get(service, settings.HTTP_TIMEOUT_CRAWL_S)
+    options: Dict[str, Any] = {
+        "timeout": httpx.Timeout(read, connect=min(read, settings.HTTP_CONNECT_TIMEOUT_S)),
+        "limits": httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_S,
+        ),
+        "http2": _http2(),
+    }
+    if service in (CRAWL, WEB):
+        options["follow_redirects"] = True
+        options["headers"] = {"User-Agent": USER_AGENT}
+    return options
+
+
+def get(service: str) -> httpx.AsyncClient:
+    """Shared async client for `service` (created on first use if startup did not)."""
+    client = _clients.get(service)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_options(service))
+        _clients[service] = client
+    return client
+
+
+def get_sync(service: str) -> httpx.Client:
+    """Shared blocking client for sync code run via run_in_threadpool (e.g. web search); thread-safe."""
+    with _sync_lock:
+        client = _sync_clients.get(service)
+        if client is None or client.is_closed:
+            client = httpx.Client(**_options(service))
+            _sync_clients[service] = client
+        return client
+
+
+def start() -> None:
+    for service in (TTS, CRAWL):
+        get(service)
+    get_sync(WEB)
+
+
+async def close() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+    with _sync_lock:
+        sync_clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in sync_clients:
+        try:
+            client.close()
+        except Exception:
+            pass
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.services import single_flight, telemetry
+
+# Image preprocessing before vision calls: decode, apply EXIF orientation, cap the
+# longest side per quality tier, drop metadata and re-encode (WebP by default).
+# Decoding a 12 MP photo takes hundreds of ms of CPU, so the work runs in a process
+# pool; results are cached by content hash so re-asked images skip it entirely.
+
+_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+_cache: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+_cache_bytes = 0
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _process(data: bytes, max_side: int, fmt: str, quality: int) -> Tuple[bytes, str]:
+    """Worker: return (encoded bytes, mime type). Runs in a pool process."""
+    pil_format, mime = _FORMATS.get(fmt, _FORMATS["webp"])
+    img = Image.open(BytesIO(data))
+    # JPEG can decode straight to a reduced scale, which is most of the speed-up
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    if has_alpha and pil_format == "JPEG":
+        pil_format, mime = _FORMATS["png"]
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    # Nothing from the original (EXIF, GPS, ICC, comments) is written back
+    img.info = {}
+    out = BytesIO()
+    if pil_format == "PNG":
+        img.save(out, format="PNG", optimize=True)
+    elif pil_format == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue(), mime
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = settings.IMAGE_WORKERS or min(4, os.cpu_count() or 1)
+            # spawn, not fork: the parent holds gRPC and event-loop threads
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown(wait: bool = True) -> None:
+    """Stop the pool, cancelling queued work. With wait=True this blocks until workers exit."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def max_side_for(quality: Optional[str]) -> int:
+    if quality == "high":
+        return settings.IMAGE_MAX_SIDE_HIGH
+    if quality == "medium":
+        return settings.IMAGE_MAX_SIDE_MEDIUM
+    return settings.IMAGE_MAX_SIDE_LOW
+
+
+def _remember(key: str, value: Tuple[bytes, str]) -> None:
+    global _cache_bytes
+    old = _cache.pop(key, None)
+    if old is not None:
+        _cache_bytes -= len(old[0])
+    _cache[key] = value
+    _cache_bytes += len(value[0])
+    while _cache and _cache_bytes > settings.IMAGE_CACHE_MAX_BYTES:
+        _, (evicted, _mime) = _cache.popitem(last=False)
+        _cache_bytes -= len(evicted)
+
+
+async def prepare(data: bytes, mime_type: Optional[str], quality: Optional[str] = None) -> Tuple[bytes, str]:
+    """Return (bytes, mime) to send to Gemini for an uploaded image.
+
+    Falls back to the original upload when preprocessing is disabled or the input is
+    not a decodable image.
+    """
+    mime = mime_type or "image/png"
+    if not settings.IMAGE_PREPROCESS_ENABLED or not mime.lower().startswith("image/"):
+        return data, mime
+    fmt = (settings.IMAGE_FORMAT or "webp").lower()
+    max_side = max_side_for(quality)
+    key = hashlib.sha256(data).hexdigest() + f":{max_side}:{fmt}:{settings.IMAGE_QUALITY}"
+    hit = _cache.get(key)
+    if hit is not None:
+        _cache.move_to_end(key)
+        telemetry.incr("image_preprocess_cache_hit")
+        return hit
+
+    async def _run() -> Tuple[bytes, str]:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(_get_pool(), _process, data, max_side, fmt, settings.IMAGE_QUALITY)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a decompression bomb); start a fresh pool next time.
+            # Don't wait for the broken pool's workers on the event loop
+            shutdown(wait=False)
+            raise
+        telemetry.incr("image_preprocess_bytes_in", len(data))
+        telemetry.incr("image_preprocess_bytes_out", len(result[0]))
+        return result
+
+    try:
+        processed, out_mime = await single_flight.do("image", key, _run)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        telemetry.incr("image_preprocess_error")
+        return data, mime
+    _remember(key, (processed, out_mime))
+    return processed, out_mime
+
+
+def stats() -> Dict[str, float]:
+    return {"entries": len(_cache), "bytes": _cache_bytes, **telemetry.counters("image_preprocess_")}
@@ -3,9 +3,8 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
-import google.generativeai as genai
-
 from app.core.config import settings
+from app.services import gemini_client, gemini_scheduler
 from app.db.mongo import get_db
 from app.repositories.chat_repo import get_conversation
 
@@ -34,14 +33,14 @@ async def get_user_memory(user_key: Optional[str]) -> Dict[str, Any]:
     }
 
 
-def _summarize_with_gemini(text: str, max_words: int = 120) -> str:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
+async def _summarize_with_gemini(text: str, max_words: int = 120) -> str:
     prompt = (
         "Summarize the following conversation snippet into "+str(max_words)+" words max, "
         "focusing on user goals, constraints, decisions, and key facts.\n\n" + text
     )
-    model = genai.GenerativeModel(model_name=settings.GEMINI_MODEL)
-    resp = model.generate_content(prompt)
+    # Summaries queue behind interactive chat in the outbound scheduler
+    with gemini_scheduler.use_priority(gemini_scheduler.BACKGROUND):
+        resp = await gemini_client.generate(settings.GEMINI_MODEL, prompt)
     return (getattr(resp, "text", "") or "").strip()
 
 
@@ -52,7 +51,7 @@ async def update_conversation_summary(conversation_id: str, user_key: Optional[s
     last_msgs = msgs[- settings.MEMORY_MAX_MESSAGES :]
     transcript = "\n".join([f"{m['role']}: {m['content']}" for m in last_msgs])
     try:
-        summary = _summarize_with_gemini(transcript)
+        summary = await _summarize_with_gemini(transcript)
     except Exception:
         summary = transcript[:800]  # fallback: crude truncation
 
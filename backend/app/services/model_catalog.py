@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import google.generativeai as genai
+
+from app.core.config import settings
+from app.services import gemini_client
+
+# Cached list of Gemini model ids that support text generation. Request paths only
+# ever read the cached list; it is warmed at startup, refreshed periodically in the
+# background and revalidated on access once older than MODEL_CATALOG_TTL_S. All of
+# these share one in-flight refresh, so list_models is never called twice at once.
+_names: List[str] = []
+_fetched_at: float = 0.0
+_last_error: Optional[str] = None
+_failed_at: float = 0.0
+_refreshing: Optional[asyncio.Task] = None
+_loop_task: Optional[asyncio.Task] = None
+
+
+def _fetch_names() -> List[str]:
+    """Blocking list_models call; returns model ids without the 'models/' prefix."""
+    gemini_client.configure()
+    names = []
+    for m in genai.list_models():
+        methods = getattr(m, "supported_generation_methods", []) or []
+        # Some SDK versions used 'createContent', keep both for safety
+        if "generateContent" in methods or "createContent" in methods:
+            name = getattr(m, "name", "") or ""
+            if name.startswith("models/"):
+                name = name.split("/", 1)[1]
+            if name:
+                names.append(name)
+    # de-duplicate and sort for stability
+    return sorted(set(names))
+
+
+async def _refresh() -> List[str]:
+    global _names, _fetched_at, _last_error, _failed_at
+    if not settings.GEMINI_API_KEY:
+        _last_error = "GEMINI_API_KEY not configured"
+        _failed_at = time.monotonic()
+        return _names
+    try:
+        names = await asyncio.to_thread(_fetch_names)
+    except Exception as e:
+        _last_error = str(e)
+        _failed_at = time.monotonic()
+        return _names
+    _names = names
+    _fetched_at = time.monotonic()
+    _last_error = None
+    _failed_at = 0.0
+    return _names
+
+
+def _refresh_task() -> asyncio.Task:
+    """The in-flight refresh, starting one if none is running."""
+    global _refreshing
+    if _refreshing is None or _refreshing.done():
+        _refreshing = asyncio.get_running_loop().create_task(_refresh())
+    return _refreshing
+
+
+async def refresh() -> List[str]:
+    """Fetch the model list now (or join the refresh already running). On failure the previous list is kept."""
+    # Shielded: a caller giving up must not cancel the refresh others are waiting on
+    return await asyncio.shield(_refresh_task())
+
+
+def _is_stale() -> bool:
+    return not _fetched_at or (time.monotonic() - _fetched_at) > settings.MODEL_CATALOG_TTL_S
+
+
+def _revalidate() -> None:
+    """Start a background refresh if none is running."""
+    try:
+        _refresh_task()
+    except RuntimeError:
+        # No running event loop (sync caller): the periodic refresher will catch up
+        pass
+
+
+def _backing_off() -> bool:
+    # After a failed refresh wait before the next one, or an outage turns every
+    # request into another list_models call
+    return bool(_failed_at) and (time.monotonic() - _failed_at) < min(settings.MODEL_CATALOG_TTL_S, 30.0)
+
+
+def get_names() -> List[str]:
+    """Return the cached model ids without waiting; stale lists trigger a background refresh."""
+    if _is_stale() and not _backing_off():
+        _revalidate()
+    return list(_names)
+
+
+async def _refresh_loop() -> None:
+    while True:
+        await asyncio.sleep(max(5.0, settings.MODEL_CATALOG_TTL_S))
+        await refresh()
+
+
+async def start() -> None:
+    """Warm the catalog (bounded by MODEL_CATALOG_WARM_TIMEOUT_S) and start the refresher."""
+    global _loop_task
+    try:
+        await asyncio.wait_for(refresh(), timeout=settings.MODEL_CATALOG_WARM_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        # The refresh keeps running in the background; the first request joins it
+        pass
+    if _loop_task is None or _loop_task.done():
+        _loop_task = asyncio.get_running_loop().create_task(_refresh_loop())
+
+
+async def stop() -> None:
+    global _loop_task
+    for task in (_loop_task, _refreshing):
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+    _loop_task = None
+
+
+def snapshot() -> Dict[str, Any]:
+    age = (time.monotonic() - _fetched_at) if _fetched_at else None
+    return {
+        "models": list(_names),
+        "age_s": round(age, 1) if age is not None else None,
+        "stale": _is_stale(),
+        **({"error": _last_error} if _last_error else {}),
+    }
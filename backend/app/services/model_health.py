@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+# Process-wide health registry for Gemini models. Each model has a circuit breaker:
+#   closed    -> calls allowed, failures counted
+#   open      -> calls skipped until the cool-down expires
+#   half_open -> cool-down expired; a single probe call decides closed vs open
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _ModelHealth:
+    __slots__ = (
+        "name",
+        "state",
+        "consecutive_failures",
+        "failure_ewma",
+        "latency_ewma",
+        "open_until",
+        "probing",
+        "successes",
+        "failures",
+        "last_error",
+        "updated_at",
+        "latencies",
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failure_ewma = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.open_until = 0.0
+        self.probing = False
+        self.successes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.updated_at = 0.0
+        # Recent successful-call latencies (seconds) for percentile estimates
+        self.latencies: deque = deque(maxlen=settings.MODEL_LATENCY_SAMPLES)
+
+
+_models: Dict[str, _ModelHealth] = {}
+_lock = threading.Lock()
+
+
+def _get(name: str) -> _ModelHealth:
+    h = _models.get(name)
+    if h is None:
+        h = _ModelHealth(name)
+        _models[name] = h
+    return h
+
+
+def _ewma(prev: Optional[float], value: float) -> float:
+    alpha = settings.MODEL_HEALTH_EWMA_ALPHA
+    if prev is None:
+        return value
+    return alpha * value + (1 - alpha) * prev
+
+
+def _is_not_found(error: Optional[str]) -> bool:
+    msg = (error or "").lower()
+    return "404" in msg or "not found" in msg
+
+
+def _refresh_state(h: _ModelHealth, now: float) -> None:
+    if h.state == OPEN and now >= h.open_until:
+        h.state = HALF_OPEN
+        h.probing = False
+
+
+def record_success(name: str, latency_s: float) -> None:
+    with _lock:
+        h = _get(name)
+        h.successes += 1
+        h.consecutive_failures = 0
+        h.failure_ewma = _ewma(h.failure_ewma, 0.0)
+        h.latency_ewma = _ewma(h.latency_ewma, max(0.0, latency_s))
+        h.latencies.append(max(0.0, latency_s))
+        h.state = CLOSED
+        h.probing = False
+        h.updated_at = time.time()
+
+
+def record_failure(name: str, latency_s: float, error: Optional[str] = None) -> None:
+    """Count a failed call. Trips the breaker after MODEL_BREAKER_FAILURES consecutive
+    failures, on a failed half-open probe, or immediately when the model does not exist."""
+    with _lock:
+        h = _get(name)
+        now = time.monotonic()
+        h.failures += 1
+        h.consecutive_failures += 1
+        h.failure_ewma = _ewma(h.failure_ewma, 1.0)
+        h.latency_ewma = _ewma(h.latency_ewma, max(0.0, latency_s))
+        h.last_error = (error or "")[:300] or None
+        h.updated_at = time.time()
+        trip = (
+            h.state == HALF_OPEN
+            or h.consecutive_failures >= settings.MODEL_BREAKER_FAILURES
+            or _is_not_found(error)
+        )
+        if trip:
+            cooldown = settings.MODEL_BREAKER_COOLDOWN_S
+            if _is_not_found(error):
+                cooldown = max(cooldown, settings.MODEL_NOT_FOUND_COOLDOWN_S)
+            h.state = OPEN
+            h.open_until = now + cooldown
+        h.probing = False
+
+
+def is_available(name: str) -> bool:
+    """True when a call to `name` may be attempted right now."""
+    with _lock:
+        h = _models.get(name)
+        if h is None:
+            return True
+        _refresh_state(h, time.monotonic())
+        if h.state == OPEN:
+            return False
+        if h.state == HALF_OPEN and h.probing:
+            return False
+        return True
+
+
+def begin_attempt(name: str) -> None:
+    """Mark a half-open model as being probed so concurrent requests skip it."""
+    with _lock:
+        h = _models.get(name)
+        if h is None:
+            return
+        _refresh_state(h, time.monotonic())
+        if h.state == HALF_OPEN:
+            h.probing = True
+
+
+def end_attempt(name: str) -> None:
+    """Release a half-open probe without recording an outcome (e.g. the call was cancelled)."""
+    with _lock:
+        h = _models.get(name)
+        if h is not None:
+            h.probing = False
+
+
+def order_candidates(names: List[str]) -> List[str]:
+    """Return `names` without models whose breaker is open, healthiest first.
+
+    Closed models with a low failure rate keep their original (preference) order and
+    come first; degraded or half-open models follow. When every candidate is open,
+    the one whose cool-down ends soonest is returned alone so traffic can still probe.
+    """
+    seen: set[str] = set()
+    uniq = [n for n in names if n and not (n in seen or seen.add(n))]
+    now = time.monotonic()
+    healthy: List[str] = []
+    degraded: List[str] = []
+    soonest: Optional[_ModelHealth] = None
+    with _lock:
+        for n in uniq:
+            h = _models.get(n)
+            if h is None:
+                healthy.append(n)
+                continue
+            _refresh_state(h, now)
+            if h.state == OPEN or (h.state == HALF_OPEN and h.probing):
+                if soonest is None or h.open_until < soonest.open_until:
+                    soonest = h
+                continue
+            if h.state == HALF_OPEN or h.failure_ewma >= settings.MODEL_HEALTH_DEGRADED_RATE:
+                degraded.append(n)
+            else:
+                healthy.append(n)
+    ordered = healthy + degraded
+    if not ordered and soonest is not None:
+        ordered = [soonest.name]
+    return ordered
+
+
+def latency_ewma(name: str) -> Optional[float]:
+    with _lock:
+        h = _models.get(name)
+        return h.latency_ewma if h else None
+
+
+def latency_percentile(name: str, q: float, min_samples: int = 1) -> Optional[float]:
+    """Return the q-quantile (0..1) of recent successful latencies, or None with too few samples."""
+    with _lock:
+        h = _models.get(name)
+        samples = sorted(h.latencies) if h else []
+    if len(samples) < max(1, min_samples):
+        return None
+    idx = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+    return samples[idx]
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """Return per-model health for diagnostics (admin UI)."""
+    now = time.monotonic()
+    out: List[Dict[str, Any]] = []
+    with _lock:
+        for h in _models.values():
+            _refresh_state(h, now)
+            out.append({
+                "model": h.name,
+                "state": h.state,
+                "consecutive_failures": h.consecutive_failures,
+                "failure_rate": round(h.failure_ewma, 4),
+                "latency_ms": round(h.latency_ewma * 1000, 1) if h.latency_ewma is not None else None,
+                "successes": h.successes,
+                "failures": h.failures,
+                "cooldown_remaining_s": round(max(0.0, h.open_until - now), 1) if h.state == OPEN else 0.0,
+                "last_error": h.last_error,
+            })
+    out.sort(key=lambda x: x["model"])
+    return out
+
+
+def reset() -> None:
+    with _lock:
+        _models.clear()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.db.mongo import get_db
+
+# Latency-aware routing. Rolling latency and error statistics are kept per (task, model)
+# for task in text | stream | vision | file (stream latency is time to first chunk).
+# Within a quality tier the candidates arrive best-first by name heuristic; the router
+# keeps that order but skips models whose recent latency percentile or error rate
+# misses the task's SLO. Models without enough recent samples are assumed to meet it,
+# so new and long-unused models get re-measured.
+
+DEFAULT_SLO_MS = 6000
+
+
+class _RouteStats:
+    __slots__ = ("latencies", "error_ewma", "samples", "updated_at")
+
+    def __init__(self) -> None:
+        self.latencies: deque = deque(maxlen=settings.MODEL_LATENCY_SAMPLES)
+        self.error_ewma = 0.0
+        self.samples = 0
+        self.updated_at = 0.0
+
+
+_stats: Dict[Tuple[str, str], _RouteStats] = {}
+_lock = threading.Lock()
+
+
+def _slo_map() -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for item in (settings.ROUTER_SLO_MS or "").split(","):
+        task, _, value = item.partition("=")
+        try:
+            if task.strip():
+                out[task.strip()] = int(value)
+        except ValueError:
+            continue
+    return out
+
+
+def slo_ms(task: str) -> int:
+    return _slo_map().get(task, DEFAULT_SLO_MS)
+
+
+def _record(task: str, model: str, latency_s: Optional[float], ok: bool, at: float) -> None:
+    key = (task, model)
+    s = _stats.get(key)
+    if s is None:
+        s = _RouteStats()
+        _stats[key] = s
+    alpha = settings.MODEL_HEALTH_EWMA_ALPHA
+    s.error_ewma = (1 - alpha) * s.error_ewma + alpha * (0.0 if ok else 1.0)
+    if ok and latency_s is not None:
+        s.latencies.append(latency_s)
+    s.samples += 1
+    s.updated_at = max(s.updated_at, at)
+
+
+def _record_censored(task: str, model: str, latency_s: float, at: float) -> None:
+    key = (task, model)
+    s = _stats.get(key)
+    if s is None:
+        s = _RouteStats()
+        _stats[key] = s
+    s.latencies.append(latency_s)
+    s.samples += 1
+    s.updated_at = max(s.updated_at, at)
+
+
+def record(task: str, model: str, latency_s: Optional[float], ok: bool) -> None:
+    """Record one call outcome for (task, model)."""
+    with _lock:
+        _record(task, model, latency_s, ok, time.monotonic())
+
+
+def record_censored(task: str, model: str, latency_s: float) -> None:
+    """Record a call abandoned after `latency_s` (e.g. the primary lost to a hedge).
+
+    Its true latency is at least that long, so it is kept as a latency sample; the
+    error rate is left alone since the call did not fail.
+    """
+    with _lock:
+        _record_censored(task, model, latency_s, time.monotonic())
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _evaluate(task: str, model: str, now: float) -> Optional[Tuple[float, float]]:
+    """(latency percentile in ms, error rate) for a model with enough fresh samples, else None."""
+    s = _stats.get((task, model))
+    if s is None or s.samples < max(1, settings.ROUTER_MIN_SAMPLES):
+        return None
+    if now - s.updated_at > settings.ROUTER_STALE_S:
+        return None
+    if not s.latencies:
+        return float("inf"), s.error_ewma
+    return _percentile(list(s.latencies), settings.ROUTER_SLO_PERCENTILE) * 1000, s.error_ewma
+
+
+def choose(task: str, candidates: List[str]) -> Optional[str]:
+    """Pick the best-ranked candidate that meets the task's latency SLO.
+
+    `candidates` must be ordered best-first for the quality tier. When none meets the
+    SLO, the one with the lowest error-weighted latency is returned.
+    """
+    if not candidates:
+        return None
+    if not settings.ROUTER_ENABLED or len(candidates) == 1:
+        return candidates[0]
+    target = slo_ms(task)
+    now = time.monotonic()
+    fallback: Optional[Tuple[float, str]] = None
+    with _lock:
+        for name in candidates:
+            measured = _evaluate(task, name, now)
+            if measured is None:
+                return name
+            latency_ms, error_rate = measured
+            if latency_ms <= target and error_rate <= settings.ROUTER_MAX_ERROR_RATE:
+                return name
+            # Expected latency per successful call
+            cost = latency_ms / max(0.01, 1 - error_rate)
+            if fallback is None or cost < fallback[0]:
+                fallback = (cost, name)
+    return fallback[1] if fallback else candidates[0]
+
+
+async def seed_from_telemetry() -> int:
+    """Replay recent 'llm_call' events from the telemetry collection. Returns attempts loaded."""
+    since = datetime.utcnow() - timedelta(hours=settings.ROUTER_SEED_HOURS)
+    db = get_db()
+    cursor = (
+        db.telemetry.find({"event": "llm_call", "ts": {"$gte": since}}, {"ts": 1, "data": 1})
+        .sort("ts", -1)
+        .limit(max(0, settings.ROUTER_SEED_MAX_EVENTS))
+    )
+    docs = [d async for d in cursor]
+    loaded = 0
+    now_wall = datetime.utcnow()
+    now = time.monotonic()
+    with _lock:
+        # Oldest first, so the EWMAs and sample windows end on the newest events
+        for doc in reversed(docs):
+            data = doc.get("data") or {}
+            task = data.get("task")
+            ts = doc.get("ts")
+            if not task or not isinstance(ts, datetime):
+                continue
+            at = now - max(0.0, (now_wall - ts).total_seconds())
+            for attempt in data.get("attempts") or []:
+                outcome = attempt.get("outcome")
+                model = attempt.get("model")
+                latency_ms = attempt.get("latency_ms")
+                if "ttft_ms" in attempt:
+                    # Streams are judged on time to first chunk, whatever happened after it
+                    outcome, latency_ms = "ok", attempt["ttft_ms"]
+                if model and isinstance(attempt.get("censored_ms"), (int, float)):
+                    _record_censored(task, model, attempt["censored_ms"] / 1000, at)
+                    loaded += 1
+                    continue
+                if not model or outcome not in ("ok", "error"):
+                    continue
+                latency_s = latency_ms / 1000 if isinstance(latency_ms, (int, float)) else None
+                _record(task, model, latency_s, outcome == "ok", at)
+                loaded += 1
+    return loaded
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """Per (task, model) routing statistics for diagnostics."""
+    now = time.monotonic()
+    out: List[Dict[str, Any]] = []
+    with _lock:
+        for (task, model), s in _stats.items():
+            p = _percentile(list(s.latencies), settings.ROUTER_SLO_PERCENTILE) if s.latencies else None
+            out.append({
+                "task": task,
+                "model": model,
+                "samples": s.samples,
+                "latency_p_ms": round(p * 1000) if p is not None else None,
+                "error_rate": round(s.error_ewma, 3),
+                "slo_ms": slo_ms(task),
+                "age_s": round(now - s.updated_at, 1),
+            })
+    return sorted(out, key=lambda r: (r["task"], r["model"]))
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
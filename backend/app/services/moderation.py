@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+
+BLOCKED_MESSAGE = "Your message contains disallowed content."
+BLOCKED_OUTPUT_MESSAGE = "[response withheld: disallowed content]"
+
+
+class Matcher:
+    """Aho-Corasick automaton over lowercased block words.
+
+    Built once per block list; a scan is a single pass over the text regardless of
+    how many words are blocked.
+    """
+
+    def __init__(self, words: Iterable[str]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[str]] = [None]
+        self._depth: List[int] = [0]
+        for w in words:
+            w = (w or "").lower()
+            if w:
+                self._add(w)
+        self._build()
+
+    def _add(self, word: str) -> None:
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(None)
+                self._depth.append(self._depth[state] + 1)
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state] = word
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # Inherit matches that end at the fallback state (e.g. "he" inside "she")
+                if self._out[nxt] is None:
+                    self._out[nxt] = self._out[self._fail[nxt]]
+
+    @property
+    def empty(self) -> bool:
+        return len(self._goto) == 1
+
+    def step(self, state: int, ch: str) -> Tuple[int, Optional[str]]:
+        """Advance one (already lowercased) character; returns (new_state, matched_word)."""
+        while state and ch not in self._goto[state]:
+            state = self._fail[state]
+        state = self._goto[state].get(ch, 0)
+        return state, self._out[state]
+
+    def depth(self, state: int) -> int:
+        """Length of the partial match held in `state`."""
+        return self._depth[state]
+
+    def find(self, text: str) -> Optional[str]:
+        """Return the first block word found in `text`, or None."""
+        state = 0
+        for ch in (text or "").lower():
+            state, hit = self.step(state, ch)
+            if hit:
+                return hit
+        return None
+
+
+_matcher: Optional[Matcher] = None
+_matcher_words: Optional[Tuple[str, ...]] = None
+_lock = threading.Lock()
+
+
+def get_matcher() -> Matcher:
+    """Matcher for the current settings.SAFETY_BLOCK_WORDS, rebuilt only when the list changes."""
+    global _matcher, _matcher_words
+    words = tuple(settings.SAFETY_BLOCK_WORDS or [])
+    if _matcher is not None and words == _matcher_words:
+        return _matcher
+    with _lock:
+        if _matcher is None or words != _matcher_words:
+            _matcher = Matcher(words)
+            _matcher_words = words
+        return _matcher
+
+
+def check_text(text: str) -> Optional[str]:
+    """Return an error message if `text` contains blocked content, else None."""
+    matcher = get_matcher()
+    if matcher.empty:
+        return None
+    if matcher.find(text):
+        return BLOCKED_MESSAGE
+    return None
+
+
+class StreamScanner:
+    """Incremental matcher for streamed output.
+
+    feed() returns the part of the stream that is safe to send now: everything except
+    the trailing characters that could still be the start of a block word, so a
+    blocked word is never partially emitted. Call flush() at the end of the stream.
+    """
+
+    def __init__(self, matcher: Optional[Matcher] = None) -> None:
+        self.matcher = matcher or get_matcher()
+        self.state = 0
+        self.pending = ""
+        self.blocked: Optional[str] = None
+
+    def feed(self, chunk: str) -> str:
+        if self.blocked:
+            return ""
+        if self.matcher.empty:
+            return chunk
+        for ch in chunk:
+            for lc in ch.lower():
+                self.state, hit = self.matcher.step(self.state, lc)
+                if hit:
+                    self.blocked = hit
+                    self.pending = ""
+                    return ""
+        text = self.pending + chunk
+        hold = min(len(text), self.matcher.depth(self.state))
+        self.pending = text[len(text) - hold:] if hold else ""
+        return text[: len(text) - hold]
+
+    def flush(self) -> str:
+        out, self.pending = ("" if self.blocked else self.pending), ""
+        return out
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import settings
+from app.services import gemini_client, telemetry
+from app.services.token_budget import estimate_tokens, text_tokens
+
+# Context (prefix) caching for Gemini calls. The static system instructions plus the
+# stable older part of a conversation are stored once as a cached prefix; each call
+# then sends only the new suffix. Prefix boundaries snap to PROMPT_CACHE_BLOCK_MESSAGES
+# so the same prefix is reused for several turns of a conversation.
+#
+# Backends (PROMPT_CACHE_BACKEND):
+#   off    -> every call sends the full prompt
+#   gemini -> server-side CachedContent resources
+#   local  -> offline stand-in that keeps prefixes in process and re-expands them
+
+
+class PrefixHandle:
+    __slots__ = ("key", "name", "model", "expires_at", "tokens", "prefix_len", "resource")
+
+    def __init__(self, key: str, name: str, model: str, expires_at: float, tokens: int, prefix_len: int, resource: Any = None) -> None:
+        self.key = key
+        self.name = name
+        self.model = model
+        self.expires_at = expires_at
+        self.tokens = tokens
+        self.prefix_len = prefix_len
+        self.resource = resource
+
+
+def _as_contents(suffix: Any) -> List[Any]:
+    """Normalize a message (str / parts) or contents list to a contents list."""
+    if isinstance(suffix, list) and suffix and isinstance(suffix[0], dict) and "role" in suffix[0]:
+        return list(suffix)
+    return [{"role": "user", "parts": suffix if isinstance(suffix, list) else [suffix]}]
+
+
+class LocalPrefixBackend:
+    """Offline stand-in: remembers prefixes in memory and sends prefix + suffix as one request."""
+
+    def __init__(self) -> None:
+        self._prefixes: Dict[str, Tuple[Optional[str], List[Any]]] = {}
+
+    async def create(self, key: str, model_name: str, system_instruction: Optional[str], contents: List[Any], ttl_s: float) -> Tuple[str, Any]:
+        name = "local/" + key[:24]
+        self._prefixes[name] = (system_instruction, list(contents))
+        return name, None
+
+    async def generate(self, handle: PrefixHandle, suffix: Any, generation_config: Optional[dict]) -> Any:
+        try:
+            system_instruction, prefix = self._prefixes[handle.name]
+        except KeyError:
+            raise google_exceptions.NotFound(f"cached prefix {handle.name} not found")
+        contents = prefix + _as_contents(suffix) if prefix else suffix
+        return await gemini_client.generate(handle.model, contents, generation_config=generation_config, system_instruction=system_instruction)
+
+    async def delete(self, name: str) -> None:
+        self._prefixes.pop(name, None)
+
+
+class GeminiPrefixBackend:
+    """Server-side context caching via google.generativeai.caching.CachedContent."""
+
+    async def create(self, key: str, model_name: str, system_instruction: Optional[str], contents: List[Any], ttl_s: float) -> Tuple[str, Any]:
+        gemini_client.configure()
+        cached = await asyncio.to_thread(
+            genai.caching.CachedContent.create,
+            model=model_name,
+            display_name="taliyo-" + key[:24],
+            system_instruction=system_instruction,
+            contents=contents or None,
+            ttl=timedelta(seconds=ttl_s),
+        )
+        return cached.name, cached
+
+    async def generate(self, handle: PrefixHandle, suffix: Any, generation_config: Optional[dict]) -> Any:
+        return await gemini_client.generate_cached(handle.resource or handle.name, handle.model, suffix, generation_config)
+
+    async def delete(self, name: str) -> None:
+        gemini_client.forget_cached_model(name)
+        try:
+            await asyncio.to_thread(lambda: genai.caching.CachedContent.get(name).delete())
+        except Exception:
+            pass
+
+
+_local_backend = LocalPrefixBackend()
+_gemini_backend = GeminiPrefixBackend()
+_entries: "OrderedDict[str, PrefixHandle]" = OrderedDict()
+_creating: Dict[str, asyncio.Future] = {}
+# model -> monotonic time until which prefix caching is not attempted (creation failed)
+_unsupported: Dict[str, float] = {}
+_background: set[asyncio.Task] = set()
+
+
+def _backend() -> Any:
+    mode = (settings.PROMPT_CACHE_BACKEND or "off").lower()
+    if mode == "gemini":
+        return _gemini_backend
+    if mode == "local":
+        return _local_backend
+    return None
+
+
+def _key(model_name: str, system_instruction: Optional[str], prefix: List[Any]) -> str:
+    raw = json.dumps([model_name, system_instruction, prefix], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _content_tokens(contents: List[Any]) -> int:
+    total = 0
+    for c in contents:
+        parts = c.get("parts", []) if isinstance(c, dict) else [c]
+        total += sum(text_tokens(p) for p in parts if isinstance(p, str))
+    return total
+
+
+def _prefix_cut(n_messages: int) -> int:
+    """Number of history messages that belong to the cacheable prefix."""
+    block = max(1, settings.PROMPT_CACHE_BLOCK_MESSAGES)
+    stable = n_messages - max(0, settings.PROMPT_CACHE_TAIL_MESSAGES)
+    return max(0, (stable // block) * block)
+
+
+def _spawn(coro: Any) -> None:
+    task = asyncio.get_running_loop().create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _drop(key: str) -> None:
+    handle = _entries.pop(key, None)
+    backend = _backend()
+    if handle is not None and backend is not None:
+        _spawn(backend.delete(handle.name))
+
+
+def _cache_gone(exc: Exception) -> bool:
+    """The cached prefix itself is missing or expired (not a model or quota failure)."""
+    return isinstance(exc, (google_exceptions.NotFound, google_exceptions.PermissionDenied))
+
+
+def _caching_unsupported(exc: Exception) -> bool:
+    """Creation was refused for this model or prefix size; retrying soon would fail again."""
+    if isinstance(exc, (google_exceptions.InvalidArgument, google_exceptions.NotFound)):
+        return True
+    msg = str(exc).lower()
+    return "not supported" in msg or "too small" in msg or "min_total_token_count" in msg
+
+
+def _live(key: str) -> Optional[PrefixHandle]:
+    handle = _entries.get(key)
+    if handle is None:
+        return None
+    if handle.expires_at - time.monotonic() <= settings.PROMPT_CACHE_REFRESH_MARGIN_S:
+        # Expired (or about to): forget it and let the next call create a fresh one
+        _drop(key)
+        return None
+    _entries.move_to_end(key)
+    return handle
+
+
+async def resolve(model_name: str, system_instruction: Optional[str], history: List[Any]) -> Tuple[Optional[PrefixHandle], List[Any]]:
+    """Return (cached prefix handle or None, history messages still to send)."""
+    backend = _backend()
+    if backend is None or _unsupported.get(model_name, 0) > time.monotonic():
+        return None, history
+
+    cut = _prefix_cut(len(history))
+    prefix = list(history[:cut])
+    tokens = estimate_tokens(system_instruction or "") + _content_tokens(prefix)
+    if tokens < settings.PROMPT_CACHE_MIN_TOKENS:
+        telemetry.incr("prompt_cache_skip_small")
+        return None, history
+
+    key = _key(model_name, system_instruction, prefix)
+    handle = _live(key)
+    if handle is not None:
+        telemetry.incr("prompt_cache_hit")
+        return handle, history[cut:]
+
+    pending = _creating.get(key)
+    if pending is not None:
+        # Another request is already creating this prefix; share its result
+        try:
+            handle = await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+            handle = None
+        except Exception:
+            handle = None
+        return (handle, history[cut:]) if handle else (None, history)
+
+    fut: asyncio.Future = asyncio.get_running_loop().create_future()
+    _creating[key] = fut
+    try:
+        ttl = settings.PROMPT_CACHE_TTL_S
+        name, resource = await backend.create(key, model_name, system_instruction, prefix, ttl)
+        handle = PrefixHandle(key, name, model_name, time.monotonic() + ttl, tokens, cut, resource)
+        _entries[key] = handle
+        while len(_entries) > max(1, settings.PROMPT_CACHE_MAX_ENTRIES):
+            _drop(next(iter(_entries)))
+        telemetry.incr("prompt_cache_create")
+        fut.set_result(handle)
+    except Exception as e:
+        telemetry.incr("prompt_cache_error")
+        if _caching_unsupported(e):
+            # Model does not support caching (or the prefix is under its minimum); back off.
+            # Transient failures (quota, 5xx, timeouts) just skip the cache for this call.
+            _unsupported[model_name] = time.monotonic() + settings.PROMPT_CACHE_RETRY_S
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved
+        return None, history
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    finally:
+        _creating.pop(key, None)
+    return handle, history[cut:]
+
+
+async def generate(
+    model_name: str,
+    message: Any,
+    history: Optional[List[Any]] = None,
+    generation_config: Optional[dict] = None,
+    system_instruction: Optional[str] = None,
+) -> Any:
+    """generate_content with the cacheable prefix (system instruction + older history) served from cache.
+
+    Falls back to sending the full prompt when no prefix applies or the cached prefix
+    turns out to be gone; any other error from the cached call is raised, so an outage
+    does not double the load with a second full-prompt call.
+    """
+    history = list(history or [])
+    handle, rest = await resolve(model_name, system_instruction, history)
+    if handle is not None:
+        backend = _backend()
+        try:
+            return await backend.generate(handle, gemini_client.build_contents(message, rest), generation_config)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not _cache_gone(e):
+                raise
+            # Evicted or expired server-side; forget it and send the full prompt
+            telemetry.incr("prompt_cache_error")
+            _drop(handle.key)
+    return await gemini_client.generate(
+        model_name,
+        gemini_client.build_contents(message, history),
+        generation_config=generation_config,
+        system_instruction=system_instruction,
+    )
+
+
+def stats() -> Dict[str, Any]:
+    now = time.monotonic()
+    return {
+        "backend": (settings.PROMPT_CACHE_BACKEND or "off").lower(),
+        "entries": [
+            {"name": h.name, "model": h.model, "tokens": h.tokens, "prefix_messages": h.prefix_len, "expires_in_s": round(h.expires_at - now, 1)}
+            for h in _entries.values()
+        ],
+        **telemetry.counters("prompt_cache_"),
+    }
@@ -5,23 +5,20 @@ from typing import List, Dict, Any, Optional, Tuple, Iterable
 from io import BytesIO
 import hashlib
 
-import google.generativeai as genai
 from bson import ObjectId
 from pypdf import PdfReader
 
 from app.core.config import settings
 from app.db.mongo import get_db
+from app.services import gemini_client, gemini_scheduler
 
 
-def _embed_text(text: str) -> List[float]:
-    """Return embedding vector for the given text using Google embeddings."""
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-    model = settings.EMBEDDING_MODEL
-    result = genai.embed_content(model=model, content=text)
-    vec = result.get("embedding") or result.get("data", {}).get("embedding")
-    if not isinstance(vec, list):
-        raise RuntimeError("Failed to get embedding vector from Google API response")
-    return vec
+async def _embed_text(text: str) -> List[float]:
+    """Return embedding vector for the given text using Google embeddings.
+
+    Identical concurrent requests (e.g. the same query from several users) share one call.
+    """
+    return await gemini_client.embed(text, model=settings.EMBEDDING_MODEL)
 
 
 async def ensure_rag_indexes() -> None:
@@ -34,7 +31,7 @@ async def ensure_rag_indexes() -> None:
     coll_name = settings.RAG_COLLECTION
     try:
         # Determine embedding dimensionality dynamically
-        dim = len(_embed_text("dimension probe"))
+        dim = len(await _embed_text("dimension probe"))
         definition = {
             "fields": [
                 {
@@ -61,7 +58,9 @@ async def ensure_rag_indexes() -> None:
 async def upsert_document(text: str, metadata: Optional[Dict[str, Any]] = None, id: Optional[str] = None) -> str:
     db = get_db()
     coll = db[settings.RAG_COLLECTION]
-    emb = _embed_text(text)
+    # Ingestion embeddings queue behind interactive and background Gemini calls
+    with gemini_scheduler.use_priority(gemini_scheduler.INGEST):
+        emb = await _embed_text(text)
     now = datetime.utcnow()
     doc: Dict[str, Any] = {
         "text": text,
@@ -86,7 +85,7 @@ async def upsert_document(text: str, metadata: Optional[Dict[str, Any]] = None,
 async def query_similar(query: str, k: int = 5) -> List[Dict[str, Any]]:
     db = get_db()
     coll = db[settings.RAG_COLLECTION]
-    emb = _embed_text(query)
+    emb = await _embed_text(query)
     pipeline = [
         {
             "$vectorSearch": {
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from operator import mul
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services import gemini_client, telemetry
+
+# Two-tier cache for generate_reply:
+#   exact    -> sha256(scope, normalized message, prior-turns digest, model, gen_cfg)
+#   semantic -> bucket(scope, prior-turns digest, model, gen_cfg) + cosine similarity
+#               of the message embedding against RESPONSE_CACHE_SEMANTIC_THRESHOLD
+# Both tiers expire entries after RESPONSE_CACHE_TTL_S and evict least recently used.
+
+
+class _LRU:
+    """Thread-safe LRU map with per-entry expiry."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl_s: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > max(1, self.max_entries):
+                self._data.popitem(last=False)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Live (unexpired) entries, most recently used last."""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (exp, v) in self._data.items() if exp > now]
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_exact = _LRU(settings.RESPONSE_CACHE_MAX_ENTRIES)
+_semantic = _LRU(settings.RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES)
+
+
+class CacheProbe:
+    """Result of a cache lookup; pass it back to store() after a miss."""
+
+    __slots__ = ("key", "bucket", "embedding", "hit", "tier")
+
+    def __init__(self, key: str, bucket: str) -> None:
+        self.key = key
+        self.bucket = bucket
+        self.embedding: Optional[List[float]] = None
+        self.hit: Optional[Tuple[str, str]] = None
+        self.tier: Optional[str] = None
+
+
+def normalize(message: str) -> str:
+    return re.sub(r"\s+", " ", (message or "").strip().lower())
+
+
+def _digest(obj: Any) -> str:
+    raw = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def history_digest(history: Optional[List[Dict[str, Any]]]) -> str:
+    """Digest of the prior turns. The trailing user turn is the question itself, so it is excluded."""
+    turns = list(history or [])
+    if turns and turns[-1].get("role") == "user":
+        turns = turns[:-1]
+    return _digest([[m.get("role"), m.get("content", "")] for m in turns])
+
+
+def scope_for(user_key: Optional[str] = None, conversation_id: Optional[str] = None) -> str:
+    """Cache partition for a request according to RESPONSE_CACHE_SCOPE (global|user|conversation)."""
+    mode = (settings.RESPONSE_CACHE_SCOPE or "user").lower()
+    if mode == "conversation":
+        return f"conv:{conversation_id or ''}"
+    if mode == "user":
+        return f"user:{user_key or ''}"
+    return "global"
+
+
+def _unit(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+async def lookup(
+    message: str,
+    history: Optional[List[Dict[str, Any]]],
+    model_name: str,
+    gen_cfg: dict,
+    scope: str = "global",
+) -> CacheProbe:
+    """Check the exact tier, then (if enabled) the semantic tier. Counts hits/misses in telemetry."""
+    prior = history_digest(history)
+    bucket = _digest([scope, prior, model_name, gen_cfg])
+    probe = CacheProbe(_digest([bucket, normalize(message)]), bucket)
+
+    hit = _exact.get(probe.key)
+    if hit is not None:
+        probe.hit, probe.tier = hit, "exact"
+        telemetry.incr("response_cache_exact_hit")
+        return probe
+
+    if settings.RESPONSE_CACHE_SEMANTIC_ENABLED:
+        try:
+            probe.embedding = _unit(await gemini_client.embed(normalize(message)))
+        except Exception:
+            probe.embedding = None
+        if probe.embedding is not None:
+            best_key, best_score, best_value = None, -1.0, None
+            for key, (entry_bucket, vec, value) in _semantic.items():
+                if entry_bucket != bucket or len(vec) != len(probe.embedding):
+                    continue
+                score = sum(map(mul, vec, probe.embedding))
+                if score > best_score:
+                    best_key, best_score, best_value = key, score, value
+            if best_key is not None and best_score >= settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD:
+                _semantic.touch(best_key)
+                probe.hit, probe.tier = best_value, "semantic"
+                telemetry.incr("response_cache_semantic_hit")
+                return probe
+
+    telemetry.incr("response_cache_miss")
+    return probe
+
+
+def store(probe: CacheProbe, text: str, model_used: str) -> None:
+    """Remember a generated reply under the probe's exact key (and embedding, if computed)."""
+    value = (text, model_used)
+    ttl = settings.RESPONSE_CACHE_TTL_S
+    _exact.set(probe.key, value, ttl)
+    if probe.embedding is not None:
+        _semantic.set(probe.key, (probe.bucket, probe.embedding, value), ttl)
+    telemetry.incr("response_cache_store")
+
+
+def clear() -> None:
+    _exact.clear()
+    _semantic.clear()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "exact_entries": len(_exact),
+        "semantic_entries": len(_semantic),
+        **telemetry.counters("response_cache_"),
+    }
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+from app.services import telemetry
+
+# Single-flight: concurrent calls with the same fingerprint share one upstream call.
+# Only calls that overlap in time are merged; nothing is kept once the leader finishes
+# (that is the response cache's job). Counters per kind:
+#   singleflight_<kind>_leader     -> upstream calls actually made
+#   singleflight_<kind>_coalesced  -> callers that awaited another caller's call
+
+T = TypeVar("T")
+
+_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable digest of the request inputs (JSON-serialized; unknown objects via str())."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def do(kind: str, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """Return `await fn()`, sharing the result with concurrent callers of the same (kind, key).
+
+    Exceptions propagate to every waiter. If the leader is cancelled (e.g. its client
+    disconnected), waiters do not inherit the cancellation and run the call themselves.
+    """
+    slot = (kind, key)
+    pending = _inflight.get(slot)
+    if pending is not None:
+        telemetry.incr(f"singleflight_{kind}_coalesced")
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+        # The leader was cancelled; fall through and lead (or join the next leader)
+        return await do(kind, key, fn)
+
+    fut: asyncio.Future = asyncio.get_running_loop().create_future()
+    _inflight[slot] = fut
+    telemetry.incr(f"singleflight_{kind}_leader")
+    try:
+        result = await fn()
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            fut.cancel()
+        else:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved
+        raise
+    finally:
+        _inflight.pop(slot, None)
+    fut.set_result(result)
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    return {"in_flight": len(_inflight), **telemetry.counters("singleflight_")}
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.db.mongo import get_db
+from app.services import telemetry
+from app.services.token_budget import estimate_tokens
+
+# Resumable streamed replies. Generation runs in a producer task that appends to a
+# per-stream buffer; each SSE connection follows the buffer from an offset. Events
+# carry "<stream_id>:<offset>" ids, so a client that reconnects with Last-Event-ID
+# gets the buffered tail and then the live continuation from the same producer (no
+# second Gemini call). If no client is attached for STREAM_RESUME_GRACE_S the
+# producer is cancelled. Every STREAM_CHECKPOINT_TOKENS the text added since the last
+# checkpoint is appended to a MongoDB document, so the tail survives the in-memory
+# buffer expiring. Checkpoints record whether the reply finished or was cut short.
+
+
+class _Session:
+    __slots__ = (
+        "id",
+        "conversation_id",
+        "text",
+        "done",
+        "finished",
+        "changed",
+        "producer",
+        "consumers",
+        "grace_handle",
+        "checkpointed_tokens",
+        "checkpoint_task",
+        "saved_len",
+    )
+
+    def __init__(self, stream_id: str, conversation_id: Optional[str]) -> None:
+        self.id = stream_id
+        self.conversation_id = conversation_id
+        self.text = ""
+        self.done = False
+        # True only when the producer ran to the end (not cancelled or failed)
+        self.finished = False
+        self.changed = asyncio.Event()
+        self.producer: Optional[asyncio.Task] = None
+        self.consumers = 0
+        self.grace_handle: Optional[asyncio.TimerHandle] = None
+        self.checkpointed_tokens = 0
+        self.checkpoint_task: Optional[asyncio.Task] = None
+        # Length of the text already stored in the checkpoint document
+        self.saved_len = 0
+
+
+_sessions: Dict[str, _Session] = {}
+
+
+def event_id(stream_id: str, offset: int) -> str:
+    return f"{stream_id}:{offset}"
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    stream_id, sep, offset = (value or "").strip().rpartition(":")
+    if not sep or not stream_id:
+        return None
+    try:
+        return stream_id, max(0, int(offset))
+    except ValueError:
+        return None
+
+
+async def _save_checkpoint(session: _Session, previous: Optional[asyncio.Task]) -> None:
+    if previous is not None:
+        # Writes for one stream are serialized, so each appends after the last
+        try:
+            await previous
+        except BaseException:
+            pass
+    start, text = session.saved_len, session.text
+    fields = {
+        "conversation_id": session.conversation_id,
+        "length": len(text),
+        "done": session.finished,
+        "incomplete": session.done and not session.finished,
+        "updated_at": datetime.utcnow(),
+    }
+    try:
+        coll = get_db().stream_checkpoints
+        result = await coll.update_one(
+            {"_id": session.id, "length": start},
+            {"$push": {"parts": text[start:]}, "$set": fields},
+            upsert=start == 0,
+        )
+        if not result.matched_count and not result.upserted_id:
+            # Out of step (e.g. an earlier write failed after applying): store it whole
+            await coll.update_one({"_id": session.id}, {"$set": {"parts": [text], **fields}}, upsert=True)
+        session.saved_len = len(text)
+        telemetry.incr("stream_checkpoint")
+    except Exception:
+        pass
+
+
+def _maybe_checkpoint(session: _Session, force: bool = False) -> None:
+    tokens = estimate_tokens(session.text)
+    if not force and tokens - session.checkpointed_tokens < settings.STREAM_CHECKPOINT_TOKENS:
+        return
+    previous = session.checkpoint_task
+    if previous is not None and not previous.done() and not force:
+        # One write in flight per stream; the next chunk will catch up
+        return
+    session.checkpointed_tokens = tokens
+    session.checkpoint_task = asyncio.get_running_loop().create_task(_save_checkpoint(session, previous))
+
+
+def _expire(stream_id: str) -> None:
+    _sessions.pop(stream_id, None)
+
+
+async def _produce(session: _Session, chunks: AsyncIterator[str], on_finish: Callable[[str], Any]) -> None:
+    try:
+        async for chunk in chunks:
+            session.text += chunk
+            session.changed.set()
+            _maybe_checkpoint(session)
+        session.finished = True
+    finally:
+        await chunks.aclose()
+        session.done = True
+        session.changed.set()
+        if session.grace_handle is not None:
+            session.grace_handle.cancel()
+        _maybe_checkpoint(session, force=True)
+        try:
+            on_finish(session.text)
+        except Exception:
+            pass
+        asyncio.get_running_loop().call_later(settings.STREAM_RESUME_TTL_S, _expire, session.id)
+
+
+def start(chunks: AsyncIterator[str], on_finish: Callable[[str], Any], conversation_id: Optional[str] = None) -> _Session:
+    """Start producing `chunks` into a new resumable stream and return its session.
+
+    `on_finish(text)` is called once with the full (or partial, if cancelled) reply.
+    """
+    stream_id = uuid.uuid4().hex
+    session = _Session(stream_id, conversation_id)
+    _sessions[stream_id] = session
+    session.producer = asyncio.get_running_loop().create_task(_produce(session, chunks, on_finish))
+    return session
+
+
+def _cancel_if_abandoned(session: _Session) -> None:
+    session.grace_handle = None
+    if session.consumers == 0 and not session.done and session.producer is not None:
+        telemetry.incr("stream_abandoned")
+        session.producer.cancel()
+
+
+async def follow(session: _Session, offset: int = 0) -> AsyncIterator[Tuple[str, str]]:
+    """Yield (event_id, text) from `offset` to the end of the stream, live as it grows.
+
+    Takes the session object (see get()) rather than its id, so the stream expiring
+    between the lookup and the first iteration cannot fail mid-response.
+    """
+    session.consumers += 1
+    if session.grace_handle is not None:
+        session.grace_handle.cancel()
+        session.grace_handle = None
+    try:
+        while True:
+            session.changed.clear()
+            if offset < len(session.text):
+                piece = session.text[offset:]
+                offset = len(session.text)
+                yield event_id(session.id, offset), piece
+                continue
+            if session.done:
+                return
+            await session.changed.wait()
+    finally:
+        session.consumers -= 1
+        if session.consumers == 0 and not session.done:
+            grace = settings.STREAM_RESUME_GRACE_S
+            if grace > 0:
+                session.grace_handle = asyncio.get_running_loop().call_later(grace, _cancel_if_abandoned, session)
+            else:
+                _cancel_if_abandoned(session)
+
+
+async def checkpoint_tail(stream_id: str, offset: int = 0) -> Optional[Tuple[str, str, bool]]:
+    """(event_id, text after `offset`, finished) from the last MongoDB checkpoint, or None.
+
+    `finished` is False when the reply was cut short (cancelled or failed) or was still
+    being generated when the checkpoint was written.
+    """
+    try:
+        doc = await get_db().stream_checkpoints.find_one({"_id": stream_id})
+    except Exception:
+        return None
+    if not doc:
+        return None
+    text = "".join(doc.get("parts") or [])
+    return event_id(stream_id, len(text)), text[offset:], bool(doc.get("done"))
+
+
+def get(stream_id: str) -> Optional[_Session]:
+    """The stream's session while it is held in memory, else None."""
+    return _sessions.get(stream_id)
+
+
+async def ensure_indexes() -> None:
+    await get_db().stream_checkpoints.create_index("updated_at", expireAfterSeconds=int(settings.STREAM_CHECKPOINT_TTL_S))
+
+
+def stats() -> Dict[str, Any]:
+    live = sum(1 for s in _sessions.values() if not s.done)
+    return {"sessions": len(_sessions), "live": live, **telemetry.counters("stream_")}
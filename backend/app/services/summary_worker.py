@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, Optional, Set
+
+from app.core.config import settings
+from app.services import telemetry
+from app.services.memory_service import update_conversation_summary
+
+# Background conversation summaries. Request handlers call request() and return
+# immediately; a dispatcher runs update_conversation_summary on up to SUMMARY_WORKERS
+# conversations at once. Requests are debounced per conversation: at most one summary
+# per SUMMARY_INTERVAL_S, unless SUMMARY_MAX_NEW_MESSAGES new messages arrived
+# since the last one. A conversation is never summarized twice at the same time;
+# requests that arrive meanwhile fold into the next run. Beyond SUMMARY_MAX_PENDING
+# conversations waiting, new ones are dropped (counted) instead of queueing forever.
+
+
+class _Pending:
+    __slots__ = ("user_key", "messages", "requested_at", "due_at")
+
+    def __init__(self, user_key: Optional[str], now: float) -> None:
+        self.user_key = user_key
+        self.messages = 0
+        self.requested_at = now
+        self.due_at = now
+
+
+_pending: Dict[str, _Pending] = {}
+_last_run: Dict[str, float] = {}
+_running: Set[str] = set()
+_tasks: Set[asyncio.Task] = set()
+_wakeup: Optional[asyncio.Event] = None
+_dispatcher: Optional[asyncio.Task] = None
+
+
+def _ensure_dispatcher() -> None:
+    global _wakeup, _dispatcher
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _dispatcher is None or _dispatcher.done():
+        _wakeup = asyncio.Event()
+        _dispatcher = loop.create_task(_dispatch())
+
+
+def _due(conversation_id: str, entry: _Pending, now: float) -> float:
+    if entry.messages >= settings.SUMMARY_MAX_NEW_MESSAGES:
+        return now
+    last = _last_run.get(conversation_id)
+    return now if last is None else max(now, last + settings.SUMMARY_INTERVAL_S)
+
+
+def request(conversation_id: str, user_key: Optional[str], messages: int = 1) -> None:
+    """Ask for the conversation's summary to be refreshed in the background."""
+    now = time.monotonic()
+    telemetry.incr("summary_requested")
+    entry = _pending.get(conversation_id)
+    if entry is None:
+        if len(_pending) >= settings.SUMMARY_MAX_PENDING:
+            telemetry.incr("summary_dropped")
+            return
+        entry = _pending[conversation_id] = _Pending(user_key, now)
+    else:
+        telemetry.incr("summary_coalesced")
+        entry.user_key = user_key or entry.user_key
+    entry.messages += max(1, messages)
+    entry.due_at = _due(conversation_id, entry, now)
+    _ensure_dispatcher()
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _run(conversation_id: str, entry: _Pending) -> None:
+    started = time.monotonic()
+    telemetry.incr("summary_lag_ms", round((started - entry.requested_at) * 1000))
+    try:
+        await update_conversation_summary(conversation_id, entry.user_key)
+        telemetry.incr("summary_run")
+    except Exception:
+        telemetry.incr("summary_error")
+    finally:
+        _running.discard(conversation_id)
+        _last_run[conversation_id] = started
+        telemetry.incr("summary_run_ms", round((time.monotonic() - started) * 1000))
+        if conversation_id in _pending:
+            # Asked again while running: re-time against this run
+            later = _pending[conversation_id]
+            later.due_at = _due(conversation_id, later, time.monotonic())
+        if _wakeup is not None:
+            _wakeup.set()
+
+
+def _prune_last_run(now: float) -> None:
+    # Past the interval a conversation is due immediately anyway; forget it
+    horizon = now - settings.SUMMARY_INTERVAL_S
+    for conv_id in [c for c, t in _last_run.items() if t < horizon]:
+        del _last_run[conv_id]
+
+
+async def _dispatch() -> None:
+    assert _wakeup is not None
+    while True:
+        now = time.monotonic()
+        next_due: Optional[float] = None
+        for conv_id in sorted(_pending, key=lambda c: _pending[c].due_at):
+            if len(_running) >= max(1, settings.SUMMARY_WORKERS):
+                break
+            entry = _pending[conv_id]
+            if conv_id in _running:
+                continue
+            if entry.due_at > now:
+                next_due = entry.due_at if next_due is None else min(next_due, entry.due_at)
+                continue
+            del _pending[conv_id]
+            _running.add(conv_id)
+            task = asyncio.get_running_loop().create_task(_run(conv_id, entry))
+            _tasks.add(task)
+            task.add_done_callback(_tasks.discard)
+        if len(_last_run) > 2 * max(1, settings.SUMMARY_MAX_PENDING):
+            _prune_last_run(now)
+        _wakeup.clear()
+        timeout = None if next_due is None else max(0.01, next_due - now)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def stop() -> None:
+    """Cancel the dispatcher and in-flight summaries; pending ones are dropped (they are cheap to redo)."""
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.cancel()
+        try:
+            await _dispatcher
+        except BaseException:
+            pass
+        _dispatcher = None
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if _pending:
+        telemetry.incr("summary_abandoned", len(_pending))
+        _pending.clear()
+
+
+def stats() -> Dict[str, Any]:
+    now = time.monotonic()
+    oldest = min((e.requested_at for e in _pending.values()), default=None)
+    return {
+        "pending": len(_pending),
+        "running": len(_running),
+        "oldest_pending_s": round(now - oldest, 3) if oldest is not None else None,
+        **telemetry.counters("summary_"),
+    }
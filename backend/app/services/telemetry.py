@@ -1,11 +1,20 @@
 from __future__ import annotations
 
+import asyncio
+import threading
 import time
 from typing import Any, Dict, Optional
 from datetime import datetime
 
 from app.db.mongo import get_db
 
+# In-process counters (cache hits, hedges fired, ...). Cheap enough for hot paths;
+# read them via counters() or GET /admin/metrics.
+_counters: Dict[str, float] = {}
+_counters_lock = threading.Lock()
+# Strong references to fire-and-forget telemetry writes so they are not GC'd mid-flight
+_pending: set[asyncio.Task] = set()
+
 
 async def log_event(event: str, data: Dict[str, Any]) -> None:
     """Store a telemetry event in MongoDB for basic analytics.
@@ -22,3 +31,28 @@ async def log_event(event: str, data: Dict[str, Any]) -> None:
     except Exception:
         # Never crash on telemetry
         pass
+
+
+def emit(event: str, data: Dict[str, Any]) -> None:
+    """Schedule log_event in the background so hot paths do not wait on MongoDB.
+
+    No-op when called outside a running event loop.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(log_event(event, data))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+def incr(name: str, value: float = 1) -> None:
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters(prefix: Optional[str] = None) -> Dict[str, float]:
+    """Return a snapshot of the in-process counters, optionally filtered by name prefix."""
+    with _counters_lock:
+        return {k: v for k, v in _counters.items() if not prefix or k.startswith(prefix)}
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+# Per-message framing overhead (role marker, separators) added when budgeting history
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate for Gemini tokenizers.
+
+    Roughly 4 characters per token for ASCII text; non-ASCII scripts (e.g. Devanagari)
+    tokenize much denser, so they are counted at 2 characters per token.
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_chars = len(text) - non_ascii
+    return max(1, round(ascii_chars / 4 + non_ascii / 2))
+
+
+class CountedText(str):
+    """Message text that carries its stored token count.
+
+    Passed to the SDK as an ordinary string part; request sizing (text_tokens) reads
+    the count instead of re-tokenizing the history on every call.
+    """
+
+    tokens: int
+
+    def __new__(cls, text: str, tokens: int) -> "CountedText":
+        obj = super().__new__(cls, text)
+        obj.tokens = tokens
+        return obj
+
+
+def text_tokens(text: str) -> int:
+    """Token count of a text part: the stored count for CountedText, else an estimate."""
+    tokens = getattr(text, "tokens", None)
+    return tokens if isinstance(tokens, int) else estimate_tokens(text)
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Token count stored on the message by chat_repo, estimated for legacy messages."""
+    tokens = message.get("tokens")
+    if isinstance(tokens, int) and tokens >= 0:
+        return tokens
+    return estimate_tokens(message.get("content") or "")
+
+
+def _model_overrides() -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for item in (settings.HISTORY_TOKEN_BUDGET_MODELS or "").split(","):
+        name, _, value = item.partition("=")
+        try:
+            if name.strip():
+                out[name.strip()] = int(value)
+        except ValueError:
+            continue
+    return out
+
+
+def history_token_budget(model_name: Optional[str], quality: Optional[str]) -> int:
+    """Token budget for prior turns: the longest matching model prefix in
+    HISTORY_TOKEN_BUDGET_MODELS, else the budget for the quality tier."""
+    name = model_name or ""
+    overrides = _model_overrides()
+    matches = [p for p in overrides if name.startswith(p)]
+    if matches:
+        return overrides[max(matches, key=len)]
+    if quality == "high":
+        return settings.HISTORY_TOKEN_BUDGET_HIGH
+    if quality == "medium":
+        return settings.HISTORY_TOKEN_BUDGET_MEDIUM
+    return settings.HISTORY_TOKEN_BUDGET_LOW
+
+
+def select_history(history: List[Dict[str, Any]], token_budget: int, max_messages: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Return the longest suffix of `history` that fits `token_budget`.
+
+    The newest message is always kept, even when it alone exceeds the budget.
+    """
+    selected: List[Dict[str, Any]] = []
+    used = 0
+    for m in reversed(history):
+        if max_messages is not None and len(selected) >= max_messages:
+            break
+        cost = message_tokens(m) + MESSAGE_OVERHEAD_TOKENS
+        if selected and used + cost > token_budget:
+            break
+        selected.append(m)
+        used += cost
+    selected.reverse()
+    return selected
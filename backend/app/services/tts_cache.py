@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services import telemetry
+
+# Content-addressed disk cache for synthesized speech. Files are named by the sha256
+# of everything that shapes the audio (voice, model, output format, voice settings,
+# text), so identical requests map to the same file. Writes go to a temporary name
+# and are renamed into place, so a reader never sees a partial file. The total size
+# is capped at TTS_CACHE_MAX_BYTES with least-recently-used eviction; recency is kept
+# in file mtimes, so the order survives restarts. Entries being served straight from
+# disk are pinned (acquire/release): evicting one drops it from the index at once but
+# defers the unlink until the last reader releases it.
+
+_EXTENSIONS = {"audio/mpeg": "mp3", "audio/pcm": "pcm", "audio/basic": "ulaw", "audio/ogg": "ogg"}
+
+_index: "OrderedDict[str, int]" = OrderedDict()
+_bytes = 0
+_loaded = False
+_load_lock: Optional[asyncio.Lock] = None
+# name -> readers currently serving the file; evicted pinned names wait in _doomed
+_pins: Dict[str, int] = {}
+_doomed: Set[str] = set()
+
+
+def key_for(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _root() -> Path:
+    return Path(settings.TTS_CACHE_DIR)
+
+
+def _path(name: str) -> Path:
+    return _root() / name[:2] / name
+
+
+def _name(key: str, mime: str) -> str:
+    return f"{key}.{_EXTENSIONS.get(mime, 'bin')}"
+
+
+def _scan() -> "OrderedDict[str, int]":
+    found = []
+    root = _root()
+    if root.exists():
+        for path in root.glob("*/*"):
+            if path.name.endswith(".tmp"):
+                # Left behind by a crash mid-write
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            found.append((st.st_mtime, path.name, st.st_size))
+    found.sort()
+    return OrderedDict((name, size) for _, name, size in found)
+
+
+async def _ensure_loaded() -> None:
+    global _loaded, _bytes, _load_lock
+    if _loaded:
+        return
+    if _load_lock is None:
+        _load_lock = asyncio.Lock()
+    async with _load_lock:
+        if _loaded:
+            return
+        scanned = await asyncio.to_thread(_scan)
+        # Files found on disk are older than anything stored this session: oldest first
+        merged: "OrderedDict[str, int]" = OrderedDict((n, size) for n, size in scanned.items() if n not in _index)
+        merged.update(_index)
+        _index.clear()
+        _index.update(merged)
+        _bytes = sum(_index.values())
+        _loaded = True
+
+
+def _touch(path: Path) -> bool:
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+async def lookup(key: str, mime: str) -> Optional[Path]:
+    """Path of the cached audio for `key`, or None. A hit marks the entry recently used."""
+    if not settings.TTS_CACHE_ENABLED:
+        return None
+    await _ensure_loaded()
+    name = _name(key, mime)
+    if name not in _index:
+        telemetry.incr("tts_cache_miss")
+        return None
+    path = _path(name)
+    if not await asyncio.to_thread(_touch, path):
+        # Removed behind our back
+        _forget(name)
+        telemetry.incr("tts_cache_miss")
+        return None
+    _index.move_to_end(name)
+    telemetry.incr("tts_cache_hit")
+    return path
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def _forget(name: str) -> None:
+    global _bytes
+    size = _index.pop(name, None)
+    if size is not None:
+        _bytes -= size
+
+
+def _unlink(paths: list) -> None:
+    for path in paths:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+async def _register(name: str, size: int) -> None:
+    """Account for a file just renamed into place and evict over the cap."""
+    global _bytes
+    _forget(name)
+    _doomed.discard(name)
+    _index[name] = size
+    _bytes += size
+    evicted = []
+    while _bytes > settings.TTS_CACHE_MAX_BYTES and len(_index) > 1:
+        old = next(iter(_index))
+        _forget(old)
+        telemetry.incr("tts_cache_evicted")
+        if _pins.get(old):
+            # Still being served; release() removes it
+            _doomed.add(old)
+        else:
+            evicted.append(_path(old))
+    if evicted:
+        await asyncio.to_thread(_unlink, evicted)
+
+
+async def store(key: str, mime: str, data: bytes) -> None:
+    """Add audio to the cache (best-effort), evicting least-recently-used entries over the cap."""
+    if not settings.TTS_CACHE_ENABLED or not data or len(data) > settings.TTS_CACHE_MAX_BYTES:
+        return
+    await _ensure_loaded()
+    name = _name(key, mime)
+    try:
+        await asyncio.to_thread(_write_atomic, _path(name), data)
+    except Exception:
+        telemetry.incr("tts_cache_write_error")
+        return
+    await _register(name, len(data))
+
+
+def _open_temp(path: Path) -> Tuple[Path, BinaryIO]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    return tmp, open(tmp, "wb")
+
+
+def _discard(tmp: Path, f: BinaryIO) -> None:
+    f.close()
+    try:
+        tmp.unlink()
+    except OSError:
+        pass
+
+
+def _finish(tmp: Path, f: BinaryIO, path: Path) -> None:
+    f.close()
+    os.replace(tmp, path)
+
+
+class Writer:
+    """Streams audio into a temporary file; commit() renames it into the cache.
+
+    Gives up (and deletes the partial file) once the audio passes TTS_CACHE_MAX_BYTES
+    or a write fails, so callers never hold the whole response in memory.
+    """
+
+    __slots__ = ("name", "tmp", "file", "size")
+
+    def __init__(self, name: str, tmp: Path, file: BinaryIO) -> None:
+        self.name = name
+        self.tmp = tmp
+        self.file: Optional[BinaryIO] = file
+        self.size = 0
+
+    async def write(self, chunk: bytes) -> None:
+        if self.file is None:
+            return
+        if self.size + len(chunk) > settings.TTS_CACHE_MAX_BYTES:
+            await self.abort()
+            return
+        try:
+            await asyncio.to_thread(self.file.write, chunk)
+            self.size += len(chunk)
+        except Exception:
+            telemetry.incr("tts_cache_write_error")
+            await self.abort()
+
+    async def commit(self) -> None:
+        f, self.file = self.file, None
+        if f is None:
+            return
+        if not self.size:
+            await asyncio.to_thread(_discard, self.tmp, f)
+            return
+        try:
+            await asyncio.to_thread(_finish, self.tmp, f, _path(self.name))
+        except Exception:
+            telemetry.incr("tts_cache_write_error")
+            await asyncio.to_thread(_discard, self.tmp, f)
+            return
+        await _register(self.name, self.size)
+
+    async def abort(self) -> None:
+        f, self.file = self.file, None
+        if f is not None:
+            await asyncio.to_thread(_discard, self.tmp, f)
+
+
+async def writer(key: str, mime: str) -> Optional[Writer]:
+    """Start streaming an entry into the cache, or None when caching is off (or the disk fails)."""
+    if not settings.TTS_CACHE_ENABLED:
+        return None
+    await _ensure_loaded()
+    name = _name(key, mime)
+    try:
+        tmp, f = await asyncio.to_thread(_open_temp, _path(name))
+    except Exception:
+        telemetry.incr("tts_cache_write_error")
+        return None
+    return Writer(name, tmp, f)
+
+
+async def open_entry(key: str, mime: str) -> Optional[BinaryIO]:
+    """Open the cached audio for `key` for reading, or None.
+
+    The file is opened before returning, so a concurrent eviction (which only
+    unlinks the name) cannot pull it out from under the caller.
+    """
+    path = await lookup(key, mime)
+    if path is None:
+        return None
+    try:
+        return await asyncio.to_thread(open, path, "rb")
+    except OSError:
+        # Evicted between lookup and open
+        _forget(path.name)
+        return None
+
+
+async def acquire(key: str, mime: str) -> Optional[Path]:
+    """Like lookup(), but pins the entry so eviction leaves the file in place until release()."""
+    path = await lookup(key, mime)
+    if path is not None:
+        _pins[path.name] = _pins.get(path.name, 0) + 1
+    return path
+
+
+async def release(path: Path) -> None:
+    name = path.name
+    left = _pins.get(name, 0) - 1
+    if left > 0:
+        _pins[name] = left
+        return
+    _pins.pop(name, None)
+    if name in _doomed:
+        _doomed.discard(name)
+        await asyncio.to_thread(_unlink, [path])
+
+
+async def read(path: Path) -> Optional[bytes]:
+    try:
+        return await asyncio.to_thread(path.read_bytes)
+    except OSError:
+        return None
+
+
+def stats() -> Dict[str, Any]:
+    return {"entries": len(_index), "bytes": _bytes, **telemetry.counters("tts_cache_")}
@@ -1,53 +1,178 @@
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Dict, Optional, Tuple
 
-import httpx
 from fastapi import HTTPException
 
 from app.core.config import settings
+from app.services import http_clients, single_flight, tts_cache
 
 
 ELEVEN_TTS_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+ELEVEN_TTS_STREAM_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
 
 
-async def synthesize(text: str, voice_id: Optional[str] = None, model: Optional[str] = None, output: Optional[str] = None) -> bytes:
-    """Synthesize speech using ElevenLabs API and return audio bytes.
+def mime_for(output: Optional[str]) -> str:
+    """Content type for an ElevenLabs output_format preset."""
+    fmt = (output or settings.ELEVENLABS_OUTPUT or "mp3_44100_128").strip().lower()
+    if fmt.startswith("pcm_"):
+        return "audio/pcm"
+    if fmt.startswith("ulaw_"):
+        return "audio/basic"
+    if fmt.startswith("opus_"):
+        return "audio/ogg"
+    return "audio/mpeg"
 
-    - voice_id: overrides default voice if provided
-    - model: e.g., 'eleven_multilingual_v2', 'eleven_turbo_v2'
-    - output: e.g., 'mp3_44100_128'
-    """
+
+def resolve_voice(voice_id: Optional[str] = None) -> str:
+    """Return the voice to use, raising HTTPException when TTS is not configured."""
     if not settings.ELEVENLABS_API_KEY:
         raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY not configured")
 
     voice = (voice_id or settings.ELEVENLABS_VOICE_ID or "").strip()
     if not voice:
         raise HTTPException(status_code=400, detail="voice_id is required (set default ELEVENLABS_VOICE_ID or pass in request)")
+    return voice
+
 
+def _prepare(
+    text: str,
+    voice_id: Optional[str],
+    model: Optional[str],
+    output: Optional[str],
+    previous_text: Optional[str] = None,
+) -> Tuple[str, Dict[str, str], Dict[str, str], Dict[str, Any]]:
+    """Validate settings and return (voice, headers, params, payload) for a TTS request."""
+    voice = resolve_voice(voice_id)
     model_id = (model or settings.ELEVENLABS_MODEL or "eleven_multilingual_v2").strip()
     output_fmt = (output or settings.ELEVENLABS_OUTPUT or "mp3_44100_128").strip()
 
-    url = ELEVEN_TTS_URL.format(voice_id=voice)
     headers = {
         "xi-api-key": settings.ELEVENLABS_API_KEY,
-        "accept": "audio/mpeg",
+        "accept": mime_for(output_fmt),
         "Content-Type": "application/json",
     }
     params = {"output_format": output_fmt}
-    payload = {
+    payload: Dict[str, Any] = {
         "text": text,
         "model_id": model_id,
         # Default voice settings can be tuned by the user later
         "voice_settings": {"stability": 0.5, "similarity_boost": 0.75},
     }
+    if previous_text:
+        # Lets ElevenLabs keep intonation continuous across separately synthesized pieces
+        payload["previous_text"] = previous_text
+    return voice, headers, params, payload
+
+
+def _raise_for_tts(status_code: int, body: bytes) -> None:
+    try:
+        err_json = json.loads(body)
+    except Exception:
+        err_json = {"detail": body.decode("utf-8", "replace")}
+    raise HTTPException(status_code=status_code, detail={"msg": "TTS failed", "error": err_json})
+
+
+def _cache_key(voice: str, params: Dict[str, str], payload: Dict[str, Any]) -> str:
+    return tts_cache.key_for(voice, params, payload)
+
+
+async def acquire_cached_audio(
+    text: str, voice_id: Optional[str] = None, model: Optional[str] = None, output: Optional[str] = None
+) -> Optional[Path]:
+    """Path of previously synthesized audio for exactly this request, or None.
+
+    The entry is pinned against eviction; call tts_cache.release(path) once it was sent.
+    """
+    voice, _headers, params, payload = _prepare(text, voice_id, model, output)
+    return await tts_cache.acquire(_cache_key(voice, params, payload), mime_for(output))
+
+
+async def _file_chunks(f: BinaryIO, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, headers=headers, params=params, json=payload)
+
+async def synthesize(text: str, voice_id: Optional[str] = None, model: Optional[str] = None, output: Optional[str] = None) -> bytes:
+    """Synthesize speech using ElevenLabs API and return audio bytes.
+
+    - voice_id: overrides default voice if provided
+    - model: e.g., 'eleven_multilingual_v2', 'eleven_turbo_v2'
+    - output: e.g., 'mp3_44100_128'
+
+    Results are cached on disk (see tts_cache); concurrent identical requests share one call.
+    """
+    voice, headers, params, payload = _prepare(text, voice_id, model, output)
+    url = ELEVEN_TTS_URL.format(voice_id=voice)
+    key = _cache_key(voice, params, payload)
+    mime = mime_for(output)
+    path = await tts_cache.lookup(key, mime)
+    if path is not None:
+        data = await tts_cache.read(path)
+        if data:
+            return data
+
+    async def _fetch() -> bytes:
+        resp = await http_clients.get(http_clients.TTS).post(url, headers=headers, params=params, json=payload)
         if resp.status_code != 200:
-            try:
-                err_json = resp.json()
-            except Exception:
-                err_json = {"detail": resp.text}
-            raise HTTPException(status_code=resp.status_code, detail={"msg": "TTS failed", "error": err_json})
+            _raise_for_tts(resp.status_code, resp.content)
+        await tts_cache.store(key, mime, resp.content)
         return resp.content
+
+    return await single_flight.do("tts", key, _fetch)
+
+
+def synthesize_stream(
+    text: str,
+    voice_id: Optional[str] = None,
+    model: Optional[str] = None,
+    output: Optional[str] = None,
+    previous_text: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """Synthesize via ElevenLabs' streaming endpoint, yielding audio bytes as they arrive.
+
+    Settings are validated here (raising HTTPException before anything is streamed);
+    upstream errors are raised from the first iteration. Cached audio is replayed from
+    disk; a stream that completes is added to the cache.
+    """
+    voice, headers, params, payload = _prepare(text, voice_id, model, output, previous_text=previous_text)
+    url = ELEVEN_TTS_STREAM_URL.format(voice_id=voice)
+    key = _cache_key(voice, params, payload)
+    mime = mime_for(output)
+
+    async def _audio() -> AsyncIterator[bytes]:
+        cached = await tts_cache.open_entry(key, mime)
+        if cached is not None:
+            # Replayed from disk piece by piece rather than read into memory whole
+            async for chunk in _file_chunks(cached):
+                yield chunk
+            return
+        # Tee into a temporary cache file instead of buffering the audio in memory
+        sink = await tts_cache.writer(key, mime)
+        try:
+            client = http_clients.get(http_clients.TTS)
+            async with client.stream("POST", url, headers=headers, params=params, json=payload) as resp:
+                if resp.status_code != 200:
+                    _raise_for_tts(resp.status_code, await resp.aread())
+                async for chunk in resp.aiter_bytes():
+                    if chunk:
+                        if sink is not None:
+                            await sink.write(chunk)
+                        yield chunk
+            # Only a complete stream is cached; a failed or closed-early one is discarded
+            if sink is not None:
+                await sink.commit()
+        finally:
+            if sink is not None:
+                await sink.abort()
+
+    return _audio()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services import telemetry, tts_service
+
+# Sentence-pipelined voice replies. The streamed LLM reply is cut at sentence
+# boundaries and each sentence goes to the TTS streaming endpoint as soon as it is
+# complete, while the LLM keeps generating. Up to TTS_STREAM_CONCURRENCY sentences
+# are synthesized at once; audio is always emitted in sentence order, so the
+# first sentence plays while later ones are still being generated or synthesized.
+# Long texts for /tts go through the same pipeline in larger, paragraph-sized pieces.
+
+TEXT = "text"
+AUDIO = "audio"
+ERROR = "error"
+
+# End of sentence: terminal punctuation (optionally followed by closing quotes or
+# brackets) and whitespace, or a line break
+_BOUNDARY = re.compile(r"(?<=[.!?…。！？])[\"')\]]*\s+|\n+")
+
+
+def _cut(buffer: str, min_chars: int, max_chars: int) -> Tuple[List[str], str]:
+    """Split complete sentences off `buffer`; return (sentences, remainder)."""
+    out: List[str] = []
+    start = 0
+    pending = ""
+    for m in _BOUNDARY.finditer(buffer):
+        piece = buffer[start:m.end()]
+        start = m.end()
+        pending += piece
+        # Merge very short sentences ("Sure. Okay.") with the next one
+        if len(pending.strip()) >= min_chars:
+            out.append(pending.strip())
+            pending = ""
+    rest = pending + buffer[start:]
+    while len(rest) > max_chars:
+        # No boundary for a long stretch: break at the last comma or space instead
+        window = rest[:max_chars]
+        cut = max(window.rfind(", "), window.rfind("; "), window.rfind(" "))
+        cut = cut + 1 if cut > 0 else max_chars
+        out.append(rest[:cut].strip())
+        rest = rest[cut:]
+    return [s for s in out if s], rest
+
+
+async def sentences(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Re-chunk a stream of text pieces into sentences."""
+    buffer = ""
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            buffer += chunk
+            done, buffer = _cut(buffer, settings.TTS_SENTENCE_MIN_CHARS, settings.TTS_SENTENCE_MAX_CHARS)
+            for sentence in done:
+                yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """Split a long text into chunks of at most `max_chars` for separate synthesis.
+
+    Paragraphs are kept whole when they fit; longer ones are cut at sentence
+    boundaries. Neighbouring pieces are packed together up to `max_chars`, so the
+    number of TTS requests stays small.
+    """
+    units: List[Tuple[str, bool]] = []  # (text, starts a paragraph)
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) <= max_chars:
+            units.append((para, True))
+            continue
+        done, rest = _cut(para, 1, max_chars)
+        if rest.strip():
+            done.append(rest.strip())
+        units.extend((sentence, i == 0) for i, sentence in enumerate(done))
+    chunks: List[str] = []
+    current = ""
+    for unit, new_para in units:
+        sep = "\n\n" if new_para else " "
+        if current and len(current) + len(sep) + len(unit) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}{sep}{unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _iterate(items: List[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+
+
+class _Piece:
+    __slots__ = ("seq", "text", "audio", "task")
+
+    def __init__(self, seq: int, text: str) -> None:
+        self.seq = seq
+        self.text = text
+        # Audio bytes as they arrive; None marks the end, an Exception a failure
+        self.audio: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+
+async def _synthesize(piece: _Piece, previous: Optional[str], sem: asyncio.Semaphore, voice_id, model, output) -> None:
+    try:
+        async with sem:
+            audio = tts_service.synthesize_stream(piece.text, voice_id=voice_id, model=model, output=output, previous_text=previous)
+            async with aclosing(audio):
+                async for chunk in audio:
+                    piece.audio.put_nowait(chunk)
+        piece.audio.put_nowait(None)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        telemetry.incr("voice_tts_error")
+        piece.audio.put_nowait(e)
+
+
+def speak(
+    chunks: AsyncIterator[str],
+    voice_id: Optional[str] = None,
+    model: Optional[str] = None,
+    output: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, int, object]]:
+    """Yield (kind, seq, value) events for a streamed reply, in sentence order.
+
+    kind is TEXT (value: the sentence), AUDIO (value: bytes) or ERROR (value: message
+    for a sentence whose synthesis failed; the reply continues). Closing the
+    generator cancels the LLM stream and any in-flight synthesis.
+    """
+    return _in_order(sentences(chunks), voice_id, model, output)
+
+
+def speak_text(
+    text: str,
+    voice_id: Optional[str] = None,
+    model: Optional[str] = None,
+    output: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, int, object]]:
+    """Like speak(), for a complete text: split into TTS_LONG_CHUNK_CHARS pieces synthesized concurrently."""
+    return _in_order(_iterate(split_text(text, settings.TTS_LONG_CHUNK_CHARS)), voice_id, model, output)
+
+
+async def _in_order(
+    texts: AsyncIterator[str],
+    voice_id: Optional[str],
+    model: Optional[str],
+    output: Optional[str],
+) -> AsyncIterator[Tuple[str, int, object]]:
+    sem = asyncio.Semaphore(max(1, settings.TTS_STREAM_CONCURRENCY))
+    ready: asyncio.Queue = asyncio.Queue()
+    pieces: List[_Piece] = []
+
+    async def _feed() -> None:
+        previous: Optional[str] = None
+        try:
+            async with aclosing(texts) as stream:
+                async for sentence in stream:
+                    piece = _Piece(len(pieces), sentence)
+                    piece.task = asyncio.ensure_future(_synthesize(piece, previous, sem, voice_id, model, output))
+                    pieces.append(piece)
+                    ready.put_nowait(piece)
+                    previous = sentence
+            ready.put_nowait(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ready.put_nowait(e)
+
+    feeder = asyncio.ensure_future(_feed())
+    try:
+        while True:
+            piece = await ready.get()
+            if piece is None:
+                break
+            if isinstance(piece, Exception):
+                raise piece
+            yield TEXT, piece.seq, piece.text
+            while True:
+                item = await piece.audio.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    yield ERROR, piece.seq, str(getattr(item, "detail", None) or item)
+                    break
+                yield AUDIO, piece.seq, item
+        telemetry.incr("voice_stream_pieces", len(pieces))
+    finally:
+        feeder.cancel()
+        for piece in pieces:
+            if piece.task is not None:
+                piece.task.cancel()
+        await asyncio.gather(feeder, *(p.task for p in pieces if p.task is not None), return_exceptions=True)
@@ -3,15 +3,10 @@ from __future__ import annotations
 from typing import List, Dict, Any
 import re
 
-import httpx
 from duckduckgo_search import DDGS
 from bs4 import BeautifulSoup
 
-
-USER_AGENT = (
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
-)
+from app.services import http_clients
 
 
 def search_web(query: str, k: int = 5, fetch_pages: bool = False, timeout: float = 8.0) -> List[Dict[str, Any]]:
@@ -45,11 +40,10 @@ def search_web(query: str, k: int = 5, fetch_pages: bool = False, timeout: float
 
 
 def _fetch_page_text(url: str, timeout: float = 8.0, max_chars: int = 2500) -> str:
-    headers = {"User-Agent": USER_AGENT}
-    with httpx.Client(timeout=timeout, headers=headers, follow_redirects=True) as client:
-        resp = client.get(url)
-        resp.raise_for_status()
-        html = resp.text or ""
+    # Shared pooled client (sends the browser User-Agent); search_web is sync and called via run_in_threadpool
+    resp = http_clients.get_sync(http_clients.WEB).get(url, timeout=timeout)
+    resp.raise_for_status()
+    html = resp.text or ""
     # Strip scripts/styles and extract visible text
     soup = BeautifulSoup(html, "html.parser")
     for tag in soup(["script", "style", "noscript", "nav", "footer", "header", "aside"]):
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+from bson import ObjectId
+
+from app.core.config import settings
+from app.db.mongo import get_db
+from app.repositories.chat_repo import insert_messages
+from app.services import summary_worker, telemetry
+
+# Write-behind queue for work that must happen after a reply was sent (streamed
+# assistant messages, summary refreshes, telemetry). Callers enqueue without awaiting;
+# one worker writes in batches: messages grouped per conversation into a single
+# insert, telemetry events into one insert_many, then summary refreshes are handed to
+# the summary worker once the conversation's messages are stored. Failed jobs are
+# retried with exponential backoff; message ids are assigned at enqueue, so a retried
+# insert never stores a message twice. On shutdown the queue is drained; whatever is
+# still pending after WRITE_BEHIND_DRAIN_TIMEOUT_S is spilled to a JSONL file and
+# replayed on the next start.
+
+MESSAGE = "message"
+SUMMARY = "summary"
+EVENT = "event"
+
+
+class _Job:
+    __slots__ = ("kind", "payload", "attempts", "not_before")
+
+    def __init__(self, kind: str, payload: Dict[str, Any], attempts: int = 0) -> None:
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.not_before = 0.0
+
+
+_queue: Deque[_Job] = deque()
+_wakeup: Optional[asyncio.Event] = None
+_worker: Optional[asyncio.Task] = None
+_busy = False
+_closing = False
+_last_message_at: Optional[datetime] = None
+
+
+def _spill_path() -> Path:
+    return Path(settings.LOCAL_ARCHIVE_DIR).parent / "write_behind_pending.jsonl"
+
+
+def _ensure_worker() -> None:
+    global _wakeup, _worker
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _worker is None or _worker.done():
+        _wakeup = asyncio.Event()
+        _worker = loop.create_task(_run())
+
+
+def _put(job: _Job) -> None:
+    _queue.append(job)
+    telemetry.incr("write_behind_enqueued")
+    _ensure_worker()
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def _message_time() -> datetime:
+    # Messages are read back sorted by created_at (millisecond precision in MongoDB),
+    # so each one gets a distinct, increasing timestamp to keep the enqueue order
+    global _last_message_at
+    now = datetime.utcnow()
+    if _last_message_at is not None and now <= _last_message_at + timedelta(milliseconds=1):
+        now = _last_message_at + timedelta(milliseconds=1)
+    _last_message_at = now
+    return now
+
+
+def enqueue_message(conversation_id: str, role: str, content: str) -> None:
+    # The id and timestamp are fixed here so a retried insert skips what already landed
+    _put(_Job(MESSAGE, {
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "id": str(ObjectId()),
+        "created_at": _message_time().isoformat(),
+    }))
+
+
+def enqueue_summary(conversation_id: str, user_key: Optional[str]) -> None:
+    _put(_Job(SUMMARY, {"conversation_id": conversation_id, "user_key": user_key}))
+
+
+def enqueue_event(event: str, data: Dict[str, Any]) -> None:
+    _put(_Job(EVENT, {"event": event, "data": data, "ts": datetime.utcnow().isoformat()}))
+
+
+def depth() -> int:
+    return len(_queue)
+
+
+def _take_batch(now: float) -> List[_Job]:
+    """Pop up to WRITE_BEHIND_BATCH_SIZE jobs that are due, keeping the rest in order."""
+    batch: List[_Job] = []
+    deferred: List[_Job] = []
+    while _queue and len(batch) < max(1, settings.WRITE_BEHIND_BATCH_SIZE):
+        job = _queue.popleft()
+        (batch if job.not_before <= now else deferred).append(job)
+    _queue.extendleft(reversed(deferred))
+    return batch
+
+
+def _retry(jobs: List[_Job], error: Exception) -> None:
+    for job in jobs:
+        job.attempts += 1
+        if job.attempts > settings.WRITE_BEHIND_MAX_RETRIES:
+            telemetry.incr("write_behind_dropped")
+            continue
+        job.not_before = time.monotonic() + min(60.0, settings.WRITE_BEHIND_RETRY_BASE_S * (2 ** (job.attempts - 1)))
+        telemetry.incr("write_behind_retried")
+        _queue.append(job)
+
+
+def _message_doc(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if "id" not in payload:
+        # Spilled by a version that did not pre-assign ids
+        payload["id"] = str(ObjectId())
+        payload["created_at"] = _message_time().isoformat()
+    return {
+        "id": payload["id"],
+        "role": payload["role"],
+        "content": payload["content"],
+        "created_at": datetime.fromisoformat(payload["created_at"]),
+    }
+
+
+async def _write(batch: List[_Job]) -> None:
+    # 1) Messages: one insert per conversation, in enqueue order
+    by_conv: Dict[str, List[_Job]] = {}
+    for job in batch:
+        if job.kind == MESSAGE:
+            by_conv.setdefault(job.payload["conversation_id"], []).append(job)
+    failed_convs = set()
+    for conv_id, jobs in by_conv.items():
+        try:
+            await insert_messages(conv_id, [_message_doc(j.payload) for j in jobs])
+            telemetry.incr("write_behind_written", len(jobs))
+        except Exception as e:
+            failed_convs.add(conv_id)
+            _retry(jobs, e)
+
+    # 2) Telemetry events: one insert_many
+    events = [j for j in batch if j.kind == EVENT]
+    if events:
+        try:
+            await get_db().telemetry.insert_many([
+                {"event": j.payload["event"], "ts": datetime.fromisoformat(j.payload["ts"]), **({"data": j.payload["data"]} if j.payload["data"] else {})}
+                for j in events
+            ])
+            telemetry.incr("write_behind_written", len(events))
+        except Exception as e:
+            _retry(events, e)
+
+    # 3) Summaries: hand to the background worker (debounced there), after the messages are stored
+    for job in batch:
+        if job.kind != SUMMARY:
+            continue
+        conv_id = job.payload["conversation_id"]
+        if conv_id in failed_convs:
+            # Summarizing before the reply is stored would miss it; wait for the retry
+            job.not_before = time.monotonic() + settings.WRITE_BEHIND_RETRY_BASE_S
+            _queue.append(job)
+            continue
+        summary_worker.request(conv_id, job.payload["user_key"], messages=len(by_conv.get(conv_id, ())) or 1)
+        telemetry.incr("write_behind_written")
+
+
+async def _run() -> None:
+    global _busy
+    assert _wakeup is not None
+    while True:
+        if not _queue:
+            _wakeup.clear()
+            await _wakeup.wait()
+        batch = _take_batch(time.monotonic())
+        if not batch:
+            # Only jobs waiting on retry backoff are left
+            due = min(j.not_before for j in _queue) - time.monotonic()
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=max(0.01, due))
+            except asyncio.TimeoutError:
+                pass
+            continue
+        _busy = True
+        try:
+            await _write(batch)
+        except asyncio.CancelledError:
+            # Put the batch back so stop() spills it (writes are at-least-once)
+            _queue.extendleft(reversed(batch))
+            raise
+        except Exception as e:
+            _retry(batch, e)
+        finally:
+            _busy = False
+        if not _closing and len(_queue) < settings.WRITE_BEHIND_BATCH_SIZE:
+            # Let a few more jobs accumulate so they share one write
+            await asyncio.sleep(settings.WRITE_BEHIND_FLUSH_INTERVAL_S)
+
+
+def _spill() -> int:
+    jobs = list(_queue)
+    _queue.clear()
+    if not jobs:
+        return 0
+    path = _spill_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        for job in jobs:
+            f.write(json.dumps({"kind": job.kind, "payload": job.payload, "attempts": job.attempts}, ensure_ascii=False, default=str) + "\n")
+    return len(jobs)
+
+
+def _load_spilled() -> int:
+    path = _spill_path()
+    if not path.exists():
+        return 0
+    loaded = 0
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            item = json.loads(line)
+            _queue.append(_Job(item["kind"], item["payload"], item.get("attempts", 0)))
+            loaded += 1
+        except Exception:
+            continue
+    path.unlink()
+    return loaded
+
+
+async def start() -> None:
+    """Replay jobs spilled by the previous shutdown and start the worker."""
+    global _closing
+    _closing = False
+    try:
+        _load_spilled()
+    except Exception:
+        pass
+    _ensure_worker()
+    if _queue and _wakeup is not None:
+        _wakeup.set()
+
+
+async def stop() -> None:
+    """Drain the queue (up to WRITE_BEHIND_DRAIN_TIMEOUT_S), then spill what is left to disk."""
+    global _closing, _worker
+    _closing = True
+    deadline = time.monotonic() + settings.WRITE_BEHIND_DRAIN_TIMEOUT_S
+    while (_queue or _busy) and _worker is not None and not _worker.done() and time.monotonic() < deadline:
+        if _wakeup is not None:
+            _wakeup.set()
+        await asyncio.sleep(0.05)
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except BaseException:
+            pass
+        _worker = None
+    try:
+        spilled = _spill()
+        if spilled:
+            telemetry.incr("write_behind_spilled", spilled)
+    except Exception:
+        pass
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "depth": len(_queue),
+        "running": _worker is not None and not _worker.done(),
+        **telemetry.counters("write_behind_"),
+    }
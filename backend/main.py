@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -9,6 +11,7 @@ from app.repositories.chat_repo import init_indexes
 from app.services.rag_service import ensure_rag_indexes
 from app.services.memory_service import ensure_memory_indexes
 from app.db.mongo import close_client
+from app.services import http_clients, image_preprocess, model_catalog, model_router, stream_sessions, summary_worker, write_behind
 
 app = FastAPI(title="Taliyo AI Backend", version="0.1.0")
 
@@ -35,10 +38,31 @@ app.include_router(admin_router)
 
 @app.on_event("startup")
 async def _on_startup():
+    try:
+        # Pooled outbound HTTP clients (TTS, crawling, web search)
+        http_clients.start()
+    except Exception:
+        pass
+    try:
+        # Warm the Gemini model list so no request waits on list_models
+        await model_catalog.start()
+    except Exception:
+        pass
+    try:
+        # Replay post-stream writes left over from the last shutdown
+        await write_behind.start()
+    except Exception:
+        pass
+    try:
+        # Seed latency-aware routing from recent call telemetry
+        await model_router.seed_from_telemetry()
+    except Exception:
+        pass
     try:
         await init_indexes()
         await ensure_rag_indexes()
         await ensure_memory_indexes()
+        await stream_sessions.ensure_indexes()
     except Exception:
         # Index creation errors should not crash the app in dev
         pass
@@ -46,6 +70,29 @@ async def _on_startup():
 
 @app.on_event("shutdown")
 async def _on_shutdown():
+    try:
+        # Flush queued post-stream writes while the DB client is still open
+        await write_behind.stop()
+    except Exception:
+        pass
+    try:
+        # After write-behind, which may have handed it summaries; pending ones are dropped
+        await summary_worker.stop()
+    except Exception:
+        pass
+    try:
+        await model_catalog.stop()
+    except Exception:
+        pass
+    try:
+        # Draining worker processes blocks; keep it off the event loop
+        await asyncio.to_thread(image_preprocess.shutdown)
+    except Exception:
+        pass
+    try:
+        await http_clients.close()
+    except Exception:
+        pass
     try:
         await close_client()
     except Exception:
@@ -0,0 +1,90 @@
+import asyncio
+
+from app.core.config import settings
+from app.services import gemini_scheduler
+from app.services.gemini_scheduler import BACKGROUND, INGEST, INTERACTIVE
+
+
+def _reset(monkeypatch, per_model=1, rpm=0, tpm=0):
+    monkeypatch.setattr(settings, "GEMINI_MAX_CONCURRENCY_PER_MODEL", per_model)
+    monkeypatch.setattr(settings, "GEMINI_MAX_CONCURRENCY_PER_KEY", 100)
+    monkeypatch.setattr(settings, "GEMINI_MODEL_CONCURRENCY", "")
+    monkeypatch.setattr(settings, "GEMINI_RPM", rpm)
+    monkeypatch.setattr(settings, "GEMINI_TPM", tpm)
+    monkeypatch.setattr(settings, "GEMINI_MODEL_RPM", "")
+    monkeypatch.setattr(settings, "GEMINI_MODEL_TPM", "")
+    monkeypatch.setattr(settings, "GEMINI_QUEUE_TIMEOUT_S", 5.0)
+    monkeypatch.setattr(gemini_scheduler, "_queue", [])
+    monkeypatch.setattr(gemini_scheduler, "_models", {})
+    monkeypatch.setattr(gemini_scheduler, "_keys", {})
+    monkeypatch.setattr(gemini_scheduler, "_timer", None)
+
+
+def test_waiters_are_granted_in_priority_then_fifo_order(monkeypatch):
+    _reset(monkeypatch)
+    granted = []
+
+    async def call(name, priority):
+        async with gemini_scheduler.slot("m", priority=priority):
+            granted.append(name)
+
+    async def run():
+        async with gemini_scheduler.slot("m"):
+            tasks = [
+                asyncio.ensure_future(call("ingest", INGEST)),
+                asyncio.ensure_future(call("background-1", BACKGROUND)),
+                asyncio.ensure_future(call("interactive", INTERACTIVE)),
+                asyncio.ensure_future(call("background-2", BACKGROUND)),
+            ]
+            await asyncio.sleep(0.01)
+            assert granted == []
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert granted == ["interactive", "background-1", "background-2", "ingest"]
+
+
+def test_context_priority_applies_to_slots(monkeypatch):
+    _reset(monkeypatch)
+    granted = []
+
+    async def call(name):
+        async with gemini_scheduler.slot("m"):
+            granted.append(name)
+
+    async def run():
+        async with gemini_scheduler.slot("m"):
+            with gemini_scheduler.use_priority(BACKGROUND):
+                late = asyncio.ensure_future(call("background"))
+            first = asyncio.ensure_future(call("interactive"))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(late, first)
+
+    asyncio.run(run())
+    assert granted == ["interactive", "background"]
+
+
+def test_token_bucket_refills_continuously_up_to_its_capacity():
+    bucket = gemini_scheduler._Bucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_for(60, now) == 0.0
+    bucket.take(60)
+    # 60 per minute = one per second
+    assert bucket.wait_for(1, now) == 1.0
+    assert abs(bucket.wait_for(1, now + 0.5) - 0.5) < 1e-9
+    assert bucket.wait_for(1, now + 1.0) == 0.0
+    # Never refills past capacity, and oversized requests are capped to it
+    assert bucket.wait_for(60, now + 600) == 0.0
+    assert bucket.tokens == 60.0
+    assert bucket.wait_for(1000, now + 600) == 0.0
+
+
+def test_settled_ticket_returns_unused_tokens(monkeypatch):
+    _reset(monkeypatch, tpm=1000)
+
+    async def run():
+        async with gemini_scheduler.slot("m", tokens=400) as ticket:
+            ticket.settle(100)
+        return gemini_scheduler._models["m"].tpm.tokens
+
+    assert 899 <= asyncio.run(run()) <= 901
@@ -0,0 +1,89 @@
+import asyncio
+
+from app.core.config import settings
+from app.services import gemini_service, model_health, telemetry
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+        self.usage_metadata = None
+
+
+def _reset(monkeypatch):
+    events = []
+    monkeypatch.setattr(model_health, "_models", {})
+    monkeypatch.setattr(telemetry, "_counters", {})
+    monkeypatch.setattr(telemetry, "emit", lambda event, data: events.append((event, data)))
+    monkeypatch.setattr(settings, "HEDGE_DELAY_MS", 50)
+    monkeypatch.setattr(settings, "HEDGE_MIN_DELAY_MS", 10)
+    monkeypatch.setattr(settings, "HEDGE_MIN_SAMPLES", 1000)
+    return events
+
+
+def _runner(latencies, cancelled):
+    async def run(model):
+        try:
+            await asyncio.sleep(latencies[model])
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return _Response(f"from {model}")
+    return run
+
+
+def test_slow_primary_fires_hedge_and_loser_is_cancelled(monkeypatch):
+    events = _reset(monkeypatch)
+    cancelled = []
+    errors, attempts = [], []
+    run = _runner({"slow": 5.0, "fast": 0.01}, cancelled)
+
+    async def go():
+        result = await gemini_service._hedged_attempt("slow", "fast", run, errors, attempts)
+        # Let the cancelled primary unwind
+        await asyncio.sleep(0)
+        return result
+
+    result, primary_exc, fired = asyncio.run(go())
+    assert result == ("from fast", "fast")
+    assert primary_exc is None and fired
+    assert cancelled == ["slow"]
+    primary, hedge = attempts
+    assert primary["model"] == "slow" and primary["outcome"] == "cancelled"
+    # Censored sample for the router: the primary took at least this long
+    assert primary["censored_ms"] >= 50
+    assert (hedge["model"], hedge.get("hedge"), hedge["outcome"]) == ("fast", True, "ok")
+    assert telemetry.counters("llm_hedge") == {"llm_hedge_fired": 1, "llm_hedge_won": 1}
+    assert [e for e, _ in events] == ["llm_hedge"]
+    assert events[0][1]["winner"] == "fast"
+
+
+def test_fast_primary_does_not_hedge(monkeypatch):
+    _reset(monkeypatch)
+    cancelled = []
+    attempts = []
+    run = _runner({"quick": 0.0, "fast": 0.0}, cancelled)
+    result, primary_exc, fired = asyncio.run(gemini_service._hedged_attempt("quick", "fast", run, [], attempts))
+    assert result == ("from quick", "quick")
+    assert not fired and primary_exc is None
+    assert [a["model"] for a in attempts] == ["quick"]
+    assert not telemetry.counters("llm_hedge")
+
+
+def test_primary_failure_after_hedge_falls_to_backup(monkeypatch):
+    _reset(monkeypatch)
+    errors, attempts = [], []
+
+    async def run(model):
+        if model == "flaky":
+            await asyncio.sleep(0.1)
+            raise RuntimeError("boom")
+        await asyncio.sleep(0.2)
+        return _Response("from backup")
+
+    result, primary_exc, fired = asyncio.run(gemini_service._hedged_attempt("flaky", "backup", run, errors, attempts))
+    assert result == ("from backup", "backup")
+    assert fired and isinstance(primary_exc, RuntimeError)
+    assert errors == ["Primary flaky: boom"]
+    assert "censored_ms" not in attempts[0]
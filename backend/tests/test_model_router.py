@@ -0,0 +1,72 @@
+from app.core.config import settings
+from app.services import model_router
+
+
+def _reset(monkeypatch):
+    monkeypatch.setattr(model_router, "_stats", {})
+    monkeypatch.setattr(settings, "ROUTER_ENABLED", True)
+    monkeypatch.setattr(settings, "ROUTER_SLO_MS", "text=1000")
+    monkeypatch.setattr(settings, "ROUTER_SLO_PERCENTILE", 0.9)
+    monkeypatch.setattr(settings, "ROUTER_MAX_ERROR_RATE", 0.2)
+    monkeypatch.setattr(settings, "ROUTER_MIN_SAMPLES", 3)
+    monkeypatch.setattr(settings, "ROUTER_STALE_S", 1800.0)
+    monkeypatch.setattr(settings, "MODEL_HEALTH_EWMA_ALPHA", 0.5)
+
+
+def _feed(model, latency_s, n=5, ok=True):
+    for _ in range(n):
+        model_router.record("text", model, latency_s, ok)
+
+
+def test_keeps_tier_order_when_the_first_model_meets_the_slo(monkeypatch):
+    _reset(monkeypatch)
+    _feed("best", 0.5)
+    _feed("next", 0.1)
+    assert model_router.choose("text", ["best", "next"]) == "best"
+
+
+def test_skips_a_model_that_misses_the_latency_slo(monkeypatch):
+    _reset(monkeypatch)
+    _feed("best", 3.0)
+    _feed("next", 0.5)
+    assert model_router.choose("text", ["best", "next"]) == "next"
+
+
+def test_skips_a_model_with_a_high_error_rate(monkeypatch):
+    _reset(monkeypatch)
+    _feed("best", 0.2)
+    _feed("best", None, n=3, ok=False)
+    _feed("next", 0.5)
+    assert model_router.choose("text", ["best", "next"]) == "next"
+
+
+def test_unmeasured_model_is_tried(monkeypatch):
+    _reset(monkeypatch)
+    _feed("best", 3.0)
+    _feed("new", 0.5, n=2)
+    assert model_router.choose("text", ["best", "new", "next"]) == "new"
+
+
+def test_lowest_expected_latency_wins_when_none_meet_the_slo(monkeypatch):
+    _reset(monkeypatch)
+    _feed("best", 5.0)
+    _feed("next", 2.0)
+    assert model_router.choose("text", ["best", "next"]) == "next"
+
+
+def test_censored_samples_count_as_latency_not_errors(monkeypatch):
+    _reset(monkeypatch)
+    _feed("best", 0.2, n=1)
+    for _ in range(4):
+        model_router.record_censored("text", "best", 2.5)
+    _feed("next", 0.5)
+    assert model_router._stats[("text", "best")].error_ewma == 0.0
+    assert model_router.choose("text", ["best", "next"]) == "next"
+
+
+def test_disabled_router_returns_first_candidate(monkeypatch):
+    _reset(monkeypatch)
+    monkeypatch.setattr(settings, "ROUTER_ENABLED", False)
+    _feed("best", 9.0)
+    assert model_router.choose("text", ["best", "next"]) == "best"
+    assert model_router.choose("text", []) is None
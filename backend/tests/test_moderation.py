@@ -0,0 +1,36 @@
+from app.services import moderation
+
+
+def _scan(chunks, words):
+    scanner = moderation.StreamScanner(moderation.Matcher(words))
+    out = "".join(scanner.feed(c) for c in chunks) + scanner.flush()
+    return out, scanner.blocked
+
+
+def test_match_across_chunk_boundary_is_blocked():
+    out, blocked = _scan(["this is forb", "idden text"], ["forbidden"])
+    assert blocked == "forbidden"
+    assert "forb" not in out
+    assert out == "this is "
+
+
+def test_partial_prefix_is_held_then_released():
+    scanner = moderation.StreamScanner(moderation.Matcher(["forbidden"]))
+    assert scanner.feed("a for") == "a "
+    assert scanner.feed("m letter") == "form letter"
+    assert scanner.flush() == ""
+    assert scanner.blocked is None
+
+
+def test_suffix_word_inside_longer_partial_match():
+    # "he" ends inside the partial match "she" via the failure link
+    out, blocked = _scan(["s", "h", "e"], ["she", "he"])
+    assert blocked == "she"
+    assert out == ""
+    assert moderation.Matcher(["he"]).find("usHer") == "he"
+
+
+def test_empty_block_list_passes_text_through():
+    out, blocked = _scan(["anything", " goes"], [])
+    assert out == "anything goes"
+    assert blocked is None
@@ -0,0 +1,48 @@
+import asyncio
+
+from app.core.config import settings
+from app.services import response_cache
+
+
+def _reset(monkeypatch, ttl_s=60.0):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SEMANTIC_ENABLED", False)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_TTL_S", ttl_s)
+    monkeypatch.setattr(response_cache, "_exact", response_cache._LRU(100))
+    monkeypatch.setattr(response_cache, "_semantic", response_cache._LRU(100))
+
+
+def _lookup(message, scope, history=None, model="m"):
+    return asyncio.run(response_cache.lookup(message, history, model, {"temperature": 0.2}, scope=scope))
+
+
+def test_hit_requires_same_scope_history_and_model(monkeypatch):
+    _reset(monkeypatch)
+    history = [{"role": "user", "content": "hi"}, {"role": "model", "content": "hello"}]
+    probe = _lookup("What is RAG?", "user:a", history)
+    assert probe.hit is None
+    response_cache.store(probe, "answer", "m")
+
+    # Whitespace/case differences and the trailing user turn do not change the key
+    again = _lookup("  what is   rag? ", "user:a", history + [{"role": "user", "content": "What is RAG?"}])
+    assert again.hit == ("answer", "m") and again.tier == "exact"
+
+    assert _lookup("What is RAG?", "user:b", history).hit is None
+    assert _lookup("What is RAG?", "user:a", history[:1]).hit is None
+    assert _lookup("What is RAG?", "user:a", history, model="other").hit is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    _reset(monkeypatch, ttl_s=0.0)
+    probe = _lookup("question", "global")
+    response_cache.store(probe, "answer", "m")
+    assert _lookup("question", "global").hit is None
+    assert len(response_cache._exact) == 0
+
+
+def test_scope_follows_setting(monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SCOPE", "conversation")
+    assert response_cache.scope_for("u1", "c1") == "conv:c1"
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SCOPE", "user")
+    assert response_cache.scope_for("u1", "c1") == "user:u1"
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SCOPE", "global")
+    assert response_cache.scope_for("u1", "c1") == "global"
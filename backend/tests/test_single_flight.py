@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from app.services import single_flight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["result"]
+
+    async def run():
+        key = single_flight.fingerprint("m", "same question")
+        other = single_flight.fingerprint("m", "different question")
+        return await asyncio.gather(
+            single_flight.do("t", key, fn),
+            single_flight.do("t", key, fn),
+            single_flight.do("t", key, fn),
+            single_flight.do("t", other, fn),
+        )
+
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert results == [["result"]] * 4
+    assert not single_flight._inflight
+
+
+def test_leader_error_reaches_every_waiter():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(single_flight.do("t", "k", fn) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) and str(r) == "upstream down" for r in results)
+    assert not single_flight._inflight
+
+
+def test_waiter_runs_the_call_itself_when_the_leader_is_cancelled():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return len(calls)
+
+    async def run():
+        leader = asyncio.ensure_future(single_flight.do("t", "k", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(single_flight.do("t", "k", fn))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(run()) == 2
+    assert len(calls) == 2
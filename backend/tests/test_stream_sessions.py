@@ -0,0 +1,97 @@
+import asyncio
+
+from app.core.config import settings
+from app.services import stream_sessions
+
+
+class _Result:
+    def __init__(self, matched, upserted_id=None):
+        self.matched_count = matched
+        self.upserted_id = upserted_id
+
+
+class _Checkpoints:
+    def __init__(self):
+        self.docs = {}
+        self.writes = []
+
+    async def update_one(self, query, update, upsert=False):
+        self.writes.append(update)
+        doc = self.docs.get(query["_id"])
+        if doc is None or ("length" in query and doc["length"] != query["length"]):
+            if doc is not None or not upsert:
+                return _Result(0)
+            doc = self.docs[query["_id"]] = {"_id": query["_id"]}
+            upserted = query["_id"]
+        else:
+            upserted = None
+        for key, value in update.get("$push", {}).items():
+            doc.setdefault(key, []).append(value)
+        doc.update(update.get("$set", {}))
+        return _Result(0 if upserted else 1, upserted)
+
+    async def find_one(self, query):
+        return self.docs.get(query["_id"])
+
+
+class _Db:
+    def __init__(self):
+        self.stream_checkpoints = _Checkpoints()
+
+
+def _setup(monkeypatch):
+    db = _Db()
+    monkeypatch.setattr(stream_sessions, "get_db", lambda: db)
+    monkeypatch.setattr(stream_sessions, "_sessions", {})
+    monkeypatch.setattr(settings, "STREAM_CHECKPOINT_TOKENS", 2)
+    monkeypatch.setattr(settings, "STREAM_RESUME_GRACE_S", 0.0)
+    return db
+
+
+async def _chunks(n, gate=None):
+    for i in range(n):
+        if gate is not None and i == 2:
+            await gate.wait()
+        await asyncio.sleep(0)
+        yield f"word{i} "
+
+
+def test_finished_stream_resumes_from_checkpoint(monkeypatch):
+    db = _setup(monkeypatch)
+    finished = []
+
+    async def run():
+        session = stream_sessions.start(_chunks(6), on_finish=finished.append)
+        got = [text async for _eid, text in stream_sessions.follow(session)]
+        await session.checkpoint_task
+        tail = await stream_sessions.checkpoint_tail(session.id, offset=len("word0 "))
+        return session, "".join(got), tail
+
+    session, text, tail = asyncio.run(run())
+    assert text == finished[0] == "".join(f"word{i} " for i in range(6))
+    doc = db.stream_checkpoints.docs[session.id]
+    # Appended in pieces rather than rewritten whole
+    assert len(doc["parts"]) > 1 and "".join(doc["parts"]) == text
+    assert doc["done"] is True and doc["incomplete"] is False
+    assert tail == (stream_sessions.event_id(session.id, len(text)), text[len("word0 "):], True)
+
+
+def test_abandoned_stream_checkpoint_is_marked_incomplete(monkeypatch):
+    db = _setup(monkeypatch)
+
+    async def run():
+        gate = asyncio.Event()
+        session = stream_sessions.start(_chunks(6, gate), on_finish=lambda text: None)
+        follower = stream_sessions.follow(session)
+        await follower.__anext__()
+        # The only client goes away; with no grace period the producer is cancelled
+        await follower.aclose()
+        await asyncio.gather(session.producer, return_exceptions=True)
+        await session.checkpoint_task
+        return session, await stream_sessions.checkpoint_tail(session.id)
+
+    session, tail = asyncio.run(run())
+    doc = db.stream_checkpoints.docs[session.id]
+    assert session.done and not session.finished
+    assert doc["done"] is False and doc["incomplete"] is True
+    assert tail[1] == session.text and tail[2] is False
@@ -0,0 +1,42 @@
+from app.core.config import settings
+from app.services import token_budget
+
+
+def _msg(i, tokens):
+    return {"role": "user", "content": f"m{i}", "tokens": tokens}
+
+
+def test_select_history_keeps_newest_suffix_within_budget():
+    history = [_msg(i, 10) for i in range(5)]
+    # Each message costs 10 + 4 overhead: 3 fit in 42, not 4
+    selected = token_budget.select_history(history, 42)
+    assert [m["content"] for m in selected] == ["m2", "m3", "m4"]
+    assert token_budget.select_history(history, 41) == history[3:]
+
+
+def test_select_history_always_keeps_the_newest_message():
+    history = [_msg(0, 5), _msg(1, 500)]
+    assert token_budget.select_history(history, 100) == [history[1]]
+    assert token_budget.select_history([], 100) == []
+
+
+def test_select_history_respects_max_messages():
+    history = [_msg(i, 1) for i in range(5)]
+    assert token_budget.select_history(history, 1000, max_messages=2) == history[3:]
+
+
+def test_message_tokens_uses_stored_count_or_estimate():
+    assert token_budget.message_tokens({"content": "x" * 400, "tokens": 7}) == 7
+    assert token_budget.message_tokens({"content": "x" * 400}) == 100
+    assert token_budget.message_tokens({"content": "x" * 400, "tokens": -1}) == 100
+    assert token_budget.text_tokens(token_budget.CountedText("x" * 400, 3)) == 3
+
+
+def test_history_token_budget_prefers_longest_model_prefix(monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET_MODELS", "gemini-1.5=100,gemini-1.5-pro=200,bad=x")
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET_LOW", 10)
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET_HIGH", 30)
+    assert token_budget.history_token_budget("gemini-1.5-pro-002", "low") == 200
+    assert token_budget.history_token_budget("gemini-1.5-flash", "high") == 100
+    assert token_budget.history_token_budget("other", "high") == 30
+    assert token_budget.history_token_budget(None, None) == 10
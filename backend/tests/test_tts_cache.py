@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+
+from app.core.config import settings
+from app.services import tts_cache
+
+
+def _restart(monkeypatch, tmp_path, max_bytes):
+    monkeypatch.setattr(settings, "TTS_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "TTS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "TTS_CACHE_MAX_BYTES", max_bytes)
+    monkeypatch.setattr(tts_cache, "_index", type(tts_cache._index)())
+    monkeypatch.setattr(tts_cache, "_pins", {})
+    monkeypatch.setattr(tts_cache, "_doomed", set())
+    monkeypatch.setattr(tts_cache, "_bytes", 0)
+    monkeypatch.setattr(tts_cache, "_loaded", False)
+    monkeypatch.setattr(tts_cache, "_load_lock", None)
+
+
+def _seed(tmp_path, name, size, age_s):
+    path = tmp_path / name[:2] / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    ts = time.time() - age_s
+    os.utime(path, (ts, ts))
+    return path
+
+
+def test_restart_keeps_lru_order_and_evicts_oldest(monkeypatch, tmp_path):
+    old = _seed(tmp_path, "aa_old.mp3", 10, 300)
+    mid = _seed(tmp_path, "bb_mid.mp3", 10, 200)
+    new = _seed(tmp_path, "cc_new.mp3", 10, 100)
+    _restart(monkeypatch, tmp_path, 30)
+
+    async def run():
+        await tts_cache._ensure_loaded()
+        assert list(tts_cache._index) == [old.name, mid.name, new.name]
+        await tts_cache.store("dd_fresh", "audio/mpeg", b"y" * 10)
+
+    asyncio.run(run())
+    assert not old.exists()
+    assert mid.exists() and new.exists()
+    assert list(tts_cache._index) == [mid.name, new.name, "dd_fresh.mp3"]
+
+
+def test_lookup_hit_is_evicted_last(monkeypatch, tmp_path):
+    old = _seed(tmp_path, "aa_old.mp3", 10, 300)
+    mid = _seed(tmp_path, "bb_mid.mp3", 10, 200)
+    _restart(monkeypatch, tmp_path, 20)
+
+    async def run():
+        assert await tts_cache.lookup("aa_old", "audio/mpeg") == old
+        await tts_cache.store("cc_fresh", "audio/mpeg", b"y" * 10)
+
+    asyncio.run(run())
+    assert old.exists()
+    assert not mid.exists()
+
+
+def test_open_entry_survives_eviction(monkeypatch, tmp_path):
+    _seed(tmp_path, "aa_old.mp3", 10, 300)
+    _restart(monkeypatch, tmp_path, 10)
+
+    async def run():
+        f = await tts_cache.open_entry("aa_old", "audio/mpeg")
+        # Evicts aa_old while the caller still holds it open
+        await tts_cache.store("bb_new", "audio/mpeg", b"y" * 10)
+        with f:
+            return f.read()
+
+    assert asyncio.run(run()) == b"x" * 10
+    assert not (tmp_path / "aa" / "aa_old.mp3").exists()
+
+
+def test_open_entry_missing_file_is_a_miss(monkeypatch, tmp_path):
+    path = _seed(tmp_path, "aa_old.mp3", 10, 300)
+    _restart(monkeypatch, tmp_path, 100)
+
+    async def run():
+        await tts_cache._ensure_loaded()
+        path.unlink()
+        return await tts_cache.open_entry("aa_old", "audio/mpeg")
+
+    assert asyncio.run(run()) is None
+    assert "aa_old.mp3" not in tts_cache._index
+
+
+def test_writer_commits_complete_stream_and_drops_oversized(monkeypatch, tmp_path):
+    _restart(monkeypatch, tmp_path, 25)
+
+    async def run():
+        w = await tts_cache.writer("aa_ok", "audio/mpeg")
+        for chunk in (b"a" * 10, b"b" * 10):
+            await w.write(chunk)
+        await w.commit()
+
+        big = await tts_cache.writer("bb_big", "audio/mpeg")
+        for chunk in (b"c" * 20, b"d" * 20):
+            await big.write(chunk)
+        await big.commit()
+
+        partial = await tts_cache.writer("cc_partial", "audio/mpeg")
+        await partial.write(b"e" * 5)
+        await partial.abort()
+
+    asyncio.run(run())
+    assert (tmp_path / "aa" / "aa_ok.mp3").read_bytes() == b"a" * 10 + b"b" * 10
+    assert list(tts_cache._index) == ["aa_ok.mp3"]
+    assert sorted(p.name for p in tmp_path.glob("*/*")) == ["aa_ok.mp3"]
+
+
+def test_pinned_entry_is_unlinked_only_after_release(monkeypatch, tmp_path):
+    old = _seed(tmp_path, "aa_old.mp3", 10, 300)
+    _restart(monkeypatch, tmp_path, 10)
+
+    async def run():
+        path = await tts_cache.acquire("aa_old", "audio/mpeg")
+        await tts_cache.store("bb_new", "audio/mpeg", b"y" * 10)
+        assert path.exists() and "aa_old.mp3" not in tts_cache._index
+        await tts_cache.release(path)
+
+    asyncio.run(run())
+    assert not old.exists()
+    assert list(tts_cache._index) == ["bb_new.mp3"]
@@ -0,0 +1,42 @@
+from app.services import voice_pipeline
+
+
+def test_cut_splits_complete_sentences_and_keeps_remainder():
+    done, rest = voice_pipeline._cut("First one here. Second one! Third is parti", 5, 200)
+    assert done == ["First one here.", "Second one!"]
+    assert rest == "Third is parti"
+
+
+def test_cut_merges_short_sentences():
+    done, rest = voice_pipeline._cut("Sure. Okay. That works fine. ", 10, 200)
+    assert done == ["Sure. Okay.", "That works fine."]
+    assert rest == ""
+
+
+def test_cut_handles_closing_quotes_and_line_breaks():
+    done, rest = voice_pipeline._cut('He said "stop." Then left\nNext', 1, 200)
+    assert done == ['He said "stop."', "Then left"]
+    assert rest == "Next"
+
+
+def test_cut_breaks_long_runs_at_a_space():
+    done, rest = voice_pipeline._cut("aaaa bbbb cccc dddd", 1, 10)
+    assert done == ["aaaa bbbb"]
+    assert rest == "cccc dddd"
+    done, rest = voice_pipeline._cut("x" * 25, 1, 10)
+    assert done == ["x" * 10, "x" * 10]
+    assert rest == "x" * 5
+
+
+def test_split_text_packs_paragraphs_up_to_the_limit():
+    text = "One.\n\nTwo.\n\n" + "Three is longer."
+    assert voice_pipeline.split_text(text, 100) == ["One.\n\nTwo.\n\nThree is longer."]
+    assert voice_pipeline.split_text(text, 16) == ["One.\n\nTwo.", "Three is longer."]
+
+
+def test_split_text_cuts_long_paragraphs_at_sentences():
+    para = "Alpha beta. Gamma delta. Epsilon zeta."
+    chunks = voice_pipeline.split_text(para, 25)
+    assert chunks == ["Alpha beta. Gamma delta.", "Epsilon zeta."]
+    assert all(len(c) <= 25 for c in chunks)
+    assert voice_pipeline.split_text("  \n\n ", 25) == []
@@ -0,0 +1,84 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from app.core.config import settings
+from app.repositories import chat_repo
+from app.services import write_behind
+
+
+class _Messages:
+    def __init__(self, fail_inserts=0, store_before_failing=False):
+        self.docs = {}
+        self.fail_inserts = fail_inserts
+        self.store_before_failing = store_before_failing
+
+    async def insert_many(self, docs, ordered=True):
+        assert not ordered
+        if self.fail_inserts:
+            self.fail_inserts -= 1
+            if self.store_before_failing:
+                self.docs[docs[0]["_id"]] = docs[0]
+            raise AutoReconnect("connection reset")
+        dupes = [{"index": i, "code": 11000} for i, d in enumerate(docs) if d["_id"] in self.docs]
+        for d in docs:
+            self.docs.setdefault(d["_id"], d)
+        if dupes:
+            raise BulkWriteError({"writeErrors": dupes, "writeConcernErrors": []})
+
+
+class _Conversations:
+    def __init__(self, fail_updates=0):
+        self.fail_updates = fail_updates
+        self.updates = 0
+
+    async def update_one(self, query, update):
+        if self.fail_updates:
+            self.fail_updates -= 1
+            raise AutoReconnect("connection reset")
+        self.updates += 1
+
+
+class _Db:
+    def __init__(self, messages, conversations):
+        self.messages = messages
+        self.conversations = conversations
+
+
+def _run_writes(monkeypatch, tmp_path, db):
+    monkeypatch.setattr(chat_repo, "get_db", lambda: db)
+    monkeypatch.setattr(chat_repo, "_USE_MEM", False)
+    monkeypatch.setattr(settings, "LOCAL_ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(settings, "WRITE_BEHIND_RETRY_BASE_S", 0.01)
+    monkeypatch.setattr(settings, "WRITE_BEHIND_FLUSH_INTERVAL_S", 0.0)
+    monkeypatch.setattr(settings, "WRITE_BEHIND_DRAIN_TIMEOUT_S", 5.0)
+    conv_id = "650000000000000000000001"
+
+    async def run():
+        await write_behind.start()
+        write_behind.enqueue_message(conv_id, "user", "hi")
+        write_behind.enqueue_message(conv_id, "assistant", "hello")
+        await write_behind.stop()
+
+    asyncio.run(run())
+    assert not chat_repo._USE_MEM
+    assert write_behind.depth() == 0
+    docs = sorted(db.messages.docs.values(), key=lambda d: d["created_at"])
+    return [(d["role"], d["content"]) for d in docs]
+
+
+def test_failed_insert_is_retried_without_memory_fallback(monkeypatch, tmp_path):
+    db = _Db(_Messages(fail_inserts=1), _Conversations())
+    assert _run_writes(monkeypatch, tmp_path, db) == [("user", "hi"), ("assistant", "hello")]
+    assert db.conversations.updates == 1
+
+
+def test_partial_insert_retry_stores_each_message_once(monkeypatch, tmp_path):
+    db = _Db(_Messages(fail_inserts=1, store_before_failing=True), _Conversations())
+    assert _run_writes(monkeypatch, tmp_path, db) == [("user", "hi"), ("assistant", "hello")]
+
+
+def test_failed_update_after_insert_does_not_duplicate(monkeypatch, tmp_path):
+    db = _Db(_Messages(), _Conversations(fail_updates=1))
+    assert _run_writes(monkeypatch, tmp_path, db) == [("user", "hi"), ("assistant", "hello")]
+    assert db.conversations.updates == 1